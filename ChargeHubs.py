@@ -6,6 +6,7 @@ import traci
 class ChargeHubs:
     """Static Class capturing the charge hub locations and functions to find the nearest hub"""
     chargeHubLocations = {}
+    offStation = {}         # hub edge -> position on its first lane clear of every charging station, None if there's no room - read when first needed
 
     def __init__(self):
         self.locateChargeHubs()
@@ -48,6 +49,22 @@ class ChargeHubs:
             ChargeHubs.chargeHubLocations[hub] = x, y, edge, pos
             traci.route.add(edge, [edge])                         # create a route comprising the edge where the hub resides - to allow add of dummyEVs for drone batteries
 
+    @staticmethod
+    def offStationPosition(edge):
+        """a position on the first lane of a hub edge, with room for a pair of dummy EVs, outside all the charging stations on it
+            - where pooled dummy EVs park while no drone is using them, so they add nothing to the charging station output"""
+        if edge not in ChargeHubs.offStation:
+            lane = edge + "_0"
+            spans = [(traci.chargingstation.getStartPos(hub), traci.chargingstation.getEndPos(hub))
+                     for hub in traci.chargingstation.getIDList() if traci.chargingstation.getLaneID(hub) == lane]
+            length = traci.lane.getLength(lane)
+            ChargeHubs.offStation[edge] = None
+            for pos in [end + 1.0 for start, end in spans] + [start - 1.5 for start, end in spans]:
+                if 0.0 <= pos and pos + 1.0 <= length and all(pos + 0.5 < start or pos > end for start, end in spans):
+                    ChargeHubs.offStation[edge] = pos
+                    break
+        return ChargeHubs.offStation[edge]
+
     @staticmethod
     def nearestHubLocation(pos):
         """Helper function"""
@@ -0,0 +1,125 @@
+"""Checkpoint and restore of a run - SUMO's saved state with a snapshot of the model, so variants can fork from a shared warm state"""
+import os
+import pickle
+import random
+import sys
+import traci
+import traci.constants as tc
+
+from GlobalClasses import GlobalClasses as GG
+from EV import EV
+from Drone import Drone
+from DummyEVPool import DummyEVPool
+from IntervalStats import IntervalStats
+from Metrics import Metrics
+from TraciBuffer import TraciBuffer
+from TraciCache import TraciCache
+
+
+class Checkpoint:
+    """Static class writing and restoring checkpoints. A checkpoint is a directory holding SUMO's state (with its random number
+        generators) and a pickle of the control centre, the EV and drone shadows, the class counters and python's random state.
+        A restored run takes its options from its own runstring - so a variant can change the weights, radius, drones etc -
+        only --fleet and --dummyPool, which change what the drone shadows hold, must be the same as for the run that wrote the checkpoint"""
+    path = None             # directory to write the checkpoint to - None for no checkpoint
+    atStep = 0              # step after which the checkpoint is written
+    restorePath = None      # checkpoint the run started from - None for a run from the beginning
+    snapshot = None         # the model snapshot being restored, read before SUMO starts
+    stateFile = "state.xml.gz"
+    modelFile = "model.pickle"
+
+    # the state of the simulation and classes - their other attributes are set from the runstring
+    simulationState = ("timeStep", "now", "EVs", "activeEVs", "waitingEVs", "retiredEVs", "activeOrder")
+    classState = ((EV, ("evCount", "evChargeSteps", "evChargeGap", "evChargeCount", "colours", "vTypes", "loadedChecked", "loadedCalls")),
+                  (Drone, ("droneIDCount", "dummyEVCreated", "poiWrites", "poiWritesSaved", "scheduledSteps", "materialisations")),
+                  (DummyEVPool, ("idle", "poolHubs", "maxWh", "addedSteps", "pairs", "inserts", "removes", "reuses", "traciCalls")),
+                  (TraciBuffer, ("written", "writes", "flushed")),
+                  (TraciCache, ("reads", "hits")))
+    ccSettings = ("wEnergy", "wUrgency", "proximityRadius", "maxDrones", "fullChargeTolerance", "globalCharge", "droneType", "runRecord")
+    ggSettings = ("droneKmPerHr", "useRandom", "onlyChargeOnce", "modelRendezvous")     # kept so a fork can say what it changed
+
+    @staticmethod
+    def settings(fleet):
+        """the options that must be the same for a checkpoint to be restored"""
+        return {"fleet": fleet is not None, "dummyPool": DummyEVPool.pooling}
+
+    @staticmethod
+    def load(path, fleet):
+        """read the model snapshot - before SUMO starts, so a checkpoint that can't be restored fails early"""
+        try:
+            if not os.path.isfile(os.path.join(path, Checkpoint.stateFile)):
+                raise OSError("no SUMO state " + Checkpoint.stateFile)
+            with open(os.path.join(path, Checkpoint.modelFile), "rb") as file:
+                snapshot = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+            print(" --restore %s: %s" % (path, e))
+            sys.exit(1)
+        mismatched = [name for name, value in Checkpoint.settings(fleet).items() if snapshot["settings"][name] != value]
+        if mismatched:
+            print(" --restore %s: the checkpoint was written %s" % (path, ", ".join(("with --" if snapshot["settings"][name] else "without --") + name for name in mismatched)))
+            sys.exit(1)
+        Checkpoint.restorePath = path
+        Checkpoint.snapshot = snapshot
+
+    @staticmethod
+    def restore(cc, ss):
+        """replace the state of the new run with the checkpoint - SUMO's vehicles and time, then our shadows of them"""
+        snapshot = Checkpoint.snapshot
+        traci.simulation.loadState(os.path.join(Checkpoint.restorePath, Checkpoint.stateFile))
+        TraciBuffer.pending.clear()
+        TraciCache.clear()
+        DummyEVPool.stateTypes = {vType for vType in traci.vehicletype.getIDList() if vType.startswith("Drone@")}
+
+        for name, value in snapshot["simulation"].items():
+            setattr(ss, name, value)
+        for cls, names in Checkpoint.classState:
+            for name, value in snapshot["classes"][cls.__name__].items():
+                setattr(cls, name, value)
+        vars(cc).update(snapshot["cc"])         # replaces the drones made as the new run started
+        GG.fleet = snapshot["fleet"]
+        random.setstate(snapshot["random"])
+        for name, value in snapshot["gg"].items():
+            if getattr(GG, name) != value:
+                print(" restored with %s %s (checkpoint %s)" % (name, getattr(GG, name), value), file=sys.stderr)
+
+        # SUMO's state has the vehicles but not the POIs we added, or our subscriptions
+        pois = set(traci.poi.getIDList())
+        for drone in cc.drones:
+            x, y = drone.myPosition
+            if drone.myID in pois:
+                traci.poi.setPosition(drone.myID, x, y)
+            else:
+                traci.poi.add(drone.myID, x, y, color=drone.myDt.droneColour, layer=250, imgFile=drone.myDt.droneImageFile,
+                              width=drone.myDt.droneWidth, height=drone.myDt.droneHeight)
+        if cc.contextSubscribing:
+            for ev in cc.contextEVs:
+                traci.vehicle.subscribeContext(ev.getID(), tc.CMD_GET_VEHICLE_VARIABLE, cc.proximityRadius, (tc.VAR_POSITION,))
+        else:
+            cc.contextEVs.clear()
+
+        if IntervalStats.sink is not None:
+            IntervalStats.resume(ss.timeStep, cc.drones)
+        Metrics.publishedSteps = ss.timeStep
+        print(" restored checkpoint %s at %.1fs" % (Checkpoint.restorePath, traci.simulation.getTime()), file=sys.stderr)
+
+    @staticmethod
+    def save(cc, ss):
+        """write SUMO's state and the model snapshot - between steps, once the buffered writes have been sent"""
+        os.makedirs(Checkpoint.path, exist_ok=True)
+        traci.simulation.saveState(os.path.join(Checkpoint.path, Checkpoint.stateFile))
+        snapshot = {"settings": Checkpoint.settings(GG.fleet),
+                    "simulation": {name: getattr(ss, name) for name in Checkpoint.simulationState},
+                    "classes": {cls.__name__: {name: getattr(cls, name) for name in names} for cls, names in Checkpoint.classState},
+                    "cc": {name: value for name, value in vars(cc).items() if name not in Checkpoint.ccSettings},
+                    "fleet": GG.fleet,
+                    "gg": {name: getattr(GG, name) for name in Checkpoint.ggSettings},
+                    "random": random.getstate()}
+        with open(os.path.join(Checkpoint.path, Checkpoint.modelFile), "wb") as file:
+            pickle.dump(snapshot, file, pickle.HIGHEST_PROTOCOL)
+        print("\n checkpoint at %.1fs written to %s" % (traci.simulation.getTime(), Checkpoint.path), file=sys.stderr)
+
+    @staticmethod
+    def update(cc, ss):
+        """called at the end of each step - write the checkpoint when its step has been simulated"""
+        if Checkpoint.path is not None and ss.timeStep == Checkpoint.atStep:
+            Checkpoint.save(cc, ss)
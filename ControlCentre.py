@@ -1,19 +1,39 @@
 """Module managing allocation of Drones to EVs and control (parking, charging) of Drones when not assigned to EVs"""
 import sys
 import math
+import heapq
+import time
 from datetime import datetime
 import traci
+import traci.constants as tc
 
 from GlobalClasses import GlobalClasses as GG
 from EV import EV
 from Drone import Drone
+from DummyEVPool import DummyEVPool
+from LatencyHistogram import LatencyHistogram
+from IntervalStats import IntervalStats
+from RunSummary import RunSummary
+from ResultCache import ResultCache
+from Checkpoint import Checkpoint
+from TraciBuffer import TraciBuffer
+from TraciCache import TraciCache
 
 class ControlCentre:
     """Main class receiving requests from EV's and notifications from Drones and EV's when charge completes or Drone is out of battery"""
+    # the states in which drones are managed (parked/charged) by the control centre, rather than an EV
+    parkingStates = (Drone.DroneState.FLYINGTOPARK, Drone.DroneState.FLYINGTOCHARGE, Drone.DroneState.PARKED, Drone.DroneState.CHARGINGDRONE)
+    # when True requesting EVs carry a SUMO context subscription, so the positions of vehicles within proximityRadius come back with each step
+    contextSubscribing = False
+    controlPeriod = 1       # steps between allocation passes - drones and EVs are still stepped every step
+    # the stages of a charge request we histogram the latency of, in summary order
+    latencyStages = ("request to allocation", "allocation to rendezvous", "rendezvous to charging", "allocation to charging",
+                     "charging to completion", "charging to break off", "end to end")
 
     def __init__(self, wEnergy, wUrgency, proximityRadius, maxDrones, fullChargeTolerance=0, globalCharge=0.0, droneType="ehang184"):
         self.wEnergy = float(wEnergy)
         self.wUrgency = float(wUrgency)
+        EV.estimatingRange = self.wUrgency > 0.0     # EVs only need to estimate their range if we weight urgency
         self.proximityRadius = proximityRadius
         self.maxDrones = maxDrones
         self.fullChargeTolerance = fullChargeTolerance
@@ -25,13 +45,39 @@ class ControlCentre:
         self.allocatedDrone = {}
         self.freeDrones = set()
         self.needChargeDrones = set()
+        self.drones = []            # every drone, in order of creation
+        self.dronesByState = {state: {} for state in Drone.DroneState}     # state -> {drone: None} ie insertion ordered sets, dormant drones are left out
+        self.droneStateCounts = {state: 0 for state in Drone.DroneState}   # state -> no of drones, including dormant drones
         self.droneType = droneType
 
         self.spawnedDrones = 0
         self.insertedDummies = 0
 
+        self.edgeLengths = {}       # edge -> length of its first lane - what we take as the edge length along a route
+        self.junctionLengths = {}   # (edge, next edge) -> driving distance across the junction between them
+        self.evRoutes = {}          # ev -> (routeID, edges, distance along the route to the start of each edge) - re-read when the route ID changes ie a reroute
+        self.evRoutePositions = {}  # ev -> (timeStep, route index, lane position, road, allowed speed) as read in that step
+
+        self.droneCalendar = []     # heap of (step, drone) - when to wake dormant drones
+        self.parkingStep = 0        # the last step in which we updated the drones we manage
+
+        self.contextEVs = set()     # requesting EVs with a context subscription
+        self.neighbourSearches = 0  # calls of getNeighboursNeedingCharge and the time spent in them
+        self.neighbourSecs = 0.0
+
+        self.requestSteps = {}      # ev -> step it requested charge, for the wait until a drone is allocated
+        self.allocationWaitSteps = 0
+        self.allocationPasses = 0   # passes of scoring/allocation and the time spent in them
+        self.allocationSecs = 0.0
+
+        # ev -> [first request, request, allocation, rendezvous, charge start] steps of its current charge request - the first request
+        # is kept when a drone breaks off, so end to end runs from the EV first asking for charge to its charge completing
+        self.lifecycles = {}
+        self.latencies = {stage: LatencyHistogram() for stage in ControlCentre.latencyStages}
+
         self.misMatch = 0
         self.allocatedCount = 0
+        self.runRecord = None       # the summary record, made by printDroneStatistics for RunSummary and ResultCache
 
 
     def allocate(self, drone, ev):
@@ -39,6 +85,9 @@ class ControlCentre:
         self.allocatedEV[ev] = drone
         self.allocatedDrone[drone] = ev
         self.allocatedCount = self.allocatedCount + 1
+        self.allocationWaitSteps += GG.ss.timeStep - self.requestSteps.pop(ev, GG.ss.timeStep)
+        self.lifecycleStage(ev, 2, 1, "request to allocation")
+        IntervalStats.allocations += 1
         if GG.modelRendezvous:
             ev.allocate(drone, self.findRendezvousXY(ev, drone))
         else:
@@ -66,7 +115,7 @@ class ControlCentre:
             for ev in dict(sorted(urgencyList.items(), key=lambda item: item[1])):
                 evPos = ev.getMyPosition()
                 (x, y, e, p), hubDistance = GG.ch.nearestHubLocation(evPos)
-                drone = Drone((x, y), "", None)
+                drone = self.newDrone((x, y))
                 self.spawnedDrones += 1
                 self.allocate(drone, ev)
                 self.misMatch = self.misMatch + urgencyPosition[ev]
@@ -94,7 +143,7 @@ class ControlCentre:
                         self.freeDrones.remove(nearestDrone)
                     elif nd > 0:
                         (x, y, e, p), hubDistance = GG.ch.nearestHubLocation(evPos)
-                        drone = Drone((x, y),"", None)
+                        drone = self.newDrone((x, y))
                         self.spawnedDrones += 1
                         self.allocate(drone, ev)
                         self.misMatch = self.misMatch + urgencyPosition[ev]
@@ -109,7 +158,7 @@ class ControlCentre:
             for ev in dict(sorted(urgencyList.items(), key=lambda item: item[1])):
                 evPos = ev.getMyPosition()
                 (x, y, e, p), hubDistance = GG.ch.nearestHubLocation(evPos)
-                drone = Drone((x, y), "", None)
+                drone = self.newDrone((x, y))
                 self.spawnedDrones += 1
                 self.allocate(drone, ev)
                 self.misMatch = self.misMatch + urgencyPosition[ev]
@@ -144,15 +193,9 @@ class ControlCentre:
                 hub, hubDistance = GG.ch.findNearestHub(evPos[0], evPos[1])
                 # hub, hubDistance = GG.ch.findNearestHubDriving(evID)
 
-                evRange = 10000.0         # arbitrary default to make this visible outside if statement
                 urgencyPosition[ev] = 0
-                if self.wUrgency > 0.0:  # if we have an ugency weight then we need to calculate the range
-                    distance = float(traci.vehicle.getDistance(evID))
-                    if distance > 10000:  # can compute real range after we've been driving for a while - arbitrary 10km
-                        mWh = distance / float(traci.vehicle.getParameter(evID, "device.battery.totalEnergyConsumed"))
-                        evRange = float(traci.vehicle.getParameter(evID, "device.battery.actualBatteryCapacity")) * mWh / 1000.
-                    else:  #  otherwise just a guesstimate
-                        evRange = float(traci.vehicle.getParameter(evID, "device.battery.actualBatteryCapacity")) * ev.getMyKmPerWh()
+                if self.wUrgency > 0.0:  # if we have an ugency weight then we need the range
+                    evRange = ev.getMyRange()
                     if evRange <= 0.0:    #  zero means battery flat!
                         evRange = 1.0
                     urgency = hubDistance/evRange   # we want most urgent to have lowest value - to be compatible with proximity (lowest proximity = nearest.
@@ -165,7 +208,10 @@ class ControlCentre:
                     urgencyList[ev] = 0.0
 
                 if self.wEnergy > 0.0:            # We have a weight so need to calculate proximity
+                    start = time.perf_counter()
                     neighbours, meanDist = self.getNeighboursNeedingCharge(ev, firstCall)
+                    self.neighbourSecs += time.perf_counter() - start
+                    self.neighbourSearches += 1
                     firstCall = False              # getneighbours will have set position for all evs
 
                     # find distance for nearest drone to this eV - usually only one drone so will be the one allocated
@@ -218,11 +264,12 @@ class ControlCentre:
         if self.fullChargeTolerance <= 0:    # don't care whether it will complete
             return True
 
-        evID = ev.getID()
-        evRoute = traci.vehicle.getRoute(evID)
-        lastEdge = evRoute[len(evRoute)-1]
-        dDist = traci.vehicle.getDrivingDistance(evID,lastEdge,0) # get distance to start of last edge in route (length of edge "ignored"as tolerance)
-        evSpeed = 0.9 * traci.vehicle.getAllowedSpeed(evID)       # use same speed estimate as in find rendezvousxy
+        (evRoute, routeDistances), idx, lanePosition, road, allowedSpeed = self.getRoutePosition(ev)
+        if road != evRoute[idx]:            # on a junction, so measure from the start of the next edge
+            dDist = routeDistances[-1] - routeDistances[min(idx + 1, len(evRoute) - 1)]
+        else:
+            dDist = routeDistances[-1] - routeDistances[idx] - lanePosition    # distance to start of last edge in route (length of edge "ignored"as tolerance)
+        evSpeed = 0.9 * allowedSpeed        # use same speed estimate as in find rendezvousxy
         availableChargeTime = (dDist/evSpeed) - self.fullChargeTolerance
         requestedWh = self.requests[ev]
         possibleCharge = Drone.d0Type.WhEVChargeRatePerTimeStep * availableChargeTime
@@ -230,22 +277,19 @@ class ControlCentre:
         return  possibleCharge > requestedWh
 
 
-    def findEdgePos(self, evID, deltaPos):
+    def findEdgePos(self, ev, deltaPos):
         """work out the edge and position of the EV, when it is deltaPos metres along the route from the current position
             to give us an approximation to the rendezvous position
         """
         jnDelta = 150          # no of travel metres 'lost' by vehicle crossing a junction, found by testing against random grid  (ie allowance for vehicle slowing/accelerating)
         # find route and position of vehicle along the route - (this will always give us an edge)
-        evRoute = traci.vehicle.getRoute(evID)
-        idx = traci.vehicle.getRouteIndex(evID)
+        (evRoute, routeDistances), idx, lanePosition, road, allowedSpeed = self.getRoutePosition(ev)
         edge = evRoute[idx]
-        lanePosition = traci.vehicle.getLanePosition(evID)
         if deltaPos < 0:
             print("oops invalid call to findEdgePos:", deltaPos)
             deltaPos = 0
         # whilst we have the edge from above the vehicle could actually be on a junction which messes up the edge to edge calculation
-        # so we get current road ID which can be a junction and if it is then skip along the route to the next edge
-        road = traci.vehicle.getRoadID(evID)
+        # so we check the current road ID which can be a junction and if it is then skip along the route to the next edge
         if road != edge:       # ev is on a junction, set to start of next edge
           idx += 1
           edge = evRoute[idx]
@@ -253,14 +297,14 @@ class ControlCentre:
 
         # 'travel' along edges on route until we've gone  deltaPos metres
         newEVPosition = lanePosition + deltaPos
-        laneLength = traci.lane.getLength(edge + '_0')
+        laneLength = self.getEdgeLength(edge)
         while newEVPosition > laneLength + jnDelta:
             newEVPosition -= (laneLength + jnDelta)    # subtract jnDelta as the penalty in distance travelled, in the total travel time, for each junction
             idx += 1
             if idx >= len(evRoute):                 # rv point is after end of route - so we can't charge
                 return evRoute[idx-1], laneLength, False   # set to end of route
             edge = evRoute[idx]
-            laneLength = traci.lane.getLength(edge + '_0')
+            laneLength = self.getEdgeLength(edge)
 
         newEVPosition = min(newEVPosition, laneLength)
 
@@ -271,9 +315,8 @@ class ControlCentre:
               apply a factor of 90% to allow for acceleration/deceleration/% of time not at allowed speed
            algorithm from https://www.codeproject.com/Articles/990452/Interception-of-Two-Moving-Objects-in-D-Space
         """
-        evID = ev.getID()         # needed for Traci calls
         # assume speed on current edge is that for subsequent edges
-        evSpeed = 0.9 * traci.vehicle.getAllowedSpeed(evID)
+        evSpeed = 0.9 * self.getRoutePosition(ev)[4]
 
         # work out how long it takes drone to fly to ev
         posEV = ev.getMyPosition()
@@ -283,7 +326,7 @@ class ControlCentre:
         # how far vehicle can travel in same time
         evCrowFlies = evSpeed * crowFlies
         # where on the road that distance is
-        vEdge, vPos, valid = self.findEdgePos(evID, evCrowFlies)
+        vEdge, vPos, valid = self.findEdgePos(ev, evCrowFlies)
         if valid:
             posRV = traci.simulation.convert2D(vEdge, vPos)        # get the x, y position after evCrowFlies metres
             # compute the velocity vector
@@ -304,7 +347,7 @@ class ControlCentre:
             else:  # one is -ve so take the maximum
                 interceptDistance = max(t1, t2) * evSpeed
 
-            rendezvousEdge, newEVPosition, valid = self.findEdgePos(evID, interceptDistance)
+            rendezvousEdge, newEVPosition, valid = self.findEdgePos(ev, interceptDistance)
             if valid:       # will normally only fail if drone cannot reach EV under straight line intercept assumptions
                 posRV = traci.simulation.convert2D(rendezvousEdge, newEVPosition)      # get the x, y position after evCrowFlies metres
                 # Algorithm debug lines - show rendezvous point
@@ -315,6 +358,36 @@ class ControlCentre:
         # print(timeStep, ev, drone, evCrowFlies, "fail 2")  'fail' usually because vehicle has left simulation
         return posDrone   # revert to direct intercept
 
+    def droneAwake(self, drone):
+        """a dormant drone is being stepped again, so put it back in the state registry"""
+        self.dronesByState[drone.myState][drone] = None
+
+    def droneStateChanged(self, drone, oldState, newState):
+        """keep the registry of drones by state up to date - called by Drone.setState"""
+        self.dronesByState[oldState].pop(drone, None)
+        if drone.myDormantFrom is None:
+            self.dronesByState[newState][drone] = None
+        self.droneStateCounts[oldState] -= 1
+        self.droneStateCounts[newState] += 1
+        if IntervalStats.sink is not None:
+            IntervalStats.droneStateChanged(drone, GG.ss.timeStep, oldState, newState)
+
+    def getEdgeLength(self, edge):
+        """length of an edge's first lane - read once per edge"""
+        length = self.edgeLengths.get(edge)
+        if length is None:
+            length = traci.lane.getLength(edge + '_0')
+            self.edgeLengths[edge] = length
+        return length
+
+    def getJunctionLength(self, edge, nextEdge):
+        """driving distance from the end of an edge to the start of the next edge on a route - read once per pair"""
+        length = self.junctionLengths.get((edge, nextEdge))
+        if length is None:
+            length = max(0.0, traci.simulation.getDistanceRoad(edge, self.getEdgeLength(edge), nextEdge, 0.0, isDriving=True))
+            self.junctionLengths[edge, nextEdge] = length
+        return length
+
     def getNeighboursNeedingCharge(self, ev, firstCall):
         """find all the ev's that are requesting a charge and compute the mean distance to these
               note calling math.dist which will use sqrt is actually faster than comparing distances to the square
@@ -322,6 +395,8 @@ class ControlCentre:
         """
         neighbours = []
         meanDist = 0.0
+        if ControlCentre.contextSubscribing:
+            return self.getNeighboursInContext(ev, firstCall)
         if firstCall:
             ev.setMyPosition()
         evPos = ev.getMyPosition()
@@ -346,6 +421,72 @@ class ControlCentre:
             meanDist = meanDist / len(neighbours)
         return neighbours, meanDist
 
+    def getNeighboursInContext(self, ev, firstCall):
+        """getNeighboursNeedingCharge from the context subscriptions - SUMO has already found the vehicles within proximityRadius,
+              positions are as at the end of the last step, ie before this step's move, so we don't read them again
+        """
+        if firstCall:
+            for rEV in self.requests:
+                if rEV == ev:               # calcUrgency has just read this one
+                    continue
+                context = traci.vehicle.getContextSubscriptionResults(rEV.getID())
+                if rEV.getID() in context:
+                    rEV.myPosition = context[rEV.getID()][tc.VAR_POSITION]
+                else:                       # only subscribed in this step
+                    rEV.setMyPosition()
+        evPos = ev.getMyPosition()
+
+        neighbours = []
+        meanDist = 0.0
+        for vehID in traci.vehicle.getContextSubscriptionResults(ev.getID()):
+            nEV = GG.ss.EVs.get(vehID)
+            if nEV is None or nEV == ev or nEV not in self.requests:
+                continue
+            xdist = math.dist(evPos, nEV.getMyPosition())
+            if xdist < self.proximityRadius:
+                neighbours.append(nEV)
+                meanDist += xdist
+
+        if meanDist > 0.0:                      # we have at least 1 ev so calculate the actual mean distance
+            meanDist = meanDist / len(neighbours)
+        return neighbours, meanDist
+
+    def getRoutePosition(self, ev):
+        """((route edges, distances to the start of each edge), route index, lane position, road, allowed speed) for an EV
+            - the position is read in one batched call at most once a step, the route only when the EV has been rerouted"""
+        position = self.evRoutePositions.get(ev)
+        if position is None or position[0] != GG.ss.timeStep:
+            evID = ev.getID()
+            traci.vehicle.subscribe(evID, (tc.VAR_ROUTE_ID, tc.VAR_ROUTE_INDEX, tc.VAR_LANEPOSITION, tc.VAR_ROAD_ID, tc.VAR_ALLOWED_SPEED),
+                                    GG.ss.now, GG.ss.now)       # ends with this step
+            values = traci.vehicle.getSubscriptionResults(evID)
+            routeID = values[tc.VAR_ROUTE_ID]
+            if ev not in self.evRoutes or self.evRoutes[ev][0] != routeID:
+                evRoute = traci.vehicle.getRoute(evID)
+                routeDistances = [0.0]
+                for edge, nextEdge in zip(evRoute, evRoute[1:]):
+                    routeDistances.append(routeDistances[-1] + self.getEdgeLength(edge) + self.getJunctionLength(edge, nextEdge))
+                self.evRoutes[ev] = routeID, evRoute, routeDistances
+            position = (GG.ss.timeStep, values[tc.VAR_ROUTE_INDEX], values[tc.VAR_LANEPOSITION], values[tc.VAR_ROAD_ID], values[tc.VAR_ALLOWED_SPEED])
+            self.evRoutePositions[ev] = position
+        return self.evRoutes[ev][1:], *position[1:]
+
+    def lifecycleStage(self, ev, stage, fromStage, name):
+        """an EV's charge request has reached stage (None if it's ended) - add the steps since fromStage to the named histogram"""
+        lifecycle = self.lifecycles.get(ev)
+        if lifecycle is None:
+            return
+        if lifecycle[fromStage] is not None:
+            self.latencies[name].add(GG.ss.timeStep - lifecycle[fromStage])
+        if stage is not None:
+            lifecycle[stage] = GG.ss.timeStep
+
+    def newDrone(self, pos, poi="", dt=None):
+        """create a drone - held in the drone fleet arrays when we are using one"""
+        if GG.fleet is not None:
+            return GG.fleet.newDrone(pos, poi, dt)
+        return Drone(pos, poi, dt)
+
     def notifyDroneState(self, drone):
         """Notification from Drone when charging finished or Drone has broken off the charge/flight"""
         if drone in self.allocatedDrone:
@@ -366,6 +507,11 @@ class ControlCentre:
                 if ev.getID() in self.startChargeEV:
                     charge = (GG.ss.timeStep - self.startChargeEV[ev.getID()]) * drone.myDt.WhEVChargeRatePerTimeStep
                     del self.startChargeEV[ev.getID()]
+                self.lifecycleStage(ev, None, 4, "charging to completion")
+                IntervalStats.completions += 1
+                lifecycle = self.lifecycles.pop(ev, None)
+                if lifecycle is not None:
+                    self.latencies["end to end"].add(GG.ss.timeStep - lifecycle[0])
 
             case EV.EVState.CHARGEREQUESTED:    # just log request
                 pass
@@ -374,11 +520,20 @@ class ControlCentre:
                 if ev.getID() in self.startChargeEV:
                     charge = (GG.ss.timeStep - self.startChargeEV[ev.getID()]) * drone.myDt.WhEVChargeRatePerTimeStep
                     del self.startChargeEV[ev.getID()]
+                self.lifecycleStage(ev, None, 4, "charging to break off")
 
             case EV.EVState.CHARGINGFROMDRONE:      # charge started
                 self.startChargeEV[ev.getID()] = GG.ss.timeStep
+                if GG.modelRendezvous:
+                    self.lifecycleStage(ev, 4, 3, "rendezvous to charging")
+                else:
+                    self.lifecycleStage(ev, 4, 2, "allocation to charging")
 
             case EV.EVState.LEFTSIMULATION:
+                self.evRoutes.pop(ev, None)
+                self.requestSteps.pop(ev, None)
+                self.evRoutePositions.pop(ev, None)
+                self.lifecycles.pop(ev, None)
                 if ev.getID() in self.startChargeEV:
                     if self.startChargeEV[ev.getID()] > 0:
                         if drone is not None:
@@ -402,7 +557,11 @@ class ControlCentre:
             if drone is not None:
                 droneID = drone.getID()
 
-            print("{}\t{}\t{!r}\t{}\t{:.1f}\t{:.1f}".format(GG.ss.timeStep, ev.getID(), evState, droneID, capacity, charge), file=GG.chargeLog)
+            GG.chargeLog.log("{}\t{}\t{!r}\t{}\t{:.1f}\t{:.1f}", GG.ss.timeStep, ev.getID(), evState, droneID, capacity, charge)
+
+    def notifyRendezvous(self, ev):
+        """Notification from EV - its drone has reached the rendezvous point"""
+        self.lifecycleStage(ev, 3, 2, "allocation to rendezvous")
 
     def printDroneStatistics(self, brief, version, runstring):
         """Print out Drone and EV statistics for the complete run"""
@@ -429,7 +588,7 @@ class ControlCentre:
         cMisMatch = float(self.misMatch) / self.allocatedCount
 
         totalSteps = GG.ss.timeStep
-        for drone in self.freeDrones | self.needChargeDrones | set(self.allocatedDrone):
+        for drone in self.drones:
             tmyLifetime             += totalSteps - drone.myCreationTime
             tmyFlyingCount          += drone.myFlyingCount
             tmyOverheadCount        += drone.myOverheadCount
@@ -475,6 +634,18 @@ class ControlCentre:
                 averageChase = 0
 
         timeStamp = datetime.now().isoformat()
+        if RunSummary.path is not None or ResultCache.path is not None:
+            totals = {"steps": GG.ss.timeStep, "drones": self.spawnedDrones, "distanceKm": tDroneDistance, "flyingKWh": tmyFlyingKWh,
+                      "chargingKWh": tmyChargingKWh, "overheadPercent": pOverhead, "chargerFlyingKWh": tmyChargeMeFlyingKWh,
+                      "chargerChargeKWh": tmyChargeMeKWh, "residualFlyingKWh": tmyResidualFlyingKWh, "residualChargeKWh": tmyResidualChargeKWh,
+                      "evs": EV.evCount, "evChargeKWh": EV.evChargeSteps * Drone.d0Type.WhEVChargeRatePerTimeStep/1000.,
+                      "evChargeGapKWh": EV.evChargeGap/(1000. * EV.evCount), "fullCharges": tmyFullCharges, "brokenCharges": tmyBrokenCharges,
+                      "brokenEVCharges": tmyBrokenEVCharges, "misMatch": cMisMatch}
+            if GG.modelRendezvous:
+                totals.update({"chases": tmyChaseCount, "averageChaseSecs": averageChase, "brokenChases": tmyBrokenChaseCount})
+            self.runRecord = self.summaryRecord(timeStamp, version, runstring, totals)
+            if RunSummary.path is not None:
+                RunSummary.write(self.runRecord)
         # all done, dump the distance travelled by the drones and KW used
         print("\t")   #  tidy up after the ....
         if brief:
@@ -518,8 +689,66 @@ class ControlCentre:
                 print("\n\tSuccessful chases: %i\tAverage chase time: %.1fs\tbroken Chases: %i" %
                       (tmyChaseCount, averageChase, tmyBrokenChaseCount))
 
+            if Drone.poiSyncSteps != 1:
+                poiWrites = Drone.poiWrites + Drone.poiWritesSaved
+                if Drone.poiSyncSteps > 1:
+                    poiSync = "every %i steps" % Drone.poiSyncSteps
+                elif Drone.poiSyncSteps == 0:
+                    poiSync = "at state changes"
+                else:
+                    poiSync = "never"
+                if poiWrites > 0:
+                    print("\n\tPOI writes (synced %s):\t%i\tsaved: %i (%.1f%%)" %
+                          (poiSync, Drone.poiWrites, Drone.poiWritesSaved, 100.0 * Drone.poiWritesSaved / poiWrites))
+
+            if Drone.scheduling:
+                print("\n\tDrone updates skipped (scheduled):\t%i\tmaterialised: %i" % (Drone.scheduledSteps, Drone.materialisations))
+
+            if DummyEVPool.inserts > 0:
+                print("\n\tDummy EVs inserted:\t%i\tremoved: %i\tTraCI calls: %i" %
+                      (DummyEVPool.inserts, DummyEVPool.removes, DummyEVPool.traciCalls), end="")
+                if DummyEVPool.pooling:
+                    print("\t(pooled, pairs reused: %i)" % DummyEVPool.reuses)
+                else:
+                    print()
+
+            if EV.loadedChecked > 0:
+                print("\n\tLoaded vehicles checked:\t%i\tTraCI calls: %i (%.2f per vehicle)\tvTypes cached: %i" %
+                      (EV.loadedChecked, EV.loadedCalls, EV.loadedCalls / EV.loadedChecked, len(EV.vTypes)))
+
+            if TraciBuffer.buffering and TraciBuffer.writes > 0:
+                print("\n\tTraCI set calls buffered:\t%i\tsent: %i\tcoalesced: %i (%.1f%%)" %
+                      (TraciBuffer.writes, TraciBuffer.flushed, TraciBuffer.writes - TraciBuffer.flushed,
+                       100.0 * (TraciBuffer.writes - TraciBuffer.flushed) / TraciBuffer.writes))
+
+            if self.allocatedCount > 0:
+                print("\n\tAllocation every %i step(s) (%.1fs):\tpasses: %i\ttime: %.3fs\tallocations: %i\tmean wait: %.1fs" %
+                      (ControlCentre.controlPeriod, ControlCentre.controlPeriod * GG.ss.stepSecs, self.allocationPasses, self.allocationSecs,
+                       self.allocatedCount, self.allocationWaitSteps * GG.ss.stepSecs / self.allocatedCount))
+
+            if self.latencies["end to end"].count > 0 or self.latencies["request to allocation"].count > 0:
+                print("\n\tCharge request latency (s):\tcount\tmean\tp50\tp90\tp99\tmax")
+                for stage in ControlCentre.latencyStages:
+                    h = self.latencies[stage]
+                    if h.count > 0:
+                        print("\t\t%-24s\t%i\t%.1f\t%.1f\t%.1f\t%.1f\t%.1f" %
+                              (stage + ":", h.count, h.mean() * GG.ss.stepSecs, h.percentile(50) * GG.ss.stepSecs, h.percentile(90) * GG.ss.stepSecs,
+                               h.percentile(99) * GG.ss.stepSecs, h.max * GG.ss.stepSecs))
+
+            if self.neighbourSearches > 0:
+                print("\n\tNeighbour searches (%s):\t%i\ttime: %.3fs\t%.1fus per search" %
+                      ("context subscriptions" if ControlCentre.contextSubscribing else "python", self.neighbourSearches,
+                       self.neighbourSecs, 1.0e6 * self.neighbourSecs / self.neighbourSearches))
+
+            if TraciCache.caching and TraciCache.reads:
+                reads = sum(TraciCache.reads.values())
+                hits = sum(TraciCache.hits.values())
+                print("\n\tTraCI get calls cached:\t%i\thits: %i (%.1f%%)" % (reads, hits, 100.0 * hits / reads))
+                for name, count in sorted(TraciCache.reads.items()):
+                    print("\t\t%s:\t%i\thits: %i (%.1f%%)" % (name, count, TraciCache.hits.get(name, 0), 100.0 * TraciCache.hits.get(name, 0) / count))
+
             print("\nDiscrete Drone data:")
-            for drone in sorted(self.freeDrones | self.needChargeDrones | set(self.allocatedDrone)):
+            for drone in sorted(self.drones):
                 droneDistance = drone.myFlyingCount * drone.myDt.droneStepMperTimeStep / 1000.
                 droneFlyingKWh = drone.myFlyingCount * drone.myDt.droneFlyingWhperTimeStep / 1000.
                 droneChargeKWh = drone.myEVChargingCount * drone.myDt.WhEVChargeRatePerTimeStep / 1000.
@@ -527,39 +756,124 @@ class ControlCentre:
                 print("\tdrone: {}\tKm: {:.2f}\tCharge KW: {:.2f}\tFlyingKW: {:.2f}\tResidual (chargeWh: {:.0f} flyingWh: {:.0f})\tOverhead: {:.2f}%"
                       .format(drone.myID, droneDistance, droneChargeKWh, droneFlyingKWh, drone.myCharge, drone.myFlyingCharge, pOverhead))
 
+    def registerDrone(self, drone):
+        """add a new drone to the registry"""
+        self.drones.append(drone)
+        self.dronesByState[drone.myState][drone] = None
+        self.droneStateCounts[drone.myState] += 1
+
     def requestCharge(self, ev, capacity, requestedWh=2000.):
         """request for charge from EV"""
         if self.globalCharge > 1.0:
             self.requests[ev] = self.globalCharge
         else:
             self.requests[ev] = requestedWh
+        self.requestSteps[ev] = GG.ss.timeStep
+        IntervalStats.requests += 1
+        lifecycle = self.lifecycles.get(ev)
+        if lifecycle is None:
+            self.lifecycles[ev] = [GG.ss.timeStep, GG.ss.timeStep, None, None, None]
+        else:                       # asking again after a drone broke off
+            lifecycle[1:] = [GG.ss.timeStep, None, None, None]
+        if ControlCentre.contextSubscribing and ev not in self.contextEVs:
+            traci.vehicle.subscribeContext(ev.getID(), tc.CMD_GET_VEHICLE_VARIABLE, self.proximityRadius, (tc.VAR_POSITION,))
+            self.contextEVs.add(ev)
         if GG.chargePrint:
-            print("{}\t{}\t{!r}\t{}\t{:.1f}\t{:.1f}\t{:.1f}".format(GG.ss.timeStep, ev.getID(), EV.EVState.CHARGEREQUESTED, "", capacity, 0.0, self.requests[ev]), file=GG.chargeLog)
+            GG.chargeLog.log("{}\t{}\t{!r}\t{}\t{:.1f}\t{:.1f}\t{:.1f}", GG.ss.timeStep, ev.getID(), EV.EVState.CHARGEREQUESTED, "", capacity, 0.0, self.requests[ev])
 
     def setMaxDrones(self, pmaxDrones):
         """ update maxDrones - when --z option is used drones are limited to those in the add file"""
         self.maxDrones = pmaxDrones
         self.syncSpawnedDrones()
 
+    def summaryRecord(self, timeStamp, version, runstring, totals):
+        """the run summary as a record for RunSummary - configuration, the totals printDroneStatistics computed, per drone data and timings"""
+        totalSteps = GG.ss.timeStep
+        config = {"modelRendezvous": GG.modelRendezvous, "onlyChargeOnce": GG.onlyChargeOnce, "dronePrint": GG.dronePrint,
+                  "useOneBattery": Drone.d0Type.useOneBattery, "wEnergy": self.wEnergy, "wUrgency": self.wUrgency,
+                  "proximityRadius": self.proximityRadius, "maxDrones": self.maxDrones, "fullChargeTolerance": self.fullChargeTolerance,
+                  "globalCharge": self.globalCharge, "droneKmPerHr": GG.droneKmPerHr, "stepSecs": GG.ss.stepSecs,
+                  "controlPeriod": ControlCentre.controlPeriod, "contextSubscribing": ControlCentre.contextSubscribing,
+                  "poiSyncSteps": Drone.poiSyncSteps, "scheduling": Drone.scheduling, "fleet": GG.fleet is not None,
+                  "bufferWrites": TraciBuffer.buffering, "cacheReads": TraciCache.caching, "dummyPool": DummyEVPool.pooling,
+                  "restoredFrom": Checkpoint.restorePath}
+        drones = []
+        for drone in sorted(self.drones):
+            drones.append({"id": drone.myID, "km": drone.myFlyingCount * drone.myDt.droneStepMperTimeStep / 1000.,
+                           "chargeKWh": drone.myEVChargingCount * drone.myDt.WhEVChargeRatePerTimeStep / 1000.,
+                           "flyingKWh": drone.myFlyingCount * drone.myDt.droneFlyingWhperTimeStep / 1000.,
+                           "residualChargeWh": drone.myCharge, "residualFlyingWh": drone.myFlyingCharge,
+                           "overheadPercent": 100.0 * drone.myOverheadCount / (totalSteps - drone.myCreationTime)})
+        latencies = {}      # every stage, so records from different runs have the same columns
+        for stage in ControlCentre.latencyStages:
+            h = self.latencies[stage]
+            latencies[stage.replace(" ", "_")] = {"count": h.count, "meanSecs": h.mean() * GG.ss.stepSecs,
+                                                  "p50Secs": h.percentile(50) * GG.ss.stepSecs, "p90Secs": h.percentile(90) * GG.ss.stepSecs,
+                                                  "p99Secs": h.percentile(99) * GG.ss.stepSecs, "maxSecs": (h.max or 0) * GG.ss.stepSecs}
+        timing = {"allocationPasses": self.allocationPasses, "allocationSecs": self.allocationSecs, "allocations": self.allocatedCount,
+                  "allocationWaitSecs": self.allocationWaitSteps * GG.ss.stepSecs / self.allocatedCount if self.allocatedCount else 0.0,
+                  "neighbourSearches": self.neighbourSearches, "neighbourSecs": self.neighbourSecs,
+                  "traciGets": sum(TraciCache.reads.values()), "traciGetHits": sum(TraciCache.hits.values()),
+                  "traciSets": TraciBuffer.writes, "traciSetsSent": TraciBuffer.flushed, "poiWrites": Drone.poiWrites,
+                  "poiWritesSaved": Drone.poiWritesSaved, "loadedChecked": EV.loadedChecked, "loadedCalls": EV.loadedCalls,
+                  "latencies": latencies}
+        return {"timeStamp": timeStamp, "version": version, "sumoVersion": traci.getVersion()[1], "runstring": runstring.strip(), "cacheHit": False,
+                "config": config, "totals": totals, "drones": drones, "timing": timing}
+
     def syncSpawnedDrones(self):
         """if we've generated drones from POI definitions in the add file we need to update our spawnedDrone count"""
         self.spawnedDrones = Drone.getIDCount(self)
 
     def tidyDrones(self):
         """remove any dummy vehicles left after all vehicles have left - ie simulation has finished"""
+        for drone in self.drones:
+            drone.materialise()
         if self.insertedDummies > 0:
-            for drone in self.freeDrones | self.needChargeDrones:
+            for drone in self.drones:
                 if drone.myDummyEVInserted:
                     drone.dummyEVHide()
+            if DummyEVPool.pooling:
+                DummyEVPool.removeAll()
+
+    def unsubscribeContexts(self):
+        """drop the context subscriptions of EVs that are no longer requesting charge - including EVs that have just left,
+            SUMO fails the step if a subscription outlives its vehicle when the vehicle left in executeMove"""
+        for ev in [ev for ev in self.contextEVs if ev not in self.requests]:
+            self.contextEVs.discard(ev)
+            try:
+                traci.vehicle.unsubscribeContext(ev.getID(), tc.CMD_GET_VEHICLE_VARIABLE, self.proximityRadius)
+            except traci.TraCIException:
+                pass
 
     def update(self):
         """Management of 'control centre' executed by simulation on every step"""
+        if ControlCentre.contextSubscribing:
+            self.unsubscribeContexts()
         availableDrones = len(self.freeDrones) + self.maxDrones - self.spawnedDrones
-        if availableDrones > 0 and len(self.requests) > 0:
+        if availableDrones > 0 and len(self.requests) > 0 and GG.ss.timeStep % ControlCentre.controlPeriod == 0:
+            start = time.perf_counter()
             urgencyList, urgencyPosition = self.calcUrgency()
             self.allocateDrones(urgencyList, urgencyPosition)
             del urgencyList, urgencyPosition
+            self.allocationSecs += time.perf_counter() - start
+            self.allocationPasses += 1
         # Control centre manages parking/charging of drones
         # each EV 'manages' the drone allocated to them
-        for drone in self.freeDrones | self.needChargeDrones:
-            drone.parkingUpdate()
+        if GG.fleet is not None:
+            GG.fleet.parkingUpdate()
+        else:
+            while self.droneCalendar and self.droneCalendar[0][0] <= GG.ss.timeStep:
+                step, drone = heapq.heappop(self.droneCalendar)
+                drone.wake()
+            for drone in [drone for state in ControlCentre.parkingStates for drone in self.dronesByState[state]]:    # snapshot, updates change state
+                drone.parkingUpdate()
+                if Drone.scheduling:
+                    drone.schedule()
+        self.parkingStep = GG.ss.timeStep
+        if IntervalStats.sink is not None:
+            IntervalStats.update(GG.ss.timeStep, GG.ss.now, len(self.requests), self.droneStateCounts)
+
+    def wakeDroneAt(self, drone, step):
+        """add a dormant drone to the calendar - it's left out of the state registry until it wakes"""
+        del self.dronesByState[drone.myState][drone]
+        heapq.heappush(self.droneCalendar, (step, drone))
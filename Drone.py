@@ -1,11 +1,13 @@
 """Drone module"""
 import math
-import copy
 from enum import Enum
 import traci
 from GlobalClasses import GlobalClasses as GG
 from DroneType import DroneType
 from EV import EV
+from DummyEVPool import DummyEVPool
+from TraciBuffer import TraciBuffer
+from TraciCache import TraciCache
 
 class Drone:
     """Drone class - main parameters based on based on Ehang 184 which has top speed of 60km/h, battery capacity of 14.4 KW giving 23 mins flight time"""
@@ -22,10 +24,23 @@ class Drone:
 
     droneIDCount = 0
     parkAtHome = False      # option to force parking/charging back to the charge hub where drone started
-    d0Type = DroneType()
+    d0Type = DroneType.get()
 
     dummyEVCreated = False          # safety flag - in case we call dummyEVHide twice
 
+    poiSyncSteps = 1        # move POIs every n steps, 0 only at state changes, -1 never - sumo-gui is always every step
+    poiWrites = 0           # count of POI position/status/colour writes made
+    poiWritesSaved = 0      # count of POI writes not made because of poiSyncSteps
+
+    scheduling = False      # when True drones at, or flying to, a hub are only stepped near their next state change
+    scheduledSteps = 0      # count of drone updates not run because the drone was dormant
+    materialisations = 0    # count of times a dormant drone's state was brought up to date
+
+    __slots__ = ("myDt", "myID", "myPosition", "myParkPosition", "myParkEP", "myCharge", "myFlyingCharge", "myViableCharge", "myState", "myEV",
+                 "myCreationTime", "myFlyingCount", "myOverheadCount", "myFullCharges", "myBrokenCharges", "myBrokenEVCharges", "myEVChargingCount",
+                 "myChargeMeFlyingCount", "myChargeMeCount", "myChaseCount", "myBrokenChaseCount", "myChaseSteps", "myRequestedCharge",
+                 "myDummyEVInserted", "myDummyEVs", "myDormantFrom")
+
     def __init__(self, pos, poi, dt):
         if len(poi) < 2:
             Drone.droneIDCount += 1
@@ -36,10 +51,6 @@ class Drone:
             self.myDt = dt
             self.myID = poi
 
-        # reset drone speed factors with any runstring override
-        self.myDt.droneKMperh = GG.getDroneSpeed()
-        self.myDt.setDerived(GG.ss.stepSecs)
-
         self.myPosition = pos
         self.myParkPosition = self.myPosition
         self.myParkEP = self.myPosition
@@ -64,6 +75,9 @@ class Drone:
         self.myChaseSteps = 0              # count of steps in all complete chases - used with myChaseCount to compute average
         self.myRequestedCharge = 0         # the amount of charge requested by the EV
         self.myDummyEVInserted = False     # whether the dummy EVs have been inserted
+        self.myDummyEVs = ()               # the dummy EVs for my batteries - my own, or a pooled pair
+        self.myDormantFrom = None          # when dormant, the step my state has been materialised to
+        GG.cc.registerDrone(self)
         # finally create the POI representing our drone
         if self.myID != poi:
             traci.poi.add(self.myID, pos[0], pos[1], color=self.myDt.droneColour, layer=250, imgFile=self.myDt.droneImageFile, width=self.myDt.droneWidth, height=self.myDt.droneHeight)
@@ -119,42 +133,78 @@ class Drone:
         traci.vehicletype.setEmissionClass("Drone", "Energy/unknown")
         Drone.dummyEVCreated = True
 
+    @classmethod
+    def poiDroneParams(cls, poi, dt):
+        """DroneType parameters overridden by a drone POI in the add file - dt is the type being overridden"""
+        params = {}
+        dWidth = int(traci.poi.getWidth(poi))
+        if dWidth > 1: params["droneWidth"] = dWidth
+        dHeight = int(traci.poi.getHeight(poi))
+        if dHeight > 1: params["droneHeight"] = dHeight
+        dColor = traci.poi.getColor(poi)
+        if len(dColor) > 1: params["droneColour"] = dColor
+        dImageFile = traci.poi.getImageFile(poi)
+        if len(dImageFile) > 1: params["droneImageFile"] = dImageFile
+
+        # droneKMperh is not used - the runstring (or default) speed applies to all drones
+
+        dDroneChargeWh = traci.poi.getParameter(poi, "droneChargeWh")
+        if len(dDroneChargeWh) > 1: params["droneChargeWh"] = float(dDroneChargeWh)
+
+        dDroneFlyingWh = traci.poi.getParameter(poi, "droneFlyingWh")
+        if len(dDroneFlyingWh) > 1: params["droneFlyingWh"] = float(dDroneFlyingWh)
+
+        dDroneFlyingMinutes = traci.poi.getParameter(poi, "droneFlyingMinutes")
+        if len(dDroneFlyingMinutes) > 1: params["droneFlyingWhperSec"] = params.get("droneFlyingWh", dt.droneFlyingWh) / (60. * int(dDroneFlyingMinutes))
+
+        dDroneChargeContingencyp = traci.poi.getParameter(poi, "droneChargeContingencyp")
+        if len(dDroneChargeContingencyp) > 1: params["droneChargeContingencyp"] = float(dDroneChargeContingencyp)
+
+        dDroneChargeViablep = traci.poi.getParameter(poi, "droneChargeViablep")
+        if len(dDroneChargeViablep) > 1: params["droneChargeViablep"] = float(dDroneChargeViablep)
+
+        dWhEVChargeRate = traci.poi.getParameter(poi, "WhEVChargeRate")
+        if len(dWhEVChargeRate) > 1: params["WhEVChargeRate"] = int(dWhEVChargeRate)
+
+        dWhDroneRechargeRate = traci.poi.getParameter(poi, "WhDroneRechargeRate")
+        if len(dWhDroneRechargeRate) > 1: params["WhDroneRechargeRate"] = int(dWhDroneRechargeRate)
+
+        dUseOneBattery = traci.poi.getParameter(poi, "useOneBattery")
+        if len(dUseOneBattery) > 1: params["useOneBattery"] = True         # if set in the add file override the runstring
+
+        return params
+
     @classmethod
     def setDroneType(cls, useOneBattery, droneType="ehang184"):     # default will be overridden by definition in add file
         """Support different drone definitions - initially to give us a drone that doesn't need charging"""
 
-        Drone.d0Type.droneKMperh = GG.getDroneSpeed()  # get speed override if any
-
         # EV charging battery size is constrained by drone carrying capacity * average battery energy density (currently ~150Wh/Kg)
         match droneType:
             case "ehang184":
-                Drone.d0Type.droneChargeWh = 30000.                      # capacity of battery used to charge ev's, based on Ehang 184 load capacity - 200Kg
-                Drone.d0Type.droneFlyingWh = 14400.                      # capacity of battery used to power drone
-                Drone.d0Type.droneFlyingWhperTimeStep = Drone.d0Type.droneFlyingWh / (23 * 60.)   # Ehang 184 has battery capacity of 14.4 KW giving 23 mins flight time
-
-                Drone.d0Type.droneChargeContingencyp = 0.05              # minimum contingency level %
-                Drone.d0Type.droneChargeViablep = 0.3                    # minimum viable level %
-                Drone.d0Type.WhEVChargeRatePerTimeStep = 25000 / 3600.   # 25KW   rate of vehicle charge from drone  (adjust for timeStep when simulation starts)
-                Drone.d0Type.WhDroneRechargePerTimeStep = 75000 / 3600.  # 75KW   rate of drone charge when parked  (adjust for timeStep when simulation starts)
-                Drone.d0Type.useOneBattery = useOneBattery               #  if true use the charge battery to fly and charge
+                params = {"droneChargeWh": 30000.,                      # capacity of battery used to charge ev's, based on Ehang 184 load capacity - 200Kg
+                          "droneFlyingWh": 14400.,                      # capacity of battery used to power drone
+                          "droneFlyingWhperSec": 14400. / (23 * 60.),   # Ehang 184 has battery capacity of 14.4 KW giving 23 mins flight time
+                          "droneChargeContingencyp": 0.05,              # minimum contingency level %
+                          "droneChargeViablep": 0.3,                    # minimum viable level %
+                          "WhEVChargeRate": 25000,                      # 25KW   rate of vehicle charge from drone
+                          "WhDroneRechargeRate": 75000,                 # 75KW   rate of drone charge when parked
+                          "useOneBattery": useOneBattery}               #  if true use the charge battery to fly and charge
 
             case "ehang184x":            # ehang 184 with artificially increased battery sizes so they don't need recharging
-                Drone.d0Type.droneChargeWh = 3000000.     # 100 * actual
-                Drone.d0Type.droneFlyingWh = 14400000.
-                Drone.d0Type.droneFlyingWhperTimeStep = 14400. / (23 * 60.)
-                Drone.d0Type.droneChargeContingencyp = 0.05              # minimum contingency level %
-                Drone.d0Type.droneChargeViablep = 0.3                    # minimum viable level %
-                Drone.d0Type.WhEVChargeRatePerTimeStep = 25000 / 3600.   # 25KW   rate of vehicle charge from drone  (adjust for timeStep when simulation starts)
-                Drone.d0Type.WhDroneRechargePerTimeStep = 75000 / 3600.  # 75KW   rate of drone charge when parked  (adjust for timeStep when simulation starts)
-                Drone.d0Type.useOneBattery = useOneBattery               #  if true use the charge battery to fly and charge
-
-        Drone.d0Type.droneMperSec = Drone.d0Type.droneKMperh / 3.6
-        Drone.d0Type.droneStepMperTimeStep = Drone.d0Type.droneMperSec                            # How far (metres) the drone will travel in one time step (adjust for timeStep when simulation starts)
-        Drone.d0Type.droneStepM2 = Drone.d0Type.droneStepMperTimeStep * Drone.d0Type.droneStepMperTimeStep     # precompute - used in distance calculations  (adjust for timeStep when simulation starts)
-        Drone.d0Type.minDroneCharge = Drone.d0Type.droneChargeContingencyp    * Drone.d0Type.droneChargeWh     # Thresholds to break off charging/flying
-        Drone.d0Type.minDroneFlyingWh = Drone.d0Type.droneChargeContingencyp  * Drone.d0Type.droneFlyingWh
-        Drone.d0Type.viableDroneCharge = Drone.d0Type.droneChargeViablep      * Drone.d0Type.droneChargeWh     # thresholds to allow allocation - ie enough charge to be useful
-        Drone.d0Type.viableDroneFlyingWh = Drone.d0Type.droneChargeViablep    * Drone.d0Type.droneFlyingWh
+                params = {"droneChargeWh": 3000000.,    # 100 * actual
+                          "droneFlyingWh": 14400000.,
+                          "droneFlyingWhperSec": 14400. / (23 * 60.),
+                          "droneChargeContingencyp": 0.05,              # minimum contingency level %
+                          "droneChargeViablep": 0.3,                    # minimum viable level %
+                          "WhEVChargeRate": 25000,                      # 25KW   rate of vehicle charge from drone
+                          "WhDroneRechargeRate": 75000,                 # 75KW   rate of drone charge when parked
+                          "useOneBattery": useOneBattery}               #  if true use the charge battery to fly and charge
+
+            case _:
+                params = {}
+
+        # per step values are derived once, for the step length of this simulation and the drone speed, which may have a runstring override
+        Drone.d0Type = DroneType.get(GG.ss.stepSecs, droneKMperh=GG.getDroneSpeed(), **params)
 
     @classmethod
     def setDroneTypeFromPOI(cls, useOneBattery, zeroDrone):
@@ -165,43 +215,7 @@ class Drone:
         if len(POIlist) > 0:
             for poi in POIlist:
                 if poi == "d0":
-                    dWidth = int(traci.poi.getWidth(poi))
-                    if dWidth > 1: Drone.d0Type.droneWidth = dWidth
-                    dHeight = int(traci.poi.getHeight(poi))
-                    if dHeight > 1: Drone.d0Type.droneHeight = dHeight
-                    dColor = traci.poi.getColor(poi)
-                    if len(dColor) > 1: Drone.d0Type.droneColour = dColor
-                    dImageFile = traci.poi.getImageFile(poi)
-                    if len(dImageFile) > 1: Drone.d0Type.droneImageFile = dImageFile
-
-                    dDroneKMperh = traci.poi.getParameter(poi, "droneKMperh")
-                    if len(dDroneKMperh) > 1: Drone.d0Type.droneKMperh = float(dDroneKMperh)
-
-                    dDroneChargeWh = traci.poi.getParameter(poi, "droneChargeWh")
-                    if len(dDroneChargeWh) > 1: Drone.d0Type.droneChargeWh = float(dDroneChargeWh)
-
-                    dDroneFlyingWh = traci.poi.getParameter(poi, "droneFlyingWh")
-                    if len(dDroneFlyingWh) > 1: Drone.d0Type.droneFlyingWh = float(dDroneFlyingWh)
-
-                    dDroneFlyingMinutes = traci.poi.getParameter(poi, "droneFlyingMinutes")
-                    if len(dDroneFlyingMinutes) > 1: Drone.d0Type.droneFlyingWhperTimeStep = Drone.d0Type.droneFlyingWh /(60. * int(dDroneFlyingMinutes))
-
-                    dDroneChargeContingencyp = traci.poi.getParameter(poi, "droneChargeContingencyp")
-                    if len(dDroneChargeContingencyp) > 1: Drone.d0Type.droneChargeContingencyp = float(dDroneChargeContingencyp)
-
-                    dDroneChargeViablep = traci.poi.getParameter(poi, "droneChargeViablep")
-                    if len(dDroneChargeViablep) > 1: Drone.d0Type.droneChargeViablep = float(dDroneChargeViablep)
-
-                    dWhEVChargeRate = traci.poi.getParameter(poi, "WhEVChargeRate")
-                    if len(dWhEVChargeRate) > 1: Drone.d0Type.WhEVChargeRatePerTimeStep = int(dWhEVChargeRate)/3600.
-
-                    dWhDroneRechargeRate = traci.poi.getParameter(poi, "WhDroneRechargeRate")
-                    if len(dWhDroneRechargeRate) > 1: Drone.d0Type.WhDroneRechargePerTimeStep = int(dWhDroneRechargeRate)/3600.
-
-                    dUseOneBattery = traci.poi.getParameter(poi, "useOneBattery")
-                    if len(dUseOneBattery) > 1: Drone.d0Type.useOneBattery = True         # if set in the add file override the runstring
-                    else: Drone.d0Type.useOneBattery = useOneBattery                      #  otherwise use the passed runstring value
-
+                    Drone.d0Type = Drone.d0Type.replace(**Drone.poiDroneParams(poi, Drone.d0Type))
                     traci.poi.remove(poi)
                     if not zeroDrone:
                         return 1  # ie we've set the d0Type so can return
@@ -211,48 +225,10 @@ class Drone:
         if zeroDrone and len(POIlist) > 0:
             for poi in POIlist:
                 if traci.poi.getType(poi) == "drone" :  # weve removed the d0 drone
-                    DT = DroneType()
-                    DT = copy.deepcopy(Drone.d0Type)
-
-                    dWidth = int(traci.poi.getWidth(poi))
-                    if dWidth > 1: DT.droneWidth = dWidth
-                    dHeight = int(traci.poi.getHeight(poi))
-                    if dHeight > 1: DT.droneHeight = dHeight
-                    dColor = traci.poi.getColor(poi)
-                    if len(dColor) > 1: DT.droneColour = dColor
-                    dImageFile = traci.poi.getImageFile(poi)
-                    if len(dImageFile) > 1: DT.droneImageFile = dImageFile
-
-                    dDroneKMperh = traci.poi.getParameter(poi, "droneKMperh")
-                    if len(dDroneKMperh) > 1: DT.droneKMperh = float(dDroneKMperh)
-
-                    dDroneChargeWh = traci.poi.getParameter(poi, "droneChargeWh")
-                    if len(dDroneChargeWh) > 1: DT.droneChargeWh = float(dDroneChargeWh)
-
-                    dDroneFlyingWh = traci.poi.getParameter(poi, "droneFlyingWh")
-                    if len(dDroneFlyingWh) > 1: DT.droneFlyingWh = float(dDroneFlyingWh)
-
-                    dDroneFlyingMinutes = traci.poi.getParameter(poi, "droneFlyingMinutes")
-                    if len(dDroneFlyingMinutes) > 1: DT.droneFlyingWhperTimeStep = DT.droneFlyingWh /(60. * int(dDroneFlyingMinutes))
-
-                    dDroneChargeContingencyp = traci.poi.getParameter(poi, "droneChargeContingencyp")
-                    if len(dDroneChargeContingencyp) > 1: DT.droneChargeContingencyp = float(dDroneChargeContingencyp)
-
-                    dDroneChargeViablep = traci.poi.getParameter(poi, "droneChargeViablep")
-                    if len(dDroneChargeViablep) > 1: DT.droneChargeViablep = float(dDroneChargeViablep)
-
-                    dWhEVChargeRate = traci.poi.getParameter(poi, "WhEVChargeRate")
-                    if len(dWhEVChargeRate) > 1: DT.WhEVChargeRatePerTimeStep = int(dWhEVChargeRate)/3600.
-
-                    dWhDroneRechargeRate = traci.poi.getParameter(poi, "WhDroneRechargeRate")
-                    if len(dWhDroneRechargeRate) > 1: DT.WhDroneRechargePerTimeStep = int(dWhDroneRechargeRate)/3600.
-
-                    dUseOneBattery = traci.poi.getParameter(poi, "useOneBattery")
-                    if len(dUseOneBattery) > 1: DT.useOneBattery = True
-
+                    DT = Drone.d0Type.replace(**Drone.poiDroneParams(poi, Drone.d0Type))     # types with the same parameters are shared
                     try:
                         pos = traci.poi.getPosition(poi)
-                        GG.cc.freeDrones.add(Drone(pos, poi, DT))
+                        GG.cc.freeDrones.add(GG.cc.newDrone(pos, poi, DT))
                         poiDroneCount += 1
                     except traci.TraCIException:
                         print("Drone ",poi," creation failed. :- ", traci.TraCIException)
@@ -261,19 +237,94 @@ class Drone:
 
         return 0
 
+    @classmethod
+    def setPOISync(cls, poiSyncSteps):
+        """headless (sumo, not sumo-gui) runs don't need to see the drones move so can defer POI updates"""
+        if not GG.ss.usingSumoGui:
+            Drone.poiSyncSteps = poiSyncSteps
+
+    @classmethod
+    def setScheduling(cls, scheduling):
+        """turn on the drone calendar - not with the drone log, which wants every step, or sumo-gui where drones should be seen to fly"""
+        Drone.scheduling = scheduling and not (GG.dronePrint or GG.ss.usingSumoGui or GG.fleet is not None)
+        return Drone.scheduling
+
+    @classmethod
+    def syncPOIs(cls):
+        """True if POI positions are to be written in this step"""
+        if Drone.poiSyncSteps == 1:
+            return True
+        return Drone.poiSyncSteps > 1 and GG.ss.timeStep % Drone.poiSyncSteps == 0
+
     def allocate(self, ev, requestedCharge ):
         """allocate this instance to an EV"""
+        self.wake()
         if self.myState in (Drone.DroneState.CHARGINGDRONE, Drone.DroneState.PARKED):
             self.dummyEVHide()
         self.myEV = ev
         self.myRequestedCharge = requestedCharge
-        traci.poi.setParameter(self.myID, "status", "allocated to " + ev.getID())
+        self.setPOIStatus("allocated to " + ev.getID())
         if GG.modelRendezvous:
-            self.myState = Drone.DroneState.FLYINGTORENDEZVOUS
+            self.setState(Drone.DroneState.FLYINGTORENDEZVOUS)
         else:
-            self.myState = Drone.DroneState.FLYINGTOEV
+            self.setState(Drone.DroneState.FLYINGTOEV)
         return True
 
+    def arrivedAtEV(self):
+        """Flown to the EV so start charging it"""
+        if self.myEV is not None:   # usePower might have broken off after using power and set myEV to None
+            self.setPOIStatus("charging:" + self.myEV.getID())
+            self.setState(Drone.DroneState.CHARGINGEV)
+            if GG.dronePrint:
+                self.logLine("arrived at ev")
+
+    def arrivedAtHub(self, needCharge):
+        """Flown to the hub, either to charge or to park"""
+        if needCharge:
+            self.setPOIStatus("parked - needs charge")
+            self.setPOIColour((0, 255, 0, 255))
+            self.setState(Drone.DroneState.CHARGINGDRONE)
+            self.dummyEVInsert()
+            if GG.dronePrint:
+                self.logLine("arrived at charge hub")
+        else:
+            self.setPOIStatus("Parked")
+            self.setState(Drone.DroneState.PARKED)
+            self.dummyEVInsert()
+            if GG.dronePrint:
+                self.logLine("arrived at hub")
+
+    def arrivedAtRendezvous(self):
+        """Flown to the rendezvous point so now chase the EV"""
+        if self.myEV is not None:   # usePower might have broken off after using power and set myEV to None
+            self.setState(Drone.DroneState.FLYINGTOEV)
+            if GG.dronePrint:
+                self.logLine("Arrived at rendezvous")
+
+    def breakOff(self):
+        """problem - one of my batteries below contingency, so break off whatever I'm doing and fly to charge"""
+        if self.myEV is not None:
+            request = int(self.myRequestedCharge + 1)
+            self.myEV.stopCharging(request)   # tell EV how much charge we still need to apply to fulfil original request
+            self.myEV = None
+            self.myBrokenCharges += 1
+
+        self.myRequestedCharge = 0
+        self.myViableCharge = False
+        self.setMyParkPosition()
+        self.setPOIColour((255, 0, 0, 255))
+        self.setPOIStatus("Flying to charge")
+        self.setState(Drone.DroneState.FLYINGTOCHARGE)
+
+        GG.cc.notifyDroneState(self)
+
+    def chargeDelivered(self):
+        """we've charged the EV with the requested amount so park"""
+        self.myEV.stopCharging(0)   # don't clear, full charge
+        self.myFullCharges += 1
+        self.myRequestedCharge = 0
+        self.park()
+
     def chargeMe(self):
         """Drone at hub - charge if needed"""
         if self.myCharge < self.myDt.droneChargeWh:
@@ -283,62 +334,28 @@ class Drone:
             self.myFlyingCharge += self.myDt.WhDroneRechargePerTimeStep
             self.myChargeMeFlyingCount += 1
         elif self.myCharge >= self.myDt.droneChargeWh:  # fully charged so move to null state, avoiding calls to chargeMe
-            # self.myCharge = self.myDt.droneChargeWh
-            # self.myFlyingCharge = self.myDt.droneFlyingWh
-            self.dummyEVHide()
-            self.myState = Drone.DroneState.NULLState
-            self.setViableCharge()
+            self.chargedUp()
+
+    def chargedUp(self):
+        """Drone at hub is fully charged"""
+        # self.myCharge = self.myDt.droneChargeWh
+        # self.myFlyingCharge = self.myDt.droneFlyingWh
+        self.dummyEVHide()
+        self.setState(Drone.DroneState.NULLState)
+        self.setViableCharge()
 
     def dummyEVHide(self):
-        """remove the dummy EVs   - we need to resume before remove to avoid the aborted stop warning However
-            insertion may have collided and teleported/removed the EV so we need to check the list maintained by simulation before we try"""
+        """remove the dummy EVs, or move them back off the station to the hub's pool"""
         if GG.ss.useChargeHubs and self.myDummyEVInserted:
-            dummyFB = self.myID + "-FB"
-            try:
-                stState = traci.vehicle.getStopState(dummyFB)
-                if stState & 2 == 2:                          # only need to resume if it's actually stopped
-                    traci.vehicle.resume(dummyFB)
-            except Exception as e:
-                pass
-                #print("resume except ",e)  - was doing a resums when parking had not actually happened - may not need this now
-            finally:
-                traci.vehicle.remove(dummyFB)
-                GG.cc.insertedDummies -= 1
-
-            dummyCB = self.myID + "-CB"
-            try:
-                stState = traci.vehicle.getStopState(dummyCB)
-                if stState & 2 == 2:
-                    traci.vehicle.resume(dummyCB)
-            except Exception as e:
-                pass
-                # print("resume except ",e)
-            finally:
-                traci.vehicle.remove(dummyCB)
-                GG.cc.insertedDummies -= 1
-
+            DummyEVPool.release(self.myDummyEVs)
+            self.myDummyEVs = ()
             self.myDummyEVInserted = False
 
     def dummyEVInsert(self):
         """If we are generating charge station output add dummy EVs to the charge station for the drone batteries - whilst the drone is there"""
         if GG.ss.useChargeHubs:
-            e,p = self.myParkEP
-            dummyFB = self.myID + "-FB"
-            traci.vehicle.add(dummyFB,e,"Drone",departLane=0,departPos=p)
-            traci.vehicle.setParameter(dummyFB, "device.battery.maximumBatteryCapacity", self.myDt.droneFlyingWh)
-            traci.vehicle.setParameter(dummyFB, "device.battery.actualBatteryCapacity", self.myFlyingCharge)
-            traci.vehicle.setEmissionClass(dummyFB, "Energy/unknown")
-            traci.vehicle.setStop(dummyFB, e, pos=p, duration=10000.0, flags=1)
-            GG.cc.insertedDummies += 1
-
-            dummyCB = self.myID + "-CB"
-            traci.vehicle.add(dummyCB,e,"Drone",departLane=0,departPos=p+0.5)
-            traci.vehicle.setParameter(dummyCB, "device.battery.maximumBatteryCapacity", self.myDt.droneChargeWh)
-            traci.vehicle.setParameter(dummyCB, "device.battery.actualBatteryCapacity", self.myCharge)
-            traci.vehicle.setEmissionClass(dummyCB, "Energy/unknown")
-            traci.vehicle.setStop(dummyCB, e, pos=p + 0.5, duration=10000.0, flags=1)
-            GG.cc.insertedDummies += 1
-
+            self.myDummyEVs = DummyEVPool.addPair(self.myID, self.myParkEP, self.myDt.droneFlyingWh, self.myFlyingCharge,
+                                                  self.myDt.droneChargeWh, self.myCharge)
             self.myDummyEVInserted = True
 
 
@@ -383,7 +400,7 @@ class Drone:
         else:
           y = dy - y
 
-        traci.poi.setPosition(self.myID, x, y)
+        self.setPOIPosition(x, y)
         self.myPosition = (x, y)
 
         if (abs(x - px) + abs(y - py)) < 5.0:    # we've arrived at px, py  - arbitrary 5m - two car kengths
@@ -400,6 +417,7 @@ class Drone:
 
     def getMyPosition(self):
         """getter for position"""
+        self.materialise()
         return self.myPosition
 
     def logLine(self, activity):
@@ -407,14 +425,56 @@ class Drone:
         x, y = self.myPosition
         if self.myEV is not None:
             evID = self.myEV.getID()
-            lane = traci.vehicle.getLaneID(evID)
-            lanePos = float(traci.vehicle.getLanePosition(evID))
+            if self.myEV.myLaneStep == GG.ss.timeStep:     # the EV read its lane with its position this step
+                lane = self.myEV.myLane
+                lanePos = self.myEV.myLanePosition
+            else:
+                lane = TraciCache.vehicleGetLaneID(evID)
+                lanePos = float(TraciCache.vehicleGetLanePosition(evID))
         else:
             evID = ""
             lane = ""
             lanePos = 0
-        print("{:.1f}\t{}\t{}\t{}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{}".format
-              (GG.ss.timeStep, self.myID, evID, lane, lanePos, x, y, self.myEVChargingCount * self.myDt.WhEVChargeRatePerTimeStep , self.myCharge, self.myFlyingCharge, activity), file=GG.droneLog)
+        GG.droneLog.log("{:.1f}\t{}\t{}\t{}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{}",
+                        GG.ss.timeStep, self.myID, evID, lane, lanePos, x, y, self.myEVChargingCount * self.myDt.WhEVChargeRatePerTimeStep , self.myCharge, self.myFlyingCharge, activity)
+
+    def materialise(self):
+        """bring a dormant drone's state up to the last step the control centre has updated - in closed form, rather than step by step"""
+        if self.myDormantFrom is None:
+            return
+        k = GG.cc.parkingStep - self.myDormantFrom
+        if k <= 0:
+            return
+        self.myDormantFrom += k
+        Drone.scheduledSteps += k
+        Drone.materialisations += 1
+
+        match self.myState:
+            case Drone.DroneState.PARKED | Drone.DroneState.CHARGINGDRONE:      # chargeMe
+                rate = self.myDt.WhDroneRechargePerTimeStep
+                if self.myCharge < self.myDt.droneChargeWh:
+                    n = min(k, math.ceil((self.myDt.droneChargeWh - self.myCharge) / rate))
+                    self.myCharge += n * rate
+                    self.myChargeMeCount += n
+                if self.myFlyingCharge < self.myDt.droneFlyingWh:
+                    n = min(k, math.ceil((self.myDt.droneFlyingWh - self.myFlyingCharge) / rate))
+                    self.myFlyingCharge += n * rate
+                    self.myChargeMeFlyingCount += n
+                if self.myState == Drone.DroneState.CHARGINGDRONE:
+                    self.myOverheadCount += k
+
+            case Drone.DroneState.FLYINGTOPARK | Drone.DroneState.FLYINGTOCHARGE:     # usePower and fly
+                (x, y), (px, py) = self.myPosition, self.myParkPosition
+                f = k * self.myDt.droneStepMperTimeStep / math.dist((x, y), (px, py))
+                self.myPosition = (x + (px - x) * f, y + (py - y) * f)
+                self.setPOIPosition(self.myPosition[0], self.myPosition[1])
+                self.myFlyingCount += k
+                if self.myDt.useOneBattery:
+                    self.myCharge -= k * self.myDt.droneFlyingWhperTimeStep
+                else:
+                    self.myFlyingCharge -= k * self.myDt.droneFlyingWhperTimeStep
+                if self.myState == Drone.DroneState.FLYINGTOCHARGE:
+                    self.myOverheadCount += k
 
     def notifyChase(self, chaseOK, chaseSteps):
         """from EV updating chases by this drone"""
@@ -444,8 +504,8 @@ class Drone:
     def park(self):
         """charge finished so park drone"""
         self.setMyParkPosition()
-        self.myState = Drone.DroneState.FLYINGTOPARK
-        traci.poi.setParameter(self.myID, "status", "Flying to park")
+        self.setState(Drone.DroneState.FLYINGTOPARK)
+        self.setPOIStatus("Flying to park")
         GG.cc.notifyDroneState(self)
         self.myEV = None
 
@@ -455,9 +515,17 @@ class Drone:
             case Drone.DroneState.FLYINGTOPARK | Drone.DroneState.FLYINGTOCHARGE | Drone.DroneState.PARKED | Drone.DroneState.CHARGINGDRONE | Drone.DroneState.NULLState:
                 pass
             case _:
-                self.myState = Drone.DroneState.FLYINGTOPARK
+                self.setState(Drone.DroneState.FLYINGTOPARK)
         self.update(self.myParkPosition)
 
+    def schedule(self):
+        """called after a control centre update - go dormant if nothing is going to happen to me for a while,
+            the control centre wakes me a couple of steps before my next state change, to be sure of stepping through it"""
+        k = self.stepsToEvent()
+        if k is not None and k > 3:
+            self.myDormantFrom = GG.ss.timeStep
+            GG.cc.wakeDroneAt(self, GG.ss.timeStep + k - 2)
+
     def setMyParkPosition(self):
         """configure my parking/charging position"""
         if not Drone.parkAtHome:   # then we park at nearest hub
@@ -465,16 +533,75 @@ class Drone:
             self.myParkPosition = (x, y)
             self.myParkEP = (e,p)
 
+    def setPOIColour(self, colour):
+        """set the colour of my POI - unless we never update POIs"""
+        if Drone.poiSyncSteps < 0:
+            Drone.poiWritesSaved += 1
+        else:
+            TraciBuffer.poiSetColor(self.myID, colour)
+            Drone.poiWrites += 1
+
+    def setPOIPosition(self, x, y):
+        """move my POI, if POIs are synced in this step"""
+        if Drone.syncPOIs():
+            TraciBuffer.poiSetPosition(self.myID, x, y)
+            Drone.poiWrites += 1
+        else:
+            Drone.poiWritesSaved += 1
+
+    def setPOIStatus(self, status):
+        """set the status of my POI - this is a state change so also bring a deferred POI position up to date"""
+        if Drone.poiSyncSteps < 0:
+            Drone.poiWritesSaved += 1
+        else:
+            TraciBuffer.poiSetParameter(self.myID, "status", status)
+            Drone.poiWrites += 1
+            if Drone.poiSyncSteps != 1:
+                x, y = self.myPosition
+                TraciBuffer.poiSetPosition(self.myID, x, y)
+                Drone.poiWrites += 1
+
+    def setState(self, state):
+        """change state - keeping the control centre's registry of drones by state up to date"""
+        GG.cc.droneStateChanged(self, self.myState, state)
+        self.myState = state
+
     def setViableCharge(self):
         """Check charge levels and see if we are viable - ie can be allocated"""
         if self.myCharge >= self.myDt.viableDroneCharge and self.myFlyingCharge >= self.myDt.viableDroneFlyingWh:
             if not self.myViableCharge:
                 self.myViableCharge = True
                 GG.cc.notifyDroneState(self)  # cc only interested when we become viable
-                traci.poi.setColor(self.myID, self.myDt.droneColour)
+                self.setPOIColour(self.myDt.droneColour)
         else:
             self.myViableCharge = False
 
+    def stepsToEvent(self):
+        """no of steps until my next state change (at the earliest), None if I'm not in a state we can schedule"""
+        match self.myState:
+            case Drone.DroneState.PARKED | Drone.DroneState.CHARGINGDRONE:      # chargedUp once both batteries are full
+                rate = self.myDt.WhDroneRechargePerTimeStep
+                nC = max(0, math.ceil((self.myDt.droneChargeWh - self.myCharge) / rate))
+                nF = max(0, math.ceil((self.myDt.droneFlyingWh - self.myFlyingCharge) / rate))
+                return max(nF + 1, nC)
+
+            case Drone.DroneState.FLYINGTOPARK | Drone.DroneState.FLYINGTOCHARGE:     # arrivedAtHub, or breakOff flying to park
+                (x, y), (px, py) = self.myPosition, self.myParkPosition
+                if x == px or y == py:          # fly() covers the whole distance in one step
+                    return None
+                d = math.dist((x, y), (px, py))
+                s = self.myDt.droneStepMperTimeStep
+                k = min(math.ceil(d / s), math.floor((d - 5.0) / s) + 1)
+                if self.myState == Drone.DroneState.FLYINGTOPARK:
+                    if self.myDt.useOneBattery:
+                        wh, minWh = self.myCharge, self.myDt.minDroneCharge
+                    else:
+                        wh, minWh = self.myFlyingCharge, self.myDt.minDroneFlyingWh
+                    k = min(k, math.floor((wh - minWh) / self.myDt.droneFlyingWhperTimeStep) + 1)
+                return k
+
+        return None
+
     def update(self, pos):
         """primary update - invoked directly when EV is managing drone"""
         updateStatus = True
@@ -489,10 +616,7 @@ class Drone:
             case Drone.DroneState.FLYINGTORENDEZVOUS:
                 if self.usePower("fly"):
                     if self.fly(pos):
-                        if self.myEV is not None:   # usePower might have broken off after using power and set myEV to None
-                            self.myState = Drone.DroneState.FLYINGTOEV
-                            if GG.dronePrint:
-                                self.logLine("Arrived at rendezvous")
+                        self.arrivedAtRendezvous()
                     else:
                         updateStatus = False
                         if GG.dronePrint:
@@ -506,11 +630,7 @@ class Drone:
             case Drone.DroneState.FLYINGTOEV:
                 if self.usePower("fly"):
                     if self.fly(pos):
-                        if self.myEV is not None:   # usePower might have broken off after using power and set myEV to None
-                            traci.poi.setParameter(self.myID, "status", "charging:" + self.myEV.getID())
-                            self.myState = Drone.DroneState.CHARGINGEV
-                            if GG.dronePrint:
-                                self.logLine("arrived at ev")
+                        self.arrivedAtEV()
                     else:
                         updateStatus = False
                         if GG.dronePrint:
@@ -540,12 +660,7 @@ class Drone:
                 self.usePower("")
                 self.myOverheadCount += 1
                 if self.fly(self.myParkPosition):
-                    traci.poi.setParameter(self.myID, "status", "parked - needs charge")
-                    traci.poi.setColor(self.myID, (0, 255, 0, 255))
-                    self.myState = Drone.DroneState.CHARGINGDRONE
-                    self.dummyEVInsert()
-                    if GG.dronePrint:
-                        self.logLine("arrived at charge hub")
+                    self.arrivedAtHub(True)
                 else:
                     updateStatus = False
                     if GG.dronePrint:
@@ -554,11 +669,7 @@ class Drone:
             case Drone.DroneState.FLYINGTOPARK:     # note that previous version did not count power/distance used in arriving at hub
                 self.usePower("fly")
                 if self.fly(self.myParkPosition):
-                    traci.poi.setParameter(self.myID, "status", "Parked")
-                    self.myState = Drone.DroneState.PARKED
-                    self.dummyEVInsert()
-                    if GG.dronePrint:
-                        self.logLine("arrived at hub")
+                    self.arrivedAtHub(False)
                 else:
                     updateStatus = False
                     if GG.dronePrint:
@@ -589,10 +700,7 @@ class Drone:
                 self.myRequestedCharge -= self.myDt.WhEVChargeRatePerTimeStep
                 self.myEVChargingCount += 1
                 if self.myRequestedCharge <= 0:    #  we've charged the requested amount
-                    self.myEV.stopCharging(0)   # don't clear, full charge
-                    self.myFullCharges += 1
-                    self.myRequestedCharge = 0
-                    self.park()
+                    self.chargeDelivered()
                     return False      # ie we're not returning a charge
                 if self.myCharge < self.myDt.minDroneCharge:
                     breakOff = True
@@ -606,21 +714,7 @@ class Drone:
 
         # problem - one of my batteries below contingency
         if breakOff:
-            if self.myEV is not None:
-                request = int(self.myRequestedCharge + 1)
-                self.myEV.stopCharging(request)   # tell EV how much charge we still need to apply to fulfil original request
-                self.myEV = None
-                self.myBrokenCharges += 1
-
-            self.myRequestedCharge = 0
-            self.myViableCharge = False
-            self.setMyParkPosition()
-            traci.poi.setColor(self.myID, (255, 0, 0, 255))
-            traci.poi.setParameter(self.myID, "status", "Flying to charge")
-            self.myState = Drone.DroneState.FLYINGTOCHARGE
-
-            GG.cc.notifyDroneState(self)
-
+            self.breakOff()
             return False
         return True
 
@@ -633,3 +727,10 @@ class Drone:
                 return self.myViableCharge
             case _:
                 return True
+
+    def wake(self):
+        """bring a dormant drone up to date and go back to stepping it"""
+        if self.myDormantFrom is not None:
+            self.materialise()
+            self.myDormantFrom = None
+            GG.cc.droneAwake(self)
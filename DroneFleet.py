@@ -0,0 +1,293 @@
+"""Drone fleet module - structure of arrays version of the drone state, advanced by vectorised updates"""
+try:
+    import numpy as np
+except ImportError:     # numpy is only needed if the fleet is used
+    np = None
+import traci
+from GlobalClasses import GlobalClasses as GG
+from Drone import Drone
+from TraciBuffer import TraciBuffer
+
+
+def fleetColumn(column, cast=float):
+    """property mapping a Drone attribute onto its element of a DroneFleet column"""
+    def getter(self):
+        return cast(getattr(self.myFleet, column)[self.myIdx])
+
+    def setter(self, value):
+        getattr(self.myFleet, column)[self.myIdx] = value
+
+    return property(getter, setter)
+
+
+class FleetDrone(Drone):
+    """Drone whose position, batteries, state and counters are held in the DroneFleet arrays
+        - same interface as Drone but update() only records the target, the fleet does the work"""
+    __slots__ = ("myFleet", "myIdx")     # the properties below override Drone's slots for the values held in the fleet
+
+    def __init__(self, fleet, pos, poi, dt):
+        self.myFleet = fleet
+        self.myIdx = fleet.addDrone(self)
+        Drone.__init__(self, pos, poi, dt)
+        fleet.setDroneType(self.myIdx, self.myDt)
+
+    def __getstate__(self):
+        """pickle only the slots the properties don't override - the values they hold are pickled with the fleet arrays"""
+        names = [name for name in Drone.__slots__ + FleetDrone.__slots__ if not isinstance(getattr(FleetDrone, name), property)]
+        return None, {name: getattr(self, name) for name in names if hasattr(self, name)}
+
+    myCharge = fleetColumn("charge")
+    myFlyingCharge = fleetColumn("flyingCharge")
+    myRequestedCharge = fleetColumn("requestedCharge")
+    myFlyingCount = fleetColumn("flyingCount", int)
+    myOverheadCount = fleetColumn("overheadCount", int)
+    myChargeMeCount = fleetColumn("chargeMeCount", int)
+    myChargeMeFlyingCount = fleetColumn("chargeMeFlyingCount", int)
+    myEVChargingCount = fleetColumn("evChargingCount", int)
+
+    @property
+    def myPosition(self):
+        """x, y position from the fleet arrays"""
+        return float(self.myFleet.x[self.myIdx]), float(self.myFleet.y[self.myIdx])
+
+    @myPosition.setter
+    def myPosition(self, pos):
+        self.myFleet.x[self.myIdx], self.myFleet.y[self.myIdx] = pos
+
+    @property
+    def myParkPosition(self):
+        """x, y of the hub we park/charge at, from the fleet arrays"""
+        return float(self.myFleet.parkX[self.myIdx]), float(self.myFleet.parkY[self.myIdx])
+
+    @myParkPosition.setter
+    def myParkPosition(self, pos):
+        self.myFleet.parkX[self.myIdx], self.myFleet.parkY[self.myIdx] = pos
+
+    @property
+    def myState(self):
+        """Drone state from the fleet state codes"""
+        return Drone.DroneState(int(self.myFleet.state[self.myIdx]))
+
+    @myState.setter
+    def myState(self, state):
+        self.myFleet.state[self.myIdx] = state.value
+
+    def reportTo(self, ev, evState):
+        """ask the fleet to give the outcome of this step's update to the EV"""
+        self.myFleet.reports[self.myIdx] = ev, evState
+
+    def update(self, pos):
+        """record where the EV wants us to fly - the fleet moves us with the other EV managed drones"""
+        self.myFleet.setTarget(self.myIdx, pos)
+        return None
+
+
+class DroneFleet:
+    """Holds the position, batteries, state, targets and counters of all drones in numpy arrays.
+        Movement, energy use and hub recharging are advanced for all drones in one vectorised update,
+        state transitions are then handed back to the drones to notify the ControlCentre and EVs"""
+    PARKED = Drone.DroneState.PARKED.value
+    FLYINGTORENDEZVOUS = Drone.DroneState.FLYINGTORENDEZVOUS.value
+    FLYINGTOEV = Drone.DroneState.FLYINGTOEV.value
+    CHARGINGEV = Drone.DroneState.CHARGINGEV.value
+    FLYINGTOCHARGE = Drone.DroneState.FLYINGTOCHARGE.value
+    CHARGINGDRONE = Drone.DroneState.CHARGINGDRONE.value
+    FLYINGTOPARK = Drone.DroneState.FLYINGTOPARK.value
+
+    parkingStates = (PARKED, FLYINGTOCHARGE, CHARGINGDRONE, FLYINGTOPARK)   # states where the control centre manages the drone
+
+    # columns and their types - per drone state, then per drone copies of the DroneType values we need
+    columns = {"x": "float64", "y": "float64", "targetX": "float64", "targetY": "float64", "parkX": "float64", "parkY": "float64",
+               "charge": "float64", "flyingCharge": "float64", "requestedCharge": "float64", "state": "int8",
+               "flyingCount": "int64", "overheadCount": "int64", "chargeMeCount": "int64", "chargeMeFlyingCount": "int64",
+               "evChargingCount": "int64", "pending": "bool",
+               "chargeWh": "float64", "flyingWh": "float64", "minCharge": "float64", "minFlyingWh": "float64", "stepM2": "float64",
+               "flyingRate": "float64", "evChargeRate": "float64", "rechargeRate": "float64", "oneBattery": "bool"}
+
+    def __init__(self, size=64):
+        self.count = 0          # no of drones in the fleet
+        self.drones = []        # the FleetDrone objects, in fleet index order
+        self.reports = []       # (ev, evState) waiting for the outcome of this step's update, per drone
+        for column, dtype in DroneFleet.columns.items():
+            setattr(self, column, np.zeros(size, dtype=dtype))
+
+    def addDrone(self, drone):
+        """allocate the next fleet index to the drone"""
+        if self.count == len(self.x):
+            self.grow()
+        self.drones.append(drone)
+        self.reports.append(None)
+        self.count += 1
+        return self.count - 1
+
+    def advance(self, idx):
+        """vectorised step for the drones in idx - mirrors Drone.update() for each drone state"""
+        s = self.state[idx]
+        toRendezvous = s == DroneFleet.FLYINGTORENDEZVOUS
+        toEV = s == DroneFleet.FLYINGTOEV
+        chargingEV = s == DroneFleet.CHARGINGEV
+        toCharge = s == DroneFleet.FLYINGTOCHARGE
+        toPark = s == DroneFleet.FLYINGTOPARK
+        chargingDrone = s == DroneFleet.CHARGINGDRONE
+        atHub = (s == DroneFleet.PARKED) | chargingDrone
+
+        # power used flying - usePower("fly") can break off, flying to charge (usePower("")) can't
+        powered = toRendezvous | toEV | toPark
+        flyers = idx[powered | toCharge]
+        self.flyingCount[flyers] += 1
+        one = self.oneBattery[flyers]
+        self.charge[flyers[one]] -= self.flyingRate[flyers[one]]
+        self.flyingCharge[flyers[~one]] -= self.flyingRate[flyers[~one]]
+        p = idx[powered]
+        brokeOff = np.zeros(len(idx), dtype=bool)
+        brokeOff[powered] = np.where(self.oneBattery[p], self.charge[p] < self.minCharge[p], self.flyingCharge[p] < self.minFlyingWh[p])
+        for i in idx[brokeOff].tolist():
+            self.drones[i].breakOff()          # can move our park position so handle before we fly
+        self.overheadCount[idx[toCharge | chargingDrone]] += 1
+
+        # fly - EV managed drones to their target, others to their hub
+        moving = toRendezvous | toEV | chargingEV | toCharge | toPark
+        m = idx[moving]
+        home = (toCharge | toPark)[moving]
+        px = np.where(home, self.parkX[m], self.targetX[m])
+        py = np.where(home, self.parkY[m], self.targetY[m])
+        dx = self.x[m]
+        dy = self.y[m]
+        ddx = px - dx
+        ddy = py - dy
+        oblique = (ddx != 0) & (ddy != 0)
+        ratio = np.divide(ddy, ddx, out=np.zeros(len(m)), where=oblique)
+        stepX = np.where(oblique, np.abs(np.sqrt(self.stepM2[m] / (1.0 + ratio ** 2))), np.where(ddx == 0, 0., np.abs(ddx)))
+        stepY = np.where(oblique, np.abs(stepX * ratio), np.where(ddx == 0, np.abs(ddy), 0.))
+        nx = np.where(np.abs(ddx) <= stepX, px + 0.001, np.where(ddx > 0, dx + stepX, dx - stepX))   # will reach px in this step so set to ~exact distance
+        ny = np.where(np.abs(ddy) <= stepY, py + 0.001, np.where(ddy > 0, dy + stepY, dy - stepY))
+        self.x[m] = nx
+        self.y[m] = ny
+        if Drone.syncPOIs():
+            for i, x, y in zip(m.tolist(), nx.tolist(), ny.tolist()):
+                TraciBuffer.poiSetPosition(self.drones[i].myID, x, y)
+            Drone.poiWrites += len(m)
+        else:
+            Drone.poiWritesSaved += len(m)
+        arrived = np.zeros(len(idx), dtype=bool)
+        arrived[moving] = (np.abs(nx - px) + np.abs(ny - py)) < 5.0    # arbitrary 5m - two car lengths
+
+        # charging EVs - usePower("chargeEV")
+        c = idx[chargingEV]
+        self.charge[c] -= self.evChargeRate[c]
+        self.requestedCharge[c] -= self.evChargeRate[c]
+        self.evChargingCount[c] += 1
+        delivered = np.zeros(len(idx), dtype=bool)
+        delivered[chargingEV] = self.requestedCharge[c] <= 0
+        exhausted = np.zeros(len(idx), dtype=bool)
+        exhausted[chargingEV] = ~delivered[chargingEV] & (self.charge[c] < self.minCharge[c])
+
+        # recharging at the hub - chargeMe()
+        h = idx[atHub]
+        low = h[self.charge[h] < self.chargeWh[h]]
+        self.charge[low] += self.rechargeRate[low]
+        self.chargeMeCount[low] += 1
+        flyingLow = self.flyingCharge[h] < self.flyingWh[h]
+        low = h[flyingLow]
+        self.flyingCharge[low] += self.rechargeRate[low]
+        self.chargeMeFlyingCount[low] += 1
+        chargedUp = np.zeros(len(idx), dtype=bool)
+        chargedUp[atHub] = ~flyingLow & (self.charge[h] >= self.chargeWh[h])
+
+        # hand the state transitions back to the drones
+        for i in idx[toRendezvous & arrived & ~brokeOff].tolist():
+            self.drones[i].arrivedAtRendezvous()
+        for i in idx[toEV & arrived & ~brokeOff].tolist():
+            self.drones[i].arrivedAtEV()
+        for i in idx[toCharge & arrived].tolist():
+            self.drones[i].arrivedAtHub(True)
+        for i in idx[toPark & arrived].tolist():
+            self.drones[i].arrivedAtHub(False)
+        for i in idx[delivered].tolist():
+            self.drones[i].chargeDelivered()
+        for i in idx[exhausted].tolist():
+            self.drones[i].breakOff()
+        for i in idx[chargedUp].tolist():
+            self.drones[i].chargedUp()
+
+        if GG.dronePrint:
+            self.logLines(idx, s, arrived, brokeOff)
+
+        # the update status, and charge given to the EV, that Drone.update() would have returned
+        status = np.where(toRendezvous | toEV, arrived & ~brokeOff, np.where(toCharge | toPark, arrived, ~(delivered | exhausted)))
+        power = np.where(chargingEV & status, self.evChargeRate[idx], 0.)
+        return status, power
+
+    def grow(self):
+        """double the size of all the columns"""
+        for column in DroneFleet.columns:
+            array = getattr(self, column)
+            setattr(self, column, np.concatenate((array, np.zeros_like(array))))
+
+    def logLines(self, idx, s, arrived, brokeOff):
+        """log activity for the drones advanced - arrivals have already been logged by the drones"""
+        for i, state, hasArrived, hasBrokeOff in zip(idx.tolist(), s.tolist(), arrived.tolist(), brokeOff.tolist()):
+            drone = self.drones[i]
+            match state:
+                case DroneFleet.PARKED:
+                    drone.logLine("Parked")
+                case DroneFleet.FLYINGTORENDEZVOUS:
+                    if hasBrokeOff:
+                        drone.logLine("breaking off")
+                    elif not hasArrived:
+                        drone.logLine("flying to rendezvous")
+                case DroneFleet.FLYINGTOEV:
+                    if hasBrokeOff:
+                        drone.logLine("breaking off")
+                    elif not hasArrived:
+                        drone.logLine("flying to ev")
+                case DroneFleet.CHARGINGEV:
+                    drone.logLine("charging EV")
+                case DroneFleet.CHARGINGDRONE:
+                    drone.logLine("charging self")
+                case DroneFleet.FLYINGTOCHARGE:
+                    if not hasArrived:
+                        drone.logLine("flying to charge hub")
+                case DroneFleet.FLYINGTOPARK:
+                    if not hasArrived:
+                        drone.logLine("flying to hub")
+
+    def newDrone(self, pos, poi, dt):
+        """create a drone held in this fleet"""
+        return FleetDrone(self, pos, poi, dt)
+
+    def parkingUpdate(self):
+        """advance the drones the control centre is managing - ie parking and charging"""
+        idx = np.flatnonzero(np.isin(self.state[:self.count], DroneFleet.parkingStates))
+        if len(idx) > 0:
+            self.advance(idx)
+
+    def setDroneType(self, i, dt):
+        """copy the DroneType values used in the vectorised update"""
+        self.chargeWh[i] = dt.droneChargeWh
+        self.flyingWh[i] = dt.droneFlyingWh
+        self.minCharge[i] = dt.minDroneCharge
+        self.minFlyingWh[i] = dt.minDroneFlyingWh
+        self.stepM2[i] = dt.droneStepM2
+        self.flyingRate[i] = dt.droneFlyingWhperTimeStep
+        self.evChargeRate[i] = dt.WhEVChargeRatePerTimeStep
+        self.rechargeRate[i] = dt.WhDroneRechargePerTimeStep
+        self.oneBattery[i] = dt.useOneBattery
+
+    def setTarget(self, i, pos):
+        """where drone i should fly to in this step"""
+        self.targetX[i], self.targetY[i] = pos
+        self.pending[i] = True
+
+    def update(self):
+        """advance the drones the EVs have updated in this step and report back to the EVs"""
+        idx = np.flatnonzero(self.pending[:self.count])
+        if len(idx) > 0:
+            self.pending[idx] = False
+            status, power = self.advance(idx)
+            for i, uStatus, chWh in zip(idx.tolist(), status.tolist(), power.tolist()):
+                report = self.reports[i]
+                if report is not None:
+                    self.reports[i] = None
+                    ev, evState = report
+                    ev.droneUpdated(evState, uStatus, chWh)
@@ -1,44 +1,78 @@
 """DroneType class"""
+import functools
+
 
 class DroneType:
-    """Drone parameters"""
-    def __init__(self):
-        self.droneKMperh = 60.0                          # drone cruising speed - will be overridden by global / runstring value
-        self.droneChargeWh = 30000.0                       # capacity of battery used to charge ev's  - based on Ehang 184 load capacity
-        self.droneFlyingWh = 14400.0                       # capacity of battery used to power drone
-        self.droneFlyingWhperTimeStep = self.droneFlyingWh / (23 * 60.)   # power usage based on Ehang 184 which has battery capacity of 14.4 KW giving 23 mins flight time
-        self.droneChargeContingencyp = .05           # minimum contingency level %
-        self.droneChargeViablep = .3                      # minimum viable level %
-        self.WhEVChargeRatePerTimeStep = 25000 / 3600.      # 25KW   rate of vehicle charge from drone(adjust for timeStep when simulation starts)
-        self.WhDroneRechargePerTimeStep = 75000 / 3600.     # 75KW   rate of drone charge when parked(adjust for timeStep when simulation starts)
-
-        self.droneImageFile = "drone.png"
-        self.droneColour =  0, 0, 255, 255
-        self.droneWidth = 10.0
-        self.droneHeight = 10.0
-        self.useOneBattery = False
-
-        # derived variables
-        self.droneMperSec =self.droneKMperh / 3.6
-        self.droneStepMperTimeStep = self.droneMperSec                        # How far(metres) the drone will travel in one time step(adjust for timeStep when simulation starts)
-        self.droneStepM2 = pow(self.droneStepMperTimeStep, 2)                 # precompute - used in distance calculations(adjust for timeStep when simulation starts)
-        self.minDroneCharge = self.droneChargeContingencyp * self.droneChargeWh    # Thresholds to break off charging / flying
-        self.minDroneFlyingWh = self.droneChargeContingencyp * self.droneFlyingWh
-        self.viableDroneCharge = self.droneChargeViablep * self.droneChargeWh      # thresholds to allow allocation - ie enough charge to be useful
-        self.viableDroneFlyingWh = self.droneChargeViablep * self.droneFlyingWh
-
-
-    def setDerived(self, stepSecs = 1.0):
-        """Adjust the derived variables for simulation step duration """
-        #droneMperSec = (droneKMperh / 3.6)
-        self.droneStepMperTimeStep = self.droneMperSec * stepSecs                        # How far(metres) the drone will travel in one time step(adjust for timeStep when simulation starts)
-        self.droneStepM2 = pow(self.droneStepMperTimeStep, 2)                 # precompute - used in distance calculations(adjust for timeStep when simulation starts)
-
-        self.droneFlyingWhperTimeStep *= stepSecs
-        self.WhEVChargeRatePerTimeStep *= stepSecs
-        self.WhDroneRechargePerTimeStep *= stepSecs
-
-        self.minDroneCharge = self.droneChargeContingencyp * self.droneChargeWh    # Thresholds to break off charging / flying
-        self.minDroneFlyingWh = self.droneChargeContingencyp * self.droneFlyingWh
-        self.viableDroneCharge = self.droneChargeViablep * self.droneChargeWh      # thresholds to allow allocation - ie enough charge to be useful
-        self.viableDroneFlyingWh = self.droneChargeViablep * self.droneFlyingWh
+    """Drone parameters - immutable and shared by every drone of the type.
+        Use DroneType.get() so each (stepSecs, parameters) combination is created, and its per step values derived, once"""
+    # parameters that define a type - rates are per second (charge rates per hour, as in the add file)
+    defaults = {
+        "droneKMperh": 60.0,                        # drone cruising speed - will be overridden by global / runstring value
+        "droneChargeWh": 30000.0,                   # capacity of battery used to charge ev's  - based on Ehang 184 load capacity
+        "droneFlyingWh": 14400.0,                   # capacity of battery used to power drone
+        "droneFlyingWhperSec": 14400.0 / (23 * 60.),    # power usage based on Ehang 184 which has battery capacity of 14.4 KW giving 23 mins flight time
+        "droneChargeContingencyp": .05,             # minimum contingency level %
+        "droneChargeViablep": .3,                   # minimum viable level %
+        "WhEVChargeRate": 25000,                    # 25KW   rate of vehicle charge from drone
+        "WhDroneRechargeRate": 75000,               # 75KW   rate of drone charge when parked
+        "droneImageFile": "drone.png",
+        "droneColour": (0, 0, 255, 255),
+        "droneWidth": 10.0,
+        "droneHeight": 10.0,
+        "useOneBattery": False,
+    }
+
+    __slots__ = tuple(defaults) + ("stepSecs", "droneMperSec", "droneStepMperTimeStep", "droneStepM2", "droneFlyingWhperTimeStep",
+                                   "WhEVChargeRatePerTimeStep", "WhDroneRechargePerTimeStep", "minDroneCharge", "minDroneFlyingWh",
+                                   "viableDroneCharge", "viableDroneFlyingWh")
+
+    registry = {}       # (stepSecs, parameters) -> DroneType
+
+    def __init__(self, stepSecs=1.0, **params):
+        unknown = params.keys() - DroneType.defaults.keys()
+        if unknown:
+            raise TypeError("unknown DroneType parameters: " + ", ".join(sorted(unknown)))
+        setValue = object.__setattr__      # we're immutable once created
+        for name, value in dict(DroneType.defaults, **params).items():
+            setValue(self, name, value)
+
+        # derived variables - adjusted for the simulation step duration
+        setValue(self, "stepSecs", stepSecs)
+        setValue(self, "droneMperSec", self.droneKMperh / 3.6)
+        setValue(self, "droneStepMperTimeStep", self.droneMperSec * stepSecs)         # How far(metres) the drone will travel in one time step
+        setValue(self, "droneStepM2", pow(self.droneStepMperTimeStep, 2))             # precompute - used in distance calculations
+        setValue(self, "droneFlyingWhperTimeStep", self.droneFlyingWhperSec * stepSecs)
+        setValue(self, "WhEVChargeRatePerTimeStep", self.WhEVChargeRate / 3600. * stepSecs)
+        setValue(self, "WhDroneRechargePerTimeStep", self.WhDroneRechargeRate / 3600. * stepSecs)
+        setValue(self, "minDroneCharge", self.droneChargeContingencyp * self.droneChargeWh)      # Thresholds to break off charging / flying
+        setValue(self, "minDroneFlyingWh", self.droneChargeContingencyp * self.droneFlyingWh)
+        setValue(self, "viableDroneCharge", self.droneChargeViablep * self.droneChargeWh)        # thresholds to allow allocation - ie enough charge to be useful
+        setValue(self, "viableDroneFlyingWh", self.droneChargeViablep * self.droneFlyingWh)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DroneType is immutable - use replace() to get a type with different parameters")
+
+    def __reduce__(self):
+        """pickled as its parameters, unpickled through the registry - so drones restored from a checkpoint share types with new drones"""
+        return functools.partial(DroneType.get, self.stepSecs, **self.params()), ()
+
+    @classmethod
+    def get(cls, stepSecs=1.0, **params):
+        """the registered type with these parameters (defaults for any not given) and step length - created if it's new"""
+        values = dict(DroneType.defaults, **params)
+        key = stepSecs, tuple(values.items())
+        dt = DroneType.registry.get(key)
+        if dt is None:
+            dt = DroneType(stepSecs, **values)
+            DroneType.registry[key] = dt
+        return dt
+
+    def params(self):
+        """the parameters defining this type"""
+        return {name: getattr(self, name) for name in DroneType.defaults}
+
+    def replace(self, stepSecs=None, **params):
+        """the registered type with some parameters (or the step length) changed"""
+        if stepSecs is None:
+            stepSecs = self.stepSecs
+        return DroneType.get(stepSecs, **dict(self.params(), **params))
@@ -0,0 +1,134 @@
+"""Dummy EVs standing in for drone batteries at the charge hubs - so drone charging shows in the charging station output"""
+import traci
+
+from GlobalClasses import GlobalClasses as GG
+from ChargeHubs import ChargeHubs
+from TraciBuffer import TraciBuffer
+
+
+class DummyEVPool:
+    """Static class adding/removing the dummy EVs - by default a pair, named after the drone, is added when a drone arrives at a hub
+        and removed when it is charged or leaves. With pooling the pairs a hub has needed stay parked for the whole run, on the hub's
+        lane but clear of the charging station while idle, so they add no output rows. An arriving drone gets an idle pair moved onto
+        the station with only its battery values set, a leaving drone's pair is moved back off - pairs are only added when a hub has
+        more drones at it than ever before"""
+    pooling = False         # when False every drone arrival/departure adds/removes its own pair
+    stopSecs = 10000.0      # length of the stop for a drone's own pair
+    poolStopSecs = 1.0e7    # pooled pairs must stay parked for the whole simulation
+
+    stateTypes = set()      # dummy EVs' own types loaded with a checkpoint's SUMO state - SUMO can't make them again, Drone has the class anyway
+
+    idle = {}               # (edge, pos) -> pairs at that hub, parked off the station and not in use
+    poolHubs = {}           # pooled dummy EV -> (edge, pos) of its hub
+    maxWh = {}              # pooled dummy EV -> maximumBatteryCapacity last set, so we only set it when the drone type differs
+    addedSteps = {}         # pooled pair -> step it was added - SUMO only inserts it in the next step, so we can't move it in this one
+    pairs = 0               # count of pooled pairs added, for their IDs
+
+    inserts = 0             # count of dummy EVs added
+    removes = 0             # count of dummy EVs removed
+    reuses = 0              # count of pooled pairs moved onto a station for an arriving drone
+    traciCalls = 0          # TraCI calls made for dummy EVs
+
+    @staticmethod
+    def addPool(ep, maxWh, actualWh):
+        """add a pair to the pool of hub ep, parked on the station with the batteries given - returns the pair"""
+        pairID = "pool" + str(DummyEVPool.pairs)
+        pair = pairID + "-FB", pairID + "-CB"
+        DummyEVPool.pairs += 1
+        DummyEVPool.addedSteps[pair] = GG.ss.timeStep
+        for dummyID, offset, dummyMaxWh, dummyWh in zip(pair, (0.0, 0.5), maxWh, actualWh):
+            DummyEVPool.addDummy(dummyID, ep, offset, dummyMaxWh, dummyWh, DummyEVPool.poolStopSecs)
+            DummyEVPool.poolHubs[dummyID] = ep
+            DummyEVPool.maxWh[dummyID] = dummyMaxWh
+        return pair
+
+    @staticmethod
+    def addPair(droneID, ep, flyingMaxWh, flyingWh, chargeMaxWh, chargeWh):
+        """the dummy EVs for a drone arriving at hub ep - an idle pooled pair moved onto the station, a new pooled pair when
+            there's none idle, or without pooling (or room off the station to keep a pool) a pair of its own"""
+        e, p = ep
+        if DummyEVPool.pooling and DummyEVPool.idle.get(ep):
+            pair = DummyEVPool.idle[ep].pop()
+            for dummyID, offset, maxWh, actualWh in zip(pair, (0.0, 0.5), (flyingMaxWh, chargeMaxWh), (flyingWh, chargeWh)):
+                traci.vehicle.moveTo(dummyID, e + "_0", p + offset)
+                DummyEVPool.setBattery(dummyID, maxWh, actualWh)
+                DummyEVPool.traciCalls += 1
+            DummyEVPool.reuses += 1
+            return pair
+        if DummyEVPool.pooling and ChargeHubs.offStationPosition(e) is not None:
+            return DummyEVPool.addPool(ep, (flyingMaxWh, chargeMaxWh), (flyingWh, chargeWh))
+
+        DummyEVPool.addDummy(droneID + "-FB", ep, 0.0, flyingMaxWh, flyingWh, DummyEVPool.stopSecs)
+        DummyEVPool.addDummy(droneID + "-CB", ep, 0.5, chargeMaxWh, chargeWh, DummyEVPool.stopSecs)
+        return droneID + "-FB", droneID + "-CB"
+
+    @staticmethod
+    def addDummy(dummyID, ep, offset, maxWh, actualWh, stopSecs):
+        """add a dummy EV parked at hub ep with the given battery"""
+        e, p = ep
+        traci.vehicle.add(dummyID, e, "Drone", departLane=0, departPos=p + offset)
+        TraciBuffer.vehicleSetParameter(dummyID, "device.battery.maximumBatteryCapacity", maxWh)
+        TraciBuffer.vehicleSetParameter(dummyID, "device.battery.actualBatteryCapacity", actualWh)
+        if "Drone@" + dummyID not in DummyEVPool.stateTypes:
+            traci.vehicle.setEmissionClass(dummyID, "Energy/unknown")
+        traci.vehicle.setStop(dummyID, e, pos=p + offset, duration=stopSecs, flags=1)
+        DummyEVPool.traciCalls += 5
+        DummyEVPool.inserts += 1
+        GG.cc.insertedDummies += 1
+
+    @staticmethod
+    def release(pair):
+        """a drone has left the hub - move its pair off the station, or remove it if it isn't pooled or was only added in this step"""
+        if DummyEVPool.addedSteps.get(pair, -1) == GG.ss.timeStep:
+            del DummyEVPool.addedSteps[pair]
+            for dummyID in pair:
+                del DummyEVPool.poolHubs[dummyID], DummyEVPool.maxWh[dummyID]
+        if pair[0] not in DummyEVPool.poolHubs:
+            for dummyID in pair:
+                DummyEVPool.removeDummy(dummyID)
+            return
+        ep = DummyEVPool.poolHubs[pair[0]]
+        offPos = ChargeHubs.offStationPosition(ep[0])
+        for dummyID, offset in zip(pair, (0.0, 0.5)):
+            traci.vehicle.moveTo(dummyID, ep[0] + "_0", offPos + offset)
+            DummyEVPool.traciCalls += 1
+        DummyEVPool.idle.setdefault(ep, []).append(pair)
+
+    @staticmethod
+    def removeAll():
+        """remove every pooled dummy EV - called when the simulation has finished"""
+        for dummyID in DummyEVPool.poolHubs:
+            DummyEVPool.removeDummy(dummyID)
+        DummyEVPool.poolHubs.clear()
+        DummyEVPool.maxWh.clear()
+        DummyEVPool.addedSteps.clear()
+        DummyEVPool.idle.clear()
+
+    @staticmethod
+    def removeDummy(dummyID):
+        """remove a dummy EV - we need to resume before remove to avoid the aborted stop warning"""
+        try:
+            DummyEVPool.traciCalls += 1
+            stState = traci.vehicle.getStopState(dummyID)
+            if stState & 2 == 2:                          # only need to resume if it's actually stopped
+                DummyEVPool.traciCalls += 1
+                traci.vehicle.resume(dummyID)
+        except Exception as e:
+            pass
+            #print("resume except ",e)  - was doing a resums when parking had not actually happened - may not need this now
+        finally:
+            traci.vehicle.remove(dummyID)
+            TraciBuffer.discard(dummyID)
+            DummyEVPool.traciCalls += 1
+            DummyEVPool.removes += 1
+            GG.cc.insertedDummies -= 1
+
+    @staticmethod
+    def setBattery(dummyID, maxWh, actualWh):
+        """point a pooled dummy EV at a drone battery"""
+        if DummyEVPool.maxWh[dummyID] != maxWh:
+            TraciBuffer.vehicleSetParameter(dummyID, "device.battery.maximumBatteryCapacity", maxWh)
+            DummyEVPool.maxWh[dummyID] = maxWh
+            DummyEVPool.traciCalls += 1
+        TraciBuffer.vehicleSetParameter(dummyID, "device.battery.actualBatteryCapacity", actualWh)
+        DummyEVPool.traciCalls += 1
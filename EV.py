@@ -1,8 +1,11 @@
 """Electric Vehicle classes"""
 from enum import Enum
 import traci
+import traci.constants as tc
 
 from GlobalClasses import GlobalClasses as GG
+from TraciBuffer import TraciBuffer
+from TraciCache import TraciCache
 
 
 class EV:
@@ -31,12 +34,29 @@ class EV:
     # average distance vehicle will travel per Wh
     kmPerWh = 6.5 / 1000.   # default average used to compute vehicle range
 
+    # range estimate - only kept when the control centre weights urgency
+    estimatingRange = False
+    rangeSampleSteps = 60   # steps of driving between samples - the distance travelled is read with the battery value we read anyway
+    rangeSampleM = 100.0    # minimum distance(metres) between samples for the consumption to be meaningful
+    rangeAlpha = 0.2        # weight of the latest sample in the exponentially weighted Wh/km
+
     evCount = 0         # count of EVs
     evChargeSteps = 0   # total steps when EVs were charging
     evChargeGap = 0.0   # total charge gap
     evChargeCount = 0   # total no of full charges
 
-    def __init__(self, evID, kmPerWh=0.0):
+    colours = {}        # colour tuples interned so EVs of the same colour share one
+
+    vTypes = {}         # vType -> (has.battery.device, chargeRequestWh, chargeRequestThresholdWh) as set in the type - read the first time we see it
+    loadedChecked = 0   # count of loaded vehicles checked for a battery device
+    loadedCalls = 0     # TraCI calls made checking loaded vehicles and reading their charge overrides
+
+    # we may shadow hundreds of thousands of EVs in a run, so no per instance dict
+    __slots__ = ("myKmPerWh", "myID", "myState", "myPosition", "myRendezvous", "myDrone", "myColour", "myChargeCount", "myChargeSteps",
+                 "myChaseSteps", "myCapacity", "myChargeNeededThreshold", "myevChargeRequestWh", "myChargeDone", "myLastChargeRequest", "mySeq",
+                 "myWhPerKm", "myRangeSteps", "myRangeDistance", "myRangeCapacity", "myLane", "myLanePosition", "myLaneStep")
+
+    def __init__(self, evID, kmPerWh=0.0, overrides=("", "", "", "")):
         if kmPerWh <= 0.0:
             self.myKmPerWh = EV.kmPerWh
         else:
@@ -45,9 +65,12 @@ class EV:
         self.myID = evID
         self.myState = EV.EVState.DRIVING
         self.myPosition = (0., 0.)
+        self.myLane = ""            # lane and position on it - only kept for the drone log, when read with myPosition
+        self.myLanePosition = 0.
+        self.myLaneStep = -1        # the step they were read in
         self.myRendezvous = (0., 0.)
         self.myDrone = None
-        self.myColour = traci.vehicle.getColor(self.myID)
+        self.myColour = None        # read when we first change it - most EVs never request charge
         self.myChargeCount = 0
         self.myChargeSteps = 0
         self.myChaseSteps = 0
@@ -56,7 +79,7 @@ class EV:
         self.myChargeNeededThreshold = EV.chargeNeededThreshold
         self.myevChargeRequestWh = EV.evChargeRequestWh
 
-        self.setEVOverrides(self.myID)
+        self.setEVOverrides(*overrides)
 
         if GG.usingRandom():
             variation = EV.pRandomVariation * self.myevChargeRequestWh
@@ -71,6 +94,11 @@ class EV:
         # Drone is now responsible for stopping charging after delivering requested amount
         self.myChargeDone = self.myChargeNeededThreshold + self.myevChargeRequestWh
         self.myLastChargeRequest =  self.myevChargeRequestWh
+        self.mySeq = EV.evCount     # order of creation - the order EVs are updated in
+        self.myWhPerKm = 1. / self.myKmPerWh     # consumption estimate - starts from the average
+        self.myRangeSteps = 0
+        self.myRangeDistance = None     # distance and battery at the last sample - None until we've sampled since driving (again)
+        self.myRangeCapacity = 0.0
         EV.evCount += 1
 
     def __del__(self):
@@ -86,6 +114,28 @@ class EV:
         """save the drone/ev relationship and set rendezvous position - may be None"""
         self.myRendezvous = rvPos
         self.myDrone = drone
+        GG.ss.activateEV(self)
+
+    @staticmethod
+    def checkLoaded(vehID, now):
+        """check whether a newly loaded vehicle is an EV - returns its charge overrides (type, vehicle) for EV() if it is, otherwise None
+            the vehicle's type and its own overrides come in one batched read, the type's values from the vType cache"""
+        traci.vehicle.subscribe(vehID, (tc.VAR_TYPE, tc.VAR_PARAMETER, tc.VAR_PARAMETER_WITH_KEY), now, now,   # ends with this step
+                                parameters={tc.VAR_PARAMETER: ("s", "chargeRequestWh"), tc.VAR_PARAMETER_WITH_KEY: ("s", "chargeRequestThresholdWh")})
+        values = traci.vehicle.getSubscriptionResults(vehID)
+        EV.loadedChecked += 1
+        EV.loadedCalls += 1
+
+        vType = values[tc.VAR_TYPE]
+        if vType not in EV.vTypes:
+            EV.vTypes[vType] = tuple(traci.vehicletype.getParameter(vType, key) for key in ("has.battery.device", "chargeRequestWh", "chargeRequestThresholdWh"))
+            EV.loadedCalls += 3
+        hasBattery, typeChargeWh, typeThresholdWh = EV.vTypes[vType]
+        if hasBattery != "true":        # the device could still come from the vehicle definition or the sumo device options
+            EV.loadedCalls += 1
+            if traci.vehicle.getParameter(vehID, "has.battery.device") != "true":
+                return None
+        return typeChargeWh, values[tc.VAR_PARAMETER], typeThresholdWh, values[tc.VAR_PARAMETER_WITH_KEY][1]
 
     def captureStats(self):
         """Add statistics for this vehicle into class variables - called when EV leaves"""
@@ -93,6 +143,50 @@ class EV:
         EV.evChargeCount += self.myChargeCount
         EV.evChargeSteps += self.myChargeSteps
 
+    def droneUpdate(self, pos):
+        """update my drone - fleet drones report back through droneUpdated once the whole fleet has moved"""
+        evState = self.myState
+        result = self.myDrone.update(pos)
+        if result is None:
+            self.myDrone.reportTo(self, evState)
+        else:
+            self.droneUpdated(evState, *result)
+
+    def droneUpdated(self, evState, uStatus, chWh):
+        """react to the outcome of my drone's update - evState is my state when the update was requested"""
+        match evState:
+            case EV.EVState.WAITINGFORRENDEZVOUS:
+                if uStatus:
+                    self.myState = EV.EVState.WAITINGFORDRONE
+                    GG.cc.notifyRendezvous(self)
+
+            case EV.EVState.WAITINGFORDRONE:
+                if uStatus:
+                    if self.myState == EV.EVState.WAITINGFORDRONE:       # drone.update could have called EV.stopCharging
+                        self.myDrone.notifyChase(True, self.myChaseSteps)
+                        TraciBuffer.vehicleSetColor(self.myID, (0, 255, 0, 255))  # green
+                        self.myState = EV.EVState.CHARGINGFROMDRONE
+                        self.myCapacity = float(TraciBuffer.vehicleGetParameter(self.myID, "device.battery.actualBatteryCapacity"))
+                        GG.cc.notifyEVState(self, self.myState, self.myDrone, self.myCapacity)
+                        self.myChargeDone = self.myCapacity + self.myLastChargeRequest # not quite right yet the charge will include usage whilst rendezvousing and charging
+                    else:   # failed chase because drone broke off and changed my state via EV.stopCharging
+                        self.myDrone.notifyChase(False, self.myChaseSteps)
+                        TraciBuffer.vehicleSetColor(self.myID, self.myColour)
+                        self.myDrone = None
+
+            case EV.EVState.CHARGINGFROMDRONE:
+                if uStatus is False:   # either charge is finished or drone has broken off
+                    if self.myState == EV.EVState.CHARGEREQUESTED:     # drone broke off before charge completed
+                        self.myDrone = None
+                    if self.myState == EV.EVState.DRIVING:   # Charge finished
+                        TraciBuffer.vehicleSetColor(self.myID, self.myColour)
+                        self.myDrone = None
+                        self.myChargeCount += 1
+                else:
+                    self.myCapacity += chWh
+                    TraciBuffer.vehicleSetParameter(self.myID, "device.battery.actualBatteryCapacity", self.myCapacity)
+                    self.myChargeSteps += 1
+
     def getID(self):
         """getter function for EV identity"""
         return self.myID
@@ -101,6 +195,12 @@ class EV:
         """getter for my average usage"""
         return self.myKmPerWh
 
+    def getMyRange(self):
+        """distance(km) I can travel on my battery now - from my consumption estimate. A waiting EV isn't updated, so this
+            reads the battery again (once a step, through the cache)"""
+        self.myCapacity = float(TraciBuffer.vehicleGetParameter(self.myID, "device.battery.actualBatteryCapacity"))
+        return self.myCapacity / self.myWhPerKm
+
     def getMyPosition(self):
         """getter function for x, y position"""
         return self.myPosition
@@ -109,11 +209,8 @@ class EV:
         """State change"""
         self.myState = EV.EVState.LEFTSIMULATION
 
-    def setEVOverrides(self,myID):
+    def setEVOverrides(self, overrideChargeWh, vehicleOverrideChargeWh, overrideChargeRequestThresholdWh, vehicleChargeRequestThresholdWh):
         """ check to see if we have an override defined for charge request - could be in type or vehicle definition - vehicle takes precedence"""
-        vType = traci.vehicle.getTypeID(myID)
-        overrideChargeWh = traci.vehicletype.getParameter(vType,"chargeRequestWh")
-        vehicleOverrideChargeWh = traci.vehicle.getParameter(myID, "chargeRequestWh")
         oWh = 0
         if len(overrideChargeWh) > 1:
            oWh = float(overrideChargeWh)
@@ -122,8 +219,6 @@ class EV:
         if oWh > 1:
            self.myevChargeRequestWh = oWh
 
-        overrideChargeRequestThresholdWh = traci.vehicletype.getParameter(vType,"chargeRequestThresholdWh")
-        vehicleChargeRequestThresholdWh = traci.vehicle.getParameter(myID, "chargeRequestThresholdWh")
         oWh = 0.
         if len(overrideChargeRequestThresholdWh) > 1:
            oWh = float(overrideChargeRequestThresholdWh)
@@ -132,7 +227,27 @@ class EV:
         if oWh > 5000:
            self.myChargeNeededThreshold = oWh
 
-
+    def readCapacity(self):
+        """read my battery in DRIVING - every rangeSampleSteps the distance travelled comes in the same call,
+            to update my exponentially weighted Wh/km"""
+        self.myRangeSteps += 1
+        if self.myRangeSteps < EV.rangeSampleSteps and self.myRangeDistance is not None:
+            self.myCapacity = float(TraciBuffer.vehicleGetParameter(self.myID, "device.battery.actualBatteryCapacity"))
+            return
+        self.myRangeSteps = 0
+        traci.vehicle.subscribe(self.myID, (tc.VAR_DISTANCE, tc.VAR_PARAMETER_WITH_KEY), GG.ss.now, GG.ss.now,   # ends with this step
+                                parameters={tc.VAR_PARAMETER_WITH_KEY: ("s", "device.battery.actualBatteryCapacity")})
+        values = traci.vehicle.getSubscriptionResults(self.myID)
+        self.myCapacity = float(values[tc.VAR_PARAMETER_WITH_KEY][1])
+        distance = values[tc.VAR_DISTANCE]
+        if self.myRangeDistance is not None:
+            metres = distance - self.myRangeDistance
+            if metres < EV.rangeSampleM:
+                return          # keep the old baseline until we've gone far enough
+            whPerKm = max(0.0, 1000. * (self.myRangeCapacity - self.myCapacity) / metres)     # recuperation can make a sample negative
+            self.myWhPerKm += EV.rangeAlpha * (whPerKm - self.myWhPerKm)
+        self.myRangeDistance = distance
+        self.myRangeCapacity = self.myCapacity
 
     def setLastChargeRequest(self):
         """Work out how much charge (in Wh) is needed"""
@@ -144,7 +259,15 @@ class EV:
         """get real EV position from simulation and set my variable"""
         if self.myState == EV.EVState.WAITINGFORRENDEZVOUS:     # never called from this state so
             self.myDrone.notifyChase(False, self.myChaseSteps)  # must be failed chase
-        self.myPosition = traci.vehicle.getPosition(self.myID)
+        if GG.dronePrint:       # the drone log wants our lane too, so read it in the same call
+            traci.vehicle.subscribe(self.myID, (tc.VAR_POSITION, tc.VAR_LANE_ID, tc.VAR_LANEPOSITION), GG.ss.now, GG.ss.now)    # ends with this step
+            values = traci.vehicle.getSubscriptionResults(self.myID)
+            self.myPosition = values[tc.VAR_POSITION]
+            self.myLane = values[tc.VAR_LANE_ID]
+            self.myLanePosition = values[tc.VAR_LANEPOSITION]
+            self.myLaneStep = GG.ss.timeStep
+        else:
+            self.myPosition = TraciCache.vehicleGetPosition(self.myID)
 
     def stopCharging(self, remainingCharge):
         """state change triggered by drone or ev leaving"""
@@ -155,7 +278,7 @@ class EV:
                 GG.cc.requestCharge(self, self.myCapacity, remainingCharge)
                 self.myDrone = None
             else:       # charge completed so log charge
-                self.myCapacity = float(traci.vehicle.getParameter(self.myID, "device.battery.actualBatteryCapacity"))
+                self.myCapacity = float(TraciBuffer.vehicleGetParameter(self.myID, "device.battery.actualBatteryCapacity"))
                 self.myState = EV.EVState.DRIVING
                 GG.cc.notifyEVState(self, self.myState, self.myDrone, self.myCapacity)
                 self.myDrone = None
@@ -168,13 +291,22 @@ class EV:
         match self.myState:
             case EV.EVState.DRIVING:
                 if (self.myChargeCount < 1) or (not GG.onlyChargeOnce):
-                    self.myCapacity = float(traci.vehicle.getParameter(self.myID, "device.battery.actualBatteryCapacity"))
+                    if EV.estimatingRange:
+                        self.readCapacity()
+                    else:
+                        self.myCapacity = float(TraciBuffer.vehicleGetParameter(self.myID, "device.battery.actualBatteryCapacity"))
                     if self.myCapacity < self.myChargeNeededThreshold:
+                        self.myRangeDistance = None     # charge comes in before we drive on, so restart sampling
                         self.setMyPosition()
-                        traci.vehicle.setColor(self.myID, (255, 0, 0, 255))   # red
+                        if self.myColour is None:
+                            colour = traci.vehicle.getColor(self.myID)
+                            self.myColour = EV.colours.setdefault(colour, colour)
+                        TraciBuffer.vehicleSetColor(self.myID, (255, 0, 0, 255))   # red
                         self.myState = EV.EVState.CHARGEREQUESTED
                         self.setLastChargeRequest()
                         GG.cc.requestCharge(self, self.myCapacity, self.myLastChargeRequest)
+                else:                   # can't request charge again
+                    GG.ss.retireEV(self)
 
             case EV.EVState.CHARGEREQUESTED:
                 if self.myDrone:
@@ -186,44 +318,23 @@ class EV:
                       self.setMyPosition()
                       self.myDrone.update(self.myPosition)
                       self.myState = EV.EVState.WAITINGFORDRONE
+                else:                   # nothing to do until we're allocated a drone
+                    GG.ss.waitForDrone(self)
 
             case EV.EVState.WAITINGFORRENDEZVOUS:
                 if self.myDrone:
-                    if self.myDrone.update(self.myRendezvous)[0]:
-                        self.myState = EV.EVState.WAITINGFORDRONE
+                    self.droneUpdate(self.myRendezvous)
 
             case EV.EVState.WAITINGFORDRONE:
                 self.setMyPosition()
                 self.myChaseSteps += 1
                 if self.myDrone:
-                    if self.myDrone.update(self.myPosition)[0]:
-                        if self.myState == EV.EVState.WAITINGFORDRONE:       # drone.update could have called EV.stopCharging
-                            self.myDrone.notifyChase(True, self.myChaseSteps)
-                            traci.vehicle.setColor(self.myID, (0, 255, 0, 255))  # green
-                            self.myState = EV.EVState.CHARGINGFROMDRONE
-                            self.myCapacity = float(traci.vehicle.getParameter(self.myID, "device.battery.actualBatteryCapacity"))
-                            GG.cc.notifyEVState(self, self.myState, self.myDrone, self.myCapacity)
-                            self.myChargeDone = self.myCapacity + self.myLastChargeRequest # not quite right yet the charge will include usage whilst rendezvousing and charging
-                        else:   # failed chase because drone broke off and changed my state via EV.stopCharging
-                            self.myDrone.notifyChase(False, self.myChaseSteps)
-                            traci.vehicle.setColor(self.myID, self.myColour)
-                            self.myDrone = None
+                    self.droneUpdate(self.myPosition)
 
             case EV.EVState.CHARGINGFROMDRONE:
                 self.setMyPosition()
-                self.myCapacity = float(traci.vehicle.getParameter(self.myID, "device.battery.actualBatteryCapacity"))
-                uStatus, chWh = self.myDrone.update(self.myPosition)
-                if uStatus is False:   # either charge is finished or drone has broken off
-                    if self.myState == EV.EVState.CHARGEREQUESTED:     # drone broke off before charge completed
-                        self.myDrone = None
-                    if self.myState == EV.EVState.DRIVING:   # Charge finished
-                        traci.vehicle.setColor(self.myID, self.myColour)
-                        self.myDrone = None
-                        self.myChargeCount += 1
-                else:
-                    self.myCapacity += chWh
-                    traci.vehicle.setParameter(self.myID, "device.battery.actualBatteryCapacity", self.myCapacity)
-                    self.myChargeSteps += 1
+                self.myCapacity = float(TraciBuffer.vehicleGetParameter(self.myID, "device.battery.actualBatteryCapacity"))
+                self.droneUpdate(self.myPosition)
 
             case EV.EVState.LEFTSIMULATION:
                 self.captureStats()
@@ -7,22 +7,24 @@ class GlobalClasses:
     cc = None   # ControlCentre
     ss = None   # Simulation
     ch = None   # ChargeHubs
+    fleet = None    # DroneFleet - only when drones are advanced as a vectorised fleet
 
     modelRendezvous = True  # whether we estimate a rendezvous point for drone/ev
     onlyChargeOnce = True   # whether we are allowed to charge EVs more than once in a simulation
     chargePrint = False     # Whether to print a charging log
 
-    chargeLog = None        # Filename for the charging log
+    chargeLog = None        # LogSink for the charging log
     dronePrint = False      # Whether to print a drone activity log
-    droneLog = None         # Filename for the drone log
+    droneLog = None         # LogSink for the drone log
 
     droneKmPerHr = 60.0     # default drone speed - to allow command line override
     useRandom = False       # whether to generate 'random' charge requests
 
-    def __init__(self, cc, ss, ch):
+    def __init__(self, cc, ss, ch, fleet=None):
         GlobalClasses.cc = cc
         GlobalClasses.ss = ss
         GlobalClasses.ch = ch
+        GlobalClasses.fleet = fleet
 
     @classmethod
     def getDroneSpeed(cls):
@@ -0,0 +1,108 @@
+"""Rolling statistics written every n simulated seconds while the simulation runs"""
+import json
+
+from Drone import Drone
+
+
+class IntervalStats:
+    """Static class keeping window aggregates up to date from drone state changes and control centre events, so nothing
+        is re-scanned when a window is written. Energy is the integral of the Wh per step of the drones in each state"""
+    sink = None             # LogSink the windows are written to - None when not collecting
+    csv = False             # write CSV rather than JSON lines
+    intervalSteps = 300     # steps in a window
+    fields = ("time", "step", "pendingRequests", "freeDrones", "busyDrones", "chargingDrones",
+              "requests", "allocations", "completions", "breakOffs", "chargeWh", "flyingWh")
+
+    # a drone fully charged at its hub is in NULLState
+    freeStates = (Drone.DroneState.NULLState, Drone.DroneState.PARKED, Drone.DroneState.FLYINGTOPARK)
+    busyStates = (Drone.DroneState.FLYINGTORENDEZVOUS, Drone.DroneState.FLYINGTOEV, Drone.DroneState.CHARGINGEV)
+    chargingStates = (Drone.DroneState.FLYINGTOCHARGE, Drone.DroneState.CHARGINGDRONE)
+    flyingStates = (Drone.DroneState.FLYINGTORENDEZVOUS, Drone.DroneState.FLYINGTOEV, Drone.DroneState.FLYINGTOCHARGE, Drone.DroneState.FLYINGTOPARK)
+
+    chargeRate = 0.0        # Wh per step given to EVs by the drones charging them
+    flyingRate = 0.0        # Wh per step used by the drones flying
+    accruedStep = 0         # step the energy totals are accrued to
+
+    windowStart = 0         # step the current window started
+    requests = 0            # counts for the current window
+    allocations = 0
+    completions = 0
+    breakOffs = 0
+    chargeWh = 0.0
+    flyingWh = 0.0
+
+    @staticmethod
+    def resume(step, drones):
+        """windows start at step, in a run restored from a checkpoint - the rates are for the drones already charging EVs or flying"""
+        IntervalStats.accruedStep = IntervalStats.windowStart = step
+        for drone in drones:
+            if drone.myState == Drone.DroneState.CHARGINGEV:
+                IntervalStats.chargeRate += drone.myDt.WhEVChargeRatePerTimeStep
+            elif drone.myState in IntervalStats.flyingStates:
+                IntervalStats.flyingRate += drone.myDt.droneFlyingWhperTimeStep
+
+    @staticmethod
+    def start(sink, intervalSecs, stepSecs):
+        """start collecting - windows of intervalSecs are written to sink, as CSV if its name ends .csv(.gz/.zst)"""
+        IntervalStats.sink = sink
+        IntervalStats.csv = ".csv" in sink.name
+        IntervalStats.intervalSteps = max(1, round(intervalSecs / stepSecs))
+        if IntervalStats.csv:
+            sink.log(",".join(IntervalStats.fields))
+
+    @staticmethod
+    def accrue(step):
+        """bring the energy totals up to step at the current rates"""
+        steps = step - IntervalStats.accruedStep
+        if steps > 0:
+            IntervalStats.chargeWh += steps * IntervalStats.chargeRate
+            IntervalStats.flyingWh += steps * IntervalStats.flyingRate
+            IntervalStats.accruedStep = step
+
+    @staticmethod
+    def close(step, now, pendingRequests, stateCounts):
+        """write the last, part, window and close the file"""
+        if IntervalStats.sink is None:
+            return
+        if step > IntervalStats.windowStart:
+            IntervalStats.write(step, now, pendingRequests, stateCounts)
+        IntervalStats.sink.close()
+        IntervalStats.sink = None
+
+    @staticmethod
+    def droneStateChanged(drone, step, oldState, newState):
+        """a drone has changed state - move it between the rates. Only breaking off sends a drone from serving an EV to charge"""
+        IntervalStats.accrue(step)
+        if newState == Drone.DroneState.FLYINGTOCHARGE and oldState in IntervalStats.busyStates:
+            IntervalStats.breakOffs += 1
+        if oldState == Drone.DroneState.CHARGINGEV:
+            IntervalStats.chargeRate -= drone.myDt.WhEVChargeRatePerTimeStep
+        elif oldState in IntervalStats.flyingStates:
+            IntervalStats.flyingRate -= drone.myDt.droneFlyingWhperTimeStep
+        if newState == Drone.DroneState.CHARGINGEV:
+            IntervalStats.chargeRate += drone.myDt.WhEVChargeRatePerTimeStep
+        elif newState in IntervalStats.flyingStates:
+            IntervalStats.flyingRate += drone.myDt.droneFlyingWhperTimeStep
+
+    @staticmethod
+    def update(step, now, pendingRequests, stateCounts):
+        """called each step - write the window if it's complete"""
+        if step - IntervalStats.windowStart >= IntervalStats.intervalSteps:
+            IntervalStats.write(step, now, pendingRequests, stateCounts)
+
+    @staticmethod
+    def write(step, now, pendingRequests, stateCounts):
+        """write the window ending at step and start the next - stateCounts are the control centre's drone counts by state"""
+        IntervalStats.accrue(step)
+        values = (now, step, pendingRequests, sum(stateCounts[state] for state in IntervalStats.freeStates),
+                  sum(stateCounts[state] for state in IntervalStats.busyStates), sum(stateCounts[state] for state in IntervalStats.chargingStates),
+                  IntervalStats.requests, IntervalStats.allocations, IntervalStats.completions, IntervalStats.breakOffs,
+                  round(IntervalStats.chargeWh, 1), round(IntervalStats.flyingWh, 1))
+        if IntervalStats.csv:
+            IntervalStats.sink.log(",".join(["{}"] * len(values)), *values)
+        else:
+            IntervalStats.sink.log("{}", json.dumps(dict(zip(IntervalStats.fields, values))))
+
+        IntervalStats.windowStart = step
+        IntervalStats.requests = IntervalStats.allocations = IntervalStats.completions = IntervalStats.breakOffs = 0
+        IntervalStats.chargeWh = IntervalStats.flyingWh = 0.0
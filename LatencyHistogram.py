@@ -0,0 +1,48 @@
+"""Fixed memory histogram of latencies, giving percentiles to a set relative precision"""
+import math
+
+
+class LatencyHistogram:
+    """Counts of values in logarithmic buckets - each bucket is precision wider than the one below, so a percentile is
+        within precision of the true value however many values are added, and memory is fixed by maxValue and precision"""
+    precision = 0.01        # relative width of a bucket
+    maxValue = 1.0e7        # values above this share the top bucket - max is still exact
+
+    def __init__(self):
+        self.base = math.log1p(LatencyHistogram.precision)
+        self.counts = [0] * (int(math.log(LatencyHistogram.maxValue) / self.base) + 2)     # bucket 0 holds values below 1
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """count a value"""
+        if value < 1:
+            bucket = 0
+        else:
+            bucket = min(int(math.log(value) / self.base) + 1, len(self.counts) - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def mean(self):
+        """mean of the values added"""
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def percentile(self, p):
+        """the value p% of the values are at or below - the upper edge of its bucket, kept within min and max"""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(p / 100. * self.count))
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                break
+        value = math.exp(bucket * self.base)
+        return min(max(value, self.min), self.max)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Offline analysis of drone (-o) and charge (-c) logs from past runs - streamed, so archives of any size can be summarised
+   run as:
+        python LogAnalyser.py [-h] [-j n] [-s file] logFile [logFile ...]
+"""
+import argparse
+import gzip
+import io
+import math
+from multiprocessing import Pool
+
+from LatencyHistogram import LatencyHistogram
+try:
+    import zstandard as zstd
+except ImportError:     # zstandard is only needed for .zst logs
+    zstd = None
+
+droneTitle = "timeStep\tDrone\tEV"
+chargeTitle = "timeStep\tEV id\tEV State"
+chunkBytes = 1 << 20    # lines are read in chunks of about this size
+flightActivities = ("flying", "arrived", "Arrived")     # drone log activities that end a step of flight
+
+
+def openLog(path):
+    """open a log as text - LogSink writes .gz and .zst compressed logs"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    if path.endswith(".zst"):
+        return io.TextIOWrapper(zstd.ZstdDecompressor().stream_reader(open(path, "rb")))
+    return open(path)
+
+
+def readChunks(log):
+    """the lines of a log, split into fields, a chunk at a time - so we never hold more than chunkBytes of the file"""
+    while True:
+        lines = log.readlines(chunkBytes)
+        if not lines:
+            return
+        yield [line.rstrip("\n").split("\t") for line in lines]
+
+
+def analyseDroneLog(log):
+    """totals per drone and per hub from a drone log - only the previous row of each drone is kept"""
+    drones = {}     # drone -> totals, with the last row seen
+    hubs = {}       # (x, y) -> hub usage
+    for chunk in readChunks(log):
+        for row in chunk:
+            if len(row) < 11:
+                continue
+            droneID, x, y, evWh, chargeWh, flyingWh, activity = row[1], float(row[5]), float(row[6]), float(row[7]), float(row[8]), float(row[9]), row[10]
+            d = drones.get(droneID)
+            if d is None:
+                d = drones[droneID] = {"rows": 0, "distance": 0.0, "flyingWh": 0.0, "flyingRechargeWh": 0.0, "chargeRechargeWh": 0.0,
+                                       "evWh": 0.0, "brokenOff": 0, "last": (x, y, chargeWh, flyingWh)}
+            lx, ly, lChargeWh, lFlyingWh = d["last"]
+            d["rows"] += 1
+            if activity.startswith(flightActivities):     # drones also move riding with the EV they charge
+                d["distance"] += math.dist((lx, ly), (x, y))
+            if flyingWh < lFlyingWh:
+                d["flyingWh"] += lFlyingWh - flyingWh
+            else:
+                d["flyingRechargeWh"] += flyingWh - lFlyingWh
+            if chargeWh > lChargeWh:
+                d["chargeRechargeWh"] += chargeWh - lChargeWh
+            d["evWh"] = max(d["evWh"], evWh)        # cumulative charge given to EVs
+            d["last"] = x, y, chargeWh, flyingWh
+
+            if activity == "breaking off":
+                d["brokenOff"] += 1
+            if activity in ("charging self", "Parked"):
+                hub = hubs.setdefault((round(x, 1), round(y, 1)), {"charging": 0, "parked": 0, "drones": set()})
+                hub["charging" if activity == "charging self" else "parked"] += 1
+                hub["drones"].add(droneID)
+
+    for d in drones.values():
+        d["chargeWh"], d["flyingResidualWh"] = d["last"][2], d["last"][3]
+        del d["last"]
+    for hub in hubs.values():
+        hub["drones"] = len(hub["drones"])
+    return {"drones": drones, "hubs": hubs}
+
+
+def analyseChargeLog(log, sessionFile=None):
+    """EV totals, charge sessions and request to charge latencies from a charge log - only the EVs still in the simulation are kept,
+        with their open session, so EVs are counted as they first appear and dropped when they leave. Latencies go into a fixed
+        memory histogram and finished sessions are written to sessionFile if given"""
+    open_ = {}      # ev -> session in progress, None between sessions
+    sessions = {"full": 0, "brokenDrone": 0, "brokenEV": 0, "reRequests": 0}
+    latencies = LatencyHistogram()
+    chargeWh = 0.0
+    evs = 0
+    for chunk in readChunks(log):
+        for row in chunk:
+            if len(row) < 6 or row[0] == "timeStep":
+                continue
+            step, evID, state, droneID, capacity, charge = int(float(row[0])), row[1], row[2], row[3], float(row[4]), float(row[5])
+            if evID not in open_:       # EV ids aren't reused in a run, so each EV is counted once
+                evs += 1
+                open_[evID] = None
+            chargeWh += charge
+            session = open_[evID]
+            if "CHARGEREQUESTED" in state:
+                if session is None or session["start"] is not None:
+                    session = open_[evID] = {"ev": evID, "request": step, "start": None, "drone": "", "chargeWh": 0.0}
+                else:       # the drone broke off before charging - latency counts from the first request
+                    sessions["reRequests"] += 1
+            elif "CHARGINGFROMDRONE" in state:
+                if session is not None:
+                    session["start"] = step
+                    session["drone"] = droneID
+                    latencies.add(step - session["request"])
+            elif session is not None and session["start"] is not None:      # the session has ended
+                session["chargeWh"] += charge
+                if "CHARGEBROKENOFF" in state:
+                    outcome = "brokenDrone"
+                elif "LEFTSIMULATION" in state:
+                    outcome = "brokenEV"
+                else:
+                    outcome = "full"
+                sessions[outcome] += 1
+                if sessionFile is not None:
+                    print("{}\t{}\t{}\t{}\t{}\t{}\t{:.1f}".format(evID, session["drone"], session["request"], session["start"], step, outcome, session["chargeWh"]),
+                          file=sessionFile)
+                open_[evID] = None
+            if "LEFTSIMULATION" in state:
+                open_.pop(evID, None)
+
+    return {"evs": evs, "chargeWh": chargeWh, "sessions": sessions, "latencies": latencies.count, "latencyMean": latencies.mean(),
+            "latencyP50": latencies.percentile(50), "latencyP90": latencies.percentile(90),
+            "latencyP99": latencies.percentile(99), "latencyMax": latencies.max or 0}
+
+
+def analyseFile(path, sessionPath=None):
+    """analyse one log - the kind of log is taken from its title line"""
+    with openLog(path) as log:
+        title = log.readline()
+        if title.startswith(droneTitle):
+            return path, "drone", analyseDroneLog(log)
+        if title.startswith(chargeTitle):
+            if sessionPath is None:
+                return path, "charge", analyseChargeLog(log)
+            with open(sessionPath, "a") as sessionFile:
+                return path, "charge", analyseChargeLog(log, sessionFile)
+    return path, "unknown", None
+
+
+def printDroneResults(r):
+    """print drone log results - in the style of the simulation summary"""
+    drones = r["drones"]
+    print("\tDrone Totals:\t(%i drones)\n\t\tDistance Km:\t%.2f\n\t\tFlying KWh:\t%.2f\n\t\tCharging KWh:\t%.2f" %
+          (len(drones), sum(d["distance"] for d in drones.values()) / 1000., sum(d["flyingWh"] for d in drones.values()) / 1000.,
+           sum(d["evWh"] for d in drones.values()) / 1000.))
+    print("\tDrone Charger usage:\n\t\tFlying KWh:\t{:.2f}\n\t\tCharge KWh:\t{:.2f}".format
+          (sum(d["flyingRechargeWh"] for d in drones.values()) / 1000., sum(d["chargeRechargeWh"] for d in drones.values()) / 1000.))
+    print("\tBroken off charges:\t{}".format(sum(d["brokenOff"] for d in drones.values())))
+    print("\tResiduals:\n\t\tFlying KWh:\t{:.1f}\n\t\tCharging KWh:\t{:.1f}".format
+          (sum(d["flyingResidualWh"] for d in drones.values()) / 1000., sum(d["chargeWh"] for d in drones.values()) / 1000.))
+    for droneID, d in sorted(drones.items()):
+        print("\tdrone: {}\tKm: {:.2f}\tCharge KW: {:.2f}\tFlyingKW: {:.2f}\tResidual (chargeWh: {:.0f} flyingWh: {:.0f})".format
+              (droneID, d["distance"] / 1000., d["evWh"] / 1000., d["flyingWh"] / 1000., d["chargeWh"], d["flyingResidualWh"]))
+    print("\tHub utilisation (logged steps):")
+    for (x, y), hub in sorted(r["hubs"].items()):
+        print("\t\thub: ({:.1f}, {:.1f})\tcharging: {}\tparked: {}\tdrones: {}".format(x, y, hub["charging"], hub["parked"], hub["drones"]))
+
+
+def printChargeResults(r):
+    """print charge log results"""
+    print("\tEV Totals:\t(%i EVs)\n\t\tCharge KWh:\t%.1f" % (r["evs"], r["chargeWh"] / 1000.))
+    print("\t\tCharge Sessions:\n\t\t\tFull charges:\t{}\n\t\t\tPart (drone):\t{}\n\t\t\tPart (ev):\t{}\n\t\t\tRe-requests:\t{}".format
+          (r["sessions"]["full"], r["sessions"]["brokenDrone"], r["sessions"]["brokenEV"], r["sessions"]["reRequests"]))
+    print("\tRequest to charge (steps):\t%i charges\tmean: %.1f\tp50: %.1f\tp90: %.1f\tp99: %.1f\tmax: %i" %
+          (r["latencies"], r["latencyMean"], r["latencyP50"], r["latencyP90"], r["latencyP99"], r["latencyMax"]))
+
+
+def main():
+    """Analyse the logs given"""
+    parser = argparse.ArgumentParser(description="summarise drone (-o) and charge (-c) logs from past runs - logs may be .gz or .zst compressed")
+    parser.add_argument('logFiles', help='drone or charge logs, the kind is taken from the title line', metavar='logFile', nargs='+')
+    parser.add_argument('-j', '--jobs', help='no of files to analyse in parallel, default 1', metavar='n', type=int, default=1)
+    parser.add_argument('-s', '--sessionFile', help='append per EV charge sessions from the charge logs to this file, default no output', metavar='filePath')
+    args = parser.parse_args()
+
+    if zstd is None and any(path.endswith(".zst") for path in args.logFiles):
+        print(" .zst logs need zstandard, which is not installed")
+        return
+
+    work = [(path, args.sessionFile) for path in args.logFiles]
+    if args.sessionFile:
+        with open(args.sessionFile, "a") as sessionFile:
+            print("EV\tDrone\tRequested\tCharge start\tCharge end\tOutcome\tCharge Wh", file=sessionFile)
+        args.jobs = 1           # sessions from different logs must not interleave
+    if args.jobs > 1:
+        with Pool(args.jobs) as pool:
+            results = pool.starmap(analyseFile, work)
+    else:
+        results = [analyseFile(*w) for w in work]
+
+    for path, kind, r in results:
+        print("\n%s:\t(%s log)" % (path, kind))
+        if kind == "drone":
+            printDroneResults(r)
+        elif kind == "charge":
+            printChargeResults(r)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Buffered, optionally compressed and threaded, writer for the drone and charge logs"""
+import gzip
+import io
+import queue
+import sys
+import threading
+try:
+    import zstandard as zstd
+except ImportError:     # zstandard is only needed for .zst logs
+    zstd = None
+
+
+class LogSink:
+    """A log file taking structured records - (format, values) - rather than formatted lines.
+        The file is compressed if its name ends .gz or .zst, and with threading on the records are
+        handed in batches to a background thread that formats and writes them, so the simulation doesn't wait on the log"""
+    threaded = False        # when False records are formatted and written as they're logged
+    batchSize = 1000        # records handed to the writer thread at a time
+    bufferBytes = 1 << 20   # size of the write buffer
+
+    def __init__(self, name):
+        """open a log file for appending - with a large buffer, or compressed. A name of - is stdout"""
+        self.name = name
+        if name == "-":
+            self.file = sys.stdout
+        elif name.endswith(".gz"):
+            self.file = gzip.open(name, "at")
+        elif name.endswith(".zst"):
+            self.file = io.TextIOWrapper(zstd.ZstdCompressor().stream_writer(open(name, "ab")), write_through=False)
+        else:
+            self.file = open(name, "a", buffering=LogSink.bufferBytes)
+
+        self.records = []       # records not yet handed to the writer thread
+        self.count = 0          # count of records logged
+        self.error = None       # exception raised in the writer thread
+        self.queue = None
+        self.thread = None
+        if LogSink.threaded:
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self.writer, name="LogSink " + self.name, daemon=True)
+            self.thread.start()
+
+    @staticmethod
+    def canWrite(name):
+        """whether we have what's needed to write a log of this name - ie zstandard for .zst"""
+        return zstd is not None or not name.endswith(".zst")
+
+    def close(self):
+        """write anything outstanding and close the file"""
+        if self.thread is not None:
+            self.handOver()
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.file is not sys.stdout:
+            self.file.close()
+        else:
+            self.file.flush()
+        if self.error is not None:
+            raise self.error
+
+    def handOver(self):
+        """pass the records logged so far to the writer thread"""
+        if self.records:
+            self.queue.put(self.records)
+            self.records = []
+
+    def log(self, format, *values):
+        """add a record - a line that is format.format(*values)"""
+        self.count += 1
+        if self.thread is None:
+            self.file.write(format.format(*values) + "\n")
+            return
+        self.records.append((format, values))
+        if len(self.records) >= LogSink.batchSize:
+            self.handOver()
+
+    def writer(self):
+        """background thread - format and write the batches of records until we get None"""
+        while True:
+            records = self.queue.get()
+            if records is None:
+                return
+            if self.error is None:
+                try:
+                    self.file.write("".join([format.format(*values) + "\n" for format, values in records]))
+                except Exception as e:     # report it when we close
+                    self.error = e
@@ -0,0 +1,125 @@
+"""Live metrics for long runs - served over local HTTP in the Prometheus text format"""
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import traci
+
+from Drone import Drone
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Answers scrapes with the last page the simulation published - it never touches the model itself"""
+
+    def do_GET(self):
+        """serve /metrics (or /)"""
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        page = Metrics.page
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        """no request log - stderr is for the progress dots"""
+
+
+class Metrics:
+    """Static class timing the phases of each step and counting TraCI calls. Once a second (wall clock) the simulation
+        renders the counters into a page, which the server thread hands to scrapers - so a scrape never waits on, or
+        holds up, the simulation loop"""
+    serving = False         # when False nothing is timed or counted
+    publishSecs = 1.0       # wall clock seconds between pages
+    server = None
+    page = b""              # the last page published - replaced whole, so the server thread always sees a complete page
+
+    traciCalls = 0          # TraCI commands sent to SUMO
+    phaseSecs = {}          # step phase -> seconds spent in it
+    lapStart = 0.0          # perf_counter at the end of the last phase timed
+
+    publishedAt = 0.0       # perf_counter, steps and TraCI calls when the last page was published - for the rates
+    publishedSteps = 0
+    publishedCalls = 0
+
+    @staticmethod
+    def countTraci():
+        """count the commands sent on the TraCI connection, once SUMO has started - every get, set, subscription and step goes through _sendCmd"""
+        connection = traci.getConnection()
+        sendCmd = connection._sendCmd
+
+        def countingSendCmd(*args):
+            Metrics.traciCalls += 1
+            return sendCmd(*args)
+        connection._sendCmd = countingSendCmd
+
+    @staticmethod
+    def lap(phase):
+        """add the time since the last lap to phase"""
+        if not Metrics.serving:
+            return
+        now = time.perf_counter()
+        Metrics.phaseSecs[phase] = Metrics.phaseSecs.get(phase, 0.0) + now - Metrics.lapStart
+        Metrics.lapStart = now
+
+    @staticmethod
+    def publish(cc, ss):
+        """render the page from the counters kept by the control centre, simulation and drones"""
+        now = time.perf_counter()
+        secs = now - Metrics.publishedAt
+        stepRate = (ss.timeStep - Metrics.publishedSteps) / secs
+        callRate = (Metrics.traciCalls - Metrics.publishedCalls) / secs
+        Metrics.publishedAt, Metrics.publishedSteps, Metrics.publishedCalls = now, ss.timeStep, Metrics.traciCalls
+
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append("# HELP drone_%s %s" % (name, help))
+            lines.append("# TYPE drone_%s %s" % (name, kind))
+            for labels, value in samples:
+                lines.append("drone_%s%s %s" % (name, labels, repr(float(value))))
+
+        metric("steps_total", "counter", "Simulation steps completed", [("", ss.timeStep)])
+        metric("simulation_time_seconds", "gauge", "SUMO time of the current step", [("", ss.now)])
+        metric("step_rate", "gauge", "Steps per wall clock second since the last page", [("", stepRate)])
+        metric("step_phase_seconds_total", "counter", "Wall clock seconds spent in each phase of the step",
+               [('{phase="%s"}' % phase, secs) for phase, secs in Metrics.phaseSecs.items()])
+        metric("traci_calls_total", "counter", "TraCI commands sent to SUMO", [("", Metrics.traciCalls)])
+        metric("traci_calls_rate", "gauge", "TraCI commands per wall clock second since the last page", [("", callRate)])
+        metric("charge_requests_pending", "gauge", "EVs waiting for a drone to be allocated", [("", len(cc.requests))])
+        metric("evs", "gauge", "EVs shadowed, by what the simulation does with them each step",
+               [('{state="active"}', len(ss.activeEVs)), ('{state="waiting"}', len(ss.waitingEVs)), ('{state="retired"}', len(ss.retiredEVs))])
+        metric("drones", "gauge", "Drones in each state", [('{state="%s"}' % state.name, n) for state, n in cc.droneStateCounts.items()])
+        metric("allocations_total", "counter", "Drones allocated to EVs", [("", cc.allocatedCount)])
+        metric("poi_writes_total", "counter", "Drone POI position writes sent", [("", Drone.poiWrites)])
+        Metrics.page = ("\n".join(lines) + "\n").encode("utf-8")
+
+    @staticmethod
+    def start(port):
+        """serve the metrics on localhost:port from a background thread"""
+        try:
+            Metrics.server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        except OSError as e:
+            print(" --metricsPort %i: %s" % (port, e))
+            sys.exit(1)
+        Metrics.server.daemon_threads = True
+        threading.Thread(target=Metrics.server.serve_forever, name="Metrics", daemon=True).start()
+        Metrics.serving = True
+        Metrics.publishedAt = Metrics.lapStart = time.perf_counter()
+
+    @staticmethod
+    def stop():
+        """stop serving"""
+        if Metrics.server is not None:
+            Metrics.server.shutdown()
+            Metrics.server.server_close()
+            Metrics.server = None
+        Metrics.serving = False
+
+    @staticmethod
+    def update(cc, ss):
+        """called at the end of each step - publish a new page once publishSecs has passed"""
+        if Metrics.serving and time.perf_counter() - Metrics.publishedAt >= Metrics.publishSecs:
+            Metrics.publish(cc, ss)
@@ -0,0 +1,100 @@
+"""Profiling of the simulation loop - cProfile or a sampling profiler, with periodic tracemalloc snapshots"""
+import cProfile
+import collections
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class Profiler:
+    """Static class running the simulation loop under a profiler, writing into the directory path:
+        profile.pstats and profile.txt (cProfile), or stacks.collapsed for flamegraph.pl/speedscope (sampling),
+        and memory.txt with the allocations that grew most between tracemalloc snapshots"""
+    path = None             # output directory - None when not profiling
+    sampling = False        # sample the stack rather than trace every call - much lower overhead, no call counts
+    sampleHz = 100          # stack samples a second
+    memorySteps = 0         # steps between tracemalloc snapshots, 0 for none
+    memoryTop = 10          # allocation lines reported for each snapshot
+    reportTop = 30          # functions listed in profile.txt
+
+    stacks = collections.Counter()      # collapsed stack -> samples
+    snapshot = None                     # the last tracemalloc snapshot
+
+    @staticmethod
+    def frameName(frame):
+        """a frame as it appears in a collapsed stack"""
+        return "%s:%s" % (os.path.basename(frame.f_code.co_filename), frame.f_code.co_qualname)
+
+    @staticmethod
+    def run(step):
+        """call step until it returns False, under the profiler"""
+        os.makedirs(Profiler.path, exist_ok=True)
+        if Profiler.memorySteps > 0:
+            tracemalloc.start()
+            Profiler.snapshot = Profiler.takeTraces()
+            open(os.path.join(Profiler.path, "memory.txt"), "w").close()
+
+        if Profiler.sampling:
+            done = threading.Event()
+            sampler = threading.Thread(target=Profiler.sample, args=(threading.get_ident(), done), name="Profiler", daemon=True)
+            sampler.start()
+            Profiler.steps(step)
+            done.set()
+            sampler.join()
+            with open(os.path.join(Profiler.path, "stacks.collapsed"), "w") as file:
+                for stack, count in Profiler.stacks.most_common():
+                    file.write("%s %i\n" % (stack, count))
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+            Profiler.steps(step)
+            profile.disable()
+            profile.dump_stats(os.path.join(Profiler.path, "profile.pstats"))
+            with open(os.path.join(Profiler.path, "profile.txt"), "w") as file:
+                pstats.Stats(profile, stream=file).sort_stats("cumulative").print_stats(Profiler.reportTop)
+
+        if Profiler.memorySteps > 0:
+            tracemalloc.stop()
+
+    @staticmethod
+    def sample(threadID, done):
+        """background thread - count the main thread's stack sampleHz times a second until done"""
+        interval = 1.0 / Profiler.sampleHz
+        while not done.wait(interval):
+            frame = sys._current_frames().get(threadID)
+            names = []
+            while frame is not None:
+                names.append(Profiler.frameName(frame))
+                frame = frame.f_back
+            if names:
+                Profiler.stacks[";".join(reversed(names))] += 1
+
+    @staticmethod
+    def steps(step):
+        """the simulation loop - taking a memory snapshot every memorySteps"""
+        count = 0
+        while step():
+            count += 1
+            if Profiler.memorySteps > 0 and count % Profiler.memorySteps == 0:
+                Profiler.takeSnapshot(count)
+
+    @staticmethod
+    def takeTraces():
+        """a tracemalloc snapshot, leaving out tracemalloc's own allocations"""
+        return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+    @staticmethod
+    def takeSnapshot(count):
+        """write the allocation lines that grew most since the last snapshot"""
+        start = time.perf_counter()
+        snapshot = Profiler.takeTraces()
+        current, peak = tracemalloc.get_traced_memory()
+        with open(os.path.join(Profiler.path, "memory.txt"), "a") as file:
+            file.write("step %i\tcurrent: %.1fMB\tpeak: %.1fMB\n" % (count, current / 1e6, peak / 1e6))
+            for stat in snapshot.compare_to(Profiler.snapshot, "lineno")[:Profiler.memoryTop]:
+                file.write("\t%s\n" % stat)
+            file.write("\t(snapshot took %.2fs)\n" % (time.perf_counter() - start))
+        Profiler.snapshot = snapshot
@@ -0,0 +1,84 @@
+"""Cache of finished run summaries in SQLite - keyed by a hash of the options, scenario files and code"""
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+
+class ResultCache:
+    """Static class looking up and storing run summaries. The key covers everything that changes the result - the options,
+        the sumocfg and the net/route/additional files it names, and the version and source of the model - so a sweep
+        re-running a point it has already finished gets the stored summary instead"""
+    path = None         # the SQLite database - None when not caching
+    key = None          # the hash of this run
+    # options that only choose where output goes, or how the run is observed - they don't change the result
+    outputOptions = ("sumocfg", "outputFile", "chargeFile", "trajectory", "intervalStats", "statsInterval", "summaryFile",
+                     "metricsPort", "profile", "profileSample", "memorySnapshots", "logThread", "resultCache", "checkpoint", "checkpointAt")
+    inputTags = ("net-file", "route-files", "additional-files")    # sumocfg entries naming scenario files
+
+    @staticmethod
+    def connect():
+        """open the database, creating the table if needed"""
+        db = sqlite3.connect(ResultCache.path)
+        db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, created TEXT, runstring TEXT, summary TEXT, record TEXT)")
+        return db
+
+    @staticmethod
+    def lookup():
+        """the stored (summary, record) for this run's key, or None - record is None if the run didn't make one"""
+        db = ResultCache.connect()
+        try:
+            row = db.execute("SELECT summary, record FROM results WHERE key = ?", (ResultCache.key,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]) if row[1] is not None else None
+
+    @staticmethod
+    def makeKey(options, sumocfg, version):
+        """hash the options (a dict from argparse), the scenario files, any checkpoint restored and the model version and source"""
+        h = hashlib.sha256()
+        h.update(json.dumps({k: v for k, v in sorted(options.items()) if k not in ResultCache.outputOptions}, default=str).encode())
+        checkpointFiles = sorted(glob.glob(os.path.join(options["restore"], "*"))) if options.get("restore") else []
+        for fileName in [sumocfg] + ResultCache.scenarioFiles(sumocfg) + checkpointFiles:
+            h.update(os.path.basename(fileName).encode())
+            try:
+                with open(fileName, "rb") as file:
+                    h.update(hashlib.sha256(file.read()).digest())
+            except OSError:     # SUMO will complain about it
+                pass
+        h.update(version.encode())
+        for fileName in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+            with open(fileName, "rb") as file:
+                h.update(hashlib.sha256(file.read()).digest())
+        ResultCache.key = h.hexdigest()
+        return ResultCache.key
+
+    @staticmethod
+    def scenarioFiles(sumocfg):
+        """the files named in the sumocfg inputs, relative to the sumocfg"""
+        try:
+            root = ET.parse(sumocfg).getroot()
+        except (OSError, ET.ParseError):
+            return []
+        files = []
+        for tag in ResultCache.inputTags:
+            for element in root.iter(tag):
+                for name in element.get("value", "").replace(",", " ").split():
+                    files.append(os.path.join(os.path.dirname(sumocfg), name))
+        return files
+
+    @staticmethod
+    def store(runstring, summary, record):
+        """store the summary (and record, if the run made one) of a finished run"""
+        db = ResultCache.connect()
+        try:
+            with db:
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                           (ResultCache.key, datetime.now().isoformat(), runstring, summary, json.dumps(record) if record is not None else None))
+        finally:
+            db.close()
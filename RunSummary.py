@@ -0,0 +1,41 @@
+"""Machine readable run summary - one record per run appended to JSON lines or a Parquet dataset"""
+import json
+import os
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:     # pyarrow is only needed for Parquet summaries
+    pa = None
+
+
+class RunSummary:
+    """Static class writing the summary record built by ControlCentre.summaryRecord. A path ending .parquet is a dataset
+        directory, each run adding its own file, so a sweep can be loaded with one read of the directory"""
+    path = None         # where to write the record - None for no record
+
+    @staticmethod
+    def flatten(record, prefix=""):
+        """nested dicts as dotted columns - lists (the per drone data) are kept as they are"""
+        flat = {}
+        for key, value in record.items():
+            if isinstance(value, dict):
+                flat.update(RunSummary.flatten(value, prefix + key + "."))
+            else:
+                flat[prefix + key] = value
+        return flat
+
+    @staticmethod
+    def isParquet(path):
+        """whether the summary goes to a Parquet dataset"""
+        return path.endswith(".parquet")
+
+    @staticmethod
+    def write(record):
+        """append the record for this run"""
+        if RunSummary.isParquet(RunSummary.path):
+            os.makedirs(RunSummary.path, exist_ok=True)
+            name = "%s-%i.parquet" % (record["timeStamp"].replace(":", ""), os.getpid())
+            pq.write_table(pa.Table.from_pylist([RunSummary.flatten(record)]), os.path.join(RunSummary.path, name))
+        else:
+            with open(RunSummary.path, "a") as file:
+                file.write(json.dumps(record) + "\n")
@@ -1,8 +1,16 @@
 """Module implementing the SUMO simulation loop"""
+import bisect
+import operator
 import sys
 import traci
 from GlobalClasses import GlobalClasses as GG
 from EV import EV
+from TraciBuffer import TraciBuffer
+from TraciCache import TraciCache
+from Metrics import Metrics
+from Checkpoint import Checkpoint
+
+bySeq = operator.attrgetter("mySeq")     # EVs are updated in order of creation
 
 class Simulation:
     """Class executing the simulation loop - tracks the timeStep"""
@@ -13,7 +21,12 @@ class Simulation:
     useChargeHubs = False   # whether we put drone charging output into charging station file - set true if the sumo options chargingstations-output is set
 
     timeStep = 0            # running count of simulation steps
+    now = 0.0               # SUMO time of the current step - subscriptions made in the step end then
     EVs = {}                # collection for the EVs we are managing
+    activeEVs = {}          # the EVs updated each step - polling their battery or interacting with a drone
+    waitingEVs = {}         # EVs that have requested charge and are waiting for the control centre to allocate a drone
+    retiredEVs = {}         # EVs that will never request charge again - kept until they leave for their statistics
+    activeOrder = []        # activeEVs in the order they were created - the order they are updated in, kept sorted as EVs are activated
     poiDrones = 0
 
     usingSumoGui = False    # flag to let us breadcrumb
@@ -26,6 +39,8 @@ class Simulation:
             sys.exit(1)
 
         self.stepSecs = traci.simulation.getDeltaT()
+        if Metrics.serving:
+            Metrics.countTraci()
 
         Simulation.maxEVs = maxEVs
         if traci.simulation.getOption("chargingstations-output"):
@@ -38,13 +53,29 @@ class Simulation:
     def __del__(self):
         traci.close()
         Simulation.EVs.clear()
+        Simulation.activeEVs.clear()
+        Simulation.activeOrder.clear()
+        Simulation.waitingEVs.clear()
+        Simulation.retiredEVs.clear()
+
+    @classmethod
+    def activateEV(cls, ev):
+        """a waiting EV has been allocated a drone so update it every step again"""
+        if ev.myID in Simulation.waitingEVs:
+            del Simulation.waitingEVs[ev.myID]
+            Simulation.activeEVs[ev.myID] = ev
+            bisect.insort(Simulation.activeOrder, ev, key=bySeq)
 
     @classmethod
     def step(cls):
         """Simulation step"""
         if  traci.simulation.getMinExpectedNumber() > GG.cc.insertedDummies:
+            Metrics.lap("between steps")
             traci.executeMove()                     #  move vehicles first so we can move drones to the same position
+            TraciCache.clear()                      #  so values read last step are stale
             Simulation.timeStep += 1
+            Simulation.now = traci.simulation.getTime()
+            Metrics.lap("move")
 
             if not Simulation.usingSumoGui:
                 op = int(Simulation.timeStep / 200) * 200
@@ -55,10 +86,14 @@ class Simulation:
                         print("", file=sys.stderr)
 
             loadedVehicles = traci.simulation.getLoadedIDList()     # add new EVs to our management list upto the maximum allowed
-            for vehID in loadedVehicles:
-                if traci.vehicle.getParameter(vehID, "has.battery.device") == "true":       # we are only interested in EVs
-                    if len(Simulation.EVs) < Simulation.maxEVs:
-                        Simulation.EVs[vehID] = EV(vehID,EV.kmPerWh)   # can set kmPerWh here to cater for different EVs - get from an EV parameter?
+            if loadedVehicles and len(Simulation.EVs) < Simulation.maxEVs:
+                for vehID in loadedVehicles:
+                    overrides = EV.checkLoaded(vehID, Simulation.now)
+                    if overrides is not None:                       # we are only interested in EVs
+                        if len(Simulation.EVs) < Simulation.maxEVs:
+                            Simulation.EVs[vehID] = EV(vehID, EV.kmPerWh, overrides)   # can set kmPerWh here to cater for different EVs - get from an EV parameter?
+                            Simulation.activeEVs[vehID] = Simulation.EVs[vehID]
+                            Simulation.activeOrder.append(Simulation.EVs[vehID])     # created last so it's last in order
 
             #tlist = traci.simulation.getStartingTeleportIDList();
             #if len(tlist) > 0:
@@ -70,19 +105,51 @@ class Simulation:
             if traci.simulation.getArrivedNumber() > 0:             # handle vehicles that have left the simulation
                 arrivedVehicles = traci.simulation.getArrivedIDList()
                 for aID in arrivedVehicles:
+                   TraciBuffer.discard(aID)                        # nothing more to write to this one
                    if aID in Simulation.EVs:
                        Simulation.EVs[aID].leftSimulation()        # notify EV shadow that the vehicle has left
                        Simulation.EVs[aID].update()                #  run the update as we will be removing this from the management loop
+                       if aID in Simulation.activeEVs:
+                           Simulation.deactivateEV(Simulation.EVs[aID])
                        del Simulation.EVs[aID]
+                       Simulation.waitingEVs.pop(aID, None)
+                       Simulation.retiredEVs.pop(aID, None)
 
-            for vehID,ev in Simulation.EVs.items():     # run the update (state machine) for each EV  we are managing
+            Metrics.lap("loaded and arrived")
+            for ev in list(Simulation.activeOrder):     # run the update (state machine) for each EV that needs it - the update may retire it or make it wait
                 ev.update()
+            if GG.fleet is not None:                # move the drones the EVs are managing, in one go
+                GG.fleet.update()
+            Metrics.lap("evs")
             GG.cc.update()                      # trigger control centre management on this step
+            Metrics.lap("control centre")
+            TraciBuffer.flush()                 # send the set calls buffered in this step
             traci.simulationStep()              # complete the SUMO step
+            Metrics.lap("sumo step")
+            Metrics.update(GG.cc, GG.ss)
+            Checkpoint.update(GG.cc, GG.ss)
 
             return True
         return False
 
+    @classmethod
+    def deactivateEV(cls, ev):
+        """stop updating an EV each step"""
+        del Simulation.activeEVs[ev.myID]
+        del Simulation.activeOrder[bisect.bisect_left(Simulation.activeOrder, ev.mySeq, key=bySeq)]
+
+    @classmethod
+    def retireEV(cls, ev):
+        """an EV that can't request charge again, so stop updating it"""
+        Simulation.deactivateEV(ev)
+        Simulation.retiredEVs[ev.myID] = ev
+
     def setMaxEvs(self, pmaxEVs):
         """set a limit to the number of EVs we handle - default is no limit"""
         Simulation.maxEVs = pmaxEVs
+
+    @classmethod
+    def waitForDrone(cls, ev):
+        """an EV has requested charge but has no drone yet - there's nothing to update until the control centre allocates one"""
+        Simulation.deactivateEV(ev)
+        Simulation.waitingEVs[ev.myID] = ev
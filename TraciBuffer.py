@@ -0,0 +1,82 @@
+"""Write behind buffer for the TraCI set calls made during a simulation step"""
+import traci
+
+from TraciCache import TraciCache
+
+
+class TraciBuffer:
+    """Static class collecting the TraCI set calls made during Simulation.step() - overwritten values and
+        values that SUMO already has are dropped, the rest are flushed just before traci.simulationStep()"""
+    buffering = False   # when False set calls go straight to SUMO
+
+    pending = {}        # objectID -> {(setter, key): (args, whether to remember)}, kept in the order first set
+    written = {}        # objectID -> {(setter, key): last args flushed} - only for values that SUMO doesn't change itself
+
+    writes = 0          # count of set calls made by the model
+    flushed = 0         # count of set calls actually sent to SUMO
+
+    @staticmethod
+    def discard(objectID):
+        """forget pending and written values for an object that has gone - ie a removed or arrived vehicle"""
+        TraciBuffer.pending.pop(objectID, None)
+        TraciBuffer.written.pop(objectID, None)
+        TraciCache.forget(objectID)
+
+    @staticmethod
+    def flush():
+        """send the pending set calls to SUMO - called just before traci.simulationStep()"""
+        for objectID, calls in TraciBuffer.pending.items():
+            for (setter, key), (args, remember) in calls.items():
+                setter(objectID, *args)
+                if remember:
+                    TraciBuffer.written.setdefault(objectID, {})[setter, key] = args
+            TraciBuffer.flushed += len(calls)
+        TraciBuffer.pending.clear()
+
+    @staticmethod
+    def poiSetColor(poiID, colour):
+        """buffered traci.poi.setColor"""
+        TraciBuffer.set(traci.poi.setColor, poiID, None, (colour,), True)
+
+    @staticmethod
+    def poiSetParameter(poiID, key, value):
+        """buffered traci.poi.setParameter"""
+        TraciBuffer.set(traci.poi.setParameter, poiID, key, (key, value), True)
+
+    @staticmethod
+    def poiSetPosition(poiID, x, y):
+        """buffered traci.poi.setPosition"""
+        TraciBuffer.set(traci.poi.setPosition, poiID, None, (x, y), True)
+
+    @staticmethod
+    def set(setter, objectID, key, args, remember):
+        """buffer a set call, or make it now if we're not buffering
+            remember is False for values that SUMO changes itself - so we can't tell whether it's redundant"""
+        TraciBuffer.writes += 1
+        if not TraciBuffer.buffering:
+            TraciCache.forget(objectID)     # anything we've read may have changed
+            setter(objectID, *args)
+            TraciBuffer.flushed += 1
+            return
+        calls = TraciBuffer.pending.setdefault(objectID, {})
+        if remember and (setter, key) not in calls and TraciBuffer.written.get(objectID, {}).get((setter, key)) == args:
+            return          # SUMO already has this value
+        calls[setter, key] = args, remember
+
+    @staticmethod
+    def vehicleGetParameter(vehID, key):
+        """traci.vehicle.getParameter that sees a value still waiting to be flushed - otherwise read through the cache"""
+        pending = TraciBuffer.pending.get(vehID, {}).get((traci.vehicle.setParameter, key))
+        if pending is not None:
+            return str(pending[0][1])
+        return TraciCache.vehicleGetParameter(vehID, key)
+
+    @staticmethod
+    def vehicleSetColor(vehID, colour):
+        """buffered traci.vehicle.setColor"""
+        TraciBuffer.set(traci.vehicle.setColor, vehID, None, (colour,), True)
+
+    @staticmethod
+    def vehicleSetParameter(vehID, key, value):
+        """buffered traci.vehicle.setParameter - not remembered as SUMO changes battery values itself"""
+        TraciBuffer.set(traci.vehicle.setParameter, vehID, key, (key, value), False)
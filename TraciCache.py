@@ -0,0 +1,59 @@
+"""Read through cache for the TraCI get calls made during a simulation step"""
+import traci
+
+
+class TraciCache:
+    """Static class remembering the values read from SUMO in the current step - SUMO only changes them when the
+        simulation moves on, so the cache is cleared after traci.executeMove() and whenever we set a value on the object"""
+    caching = False     # when False get calls go straight to SUMO
+
+    values = {}         # objectID -> {(getter, key): value} read since the vehicles last moved
+
+    reads = {}          # getter name -> count of reads asked for while caching
+    hits = {}           # getter name -> count of reads answered from the cache
+
+    @staticmethod
+    def clear():
+        """forget every value - called when the vehicles have moved"""
+        TraciCache.values.clear()
+
+    @staticmethod
+    def forget(objectID):
+        """forget the values for an object - it's been changed by a set call or has gone"""
+        TraciCache.values.pop(objectID, None)
+
+    @staticmethod
+    def get(getter, objectID, key=None, *args):
+        """the value from getter(objectID, *args) - from the cache if we've read it this step
+            key distinguishes getters that take arguments, eg parameter names"""
+        if not TraciCache.caching:
+            return getter(objectID, *args)
+        name = getter.__self__._name + "." + getter.__name__    # eg vehicle.getPosition
+        TraciCache.reads[name] = TraciCache.reads.get(name, 0) + 1
+        cached = TraciCache.values.setdefault(objectID, {})
+        if (getter, key) in cached:
+            TraciCache.hits[name] = TraciCache.hits.get(name, 0) + 1
+            return cached[getter, key]
+        value = getter(objectID, *args)
+        cached[getter, key] = value
+        return value
+
+    @staticmethod
+    def vehicleGetLaneID(vehID):
+        """cached traci.vehicle.getLaneID"""
+        return TraciCache.get(traci.vehicle.getLaneID, vehID)
+
+    @staticmethod
+    def vehicleGetLanePosition(vehID):
+        """cached traci.vehicle.getLanePosition"""
+        return TraciCache.get(traci.vehicle.getLanePosition, vehID)
+
+    @staticmethod
+    def vehicleGetParameter(vehID, key):
+        """cached traci.vehicle.getParameter - use TraciBuffer.vehicleGetParameter to see values waiting to be flushed"""
+        return TraciCache.get(traci.vehicle.getParameter, vehID, key, key)
+
+    @staticmethod
+    def vehicleGetPosition(vehID):
+        """cached traci.vehicle.getPosition"""
+        return TraciCache.get(traci.vehicle.getPosition, vehID)
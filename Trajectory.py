@@ -0,0 +1,136 @@
+"""Columnar binary store for the drone log - written instead of the -o text, read back by memory mapping"""
+import json
+import os
+try:
+    import numpy as np
+except ImportError:     # numpy is only needed for trajectory stores
+    np = None
+
+
+class Trajectory:
+    """Drone log records held as one binary file per column in a directory, plus meta.json describing them.
+        Takes the same log() calls as a LogSink - the text columns are dictionary encoded, so every column is fixed width,
+        and at close the rows of each drone and each EV are indexed so a reader can slice them out directly"""
+    # the drone log columns, in the order Drone.logLine logs them - text columns are stored as codes into their vocabulary
+    columns = (("timeStep", "int32"), ("drone", "text"), ("ev", "text"), ("lane", "text"), ("lanePosition", "float64"),
+               ("x", "float64"), ("y", "float64"), ("droneWh", "float64"), ("chargeWh", "float64"), ("flyingWh", "float64"),
+               ("activity", "text"))
+    indexed = ("drone", "ev")   # columns we index the rows of
+    chunkRows = 65536           # rows held in memory before they're appended to the column files
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.rows = 0
+        self.count = 0
+        self.chunk = [[] for c in Trajectory.columns]
+        self.vocabularies = {name: {} for name, kind in Trajectory.columns if kind == "text"}   # text -> code, in order of first appearance
+        self.files = {name: open(self.columnFile(path, name), "wb") for name, kind in Trajectory.columns}
+
+    @staticmethod
+    def columnFile(path, name):
+        """the file holding a column"""
+        return os.path.join(path, name + ".bin")
+
+    @staticmethod
+    def dtype(kind):
+        """numpy type a column is stored as - text is stored as its code"""
+        return "int32" if kind == "text" else kind
+
+    def close(self):
+        """append the last chunk, index the rows and write meta.json"""
+        self.flush()
+        for file in self.files.values():
+            file.close()
+
+        indexes = {}
+        for name in Trajectory.indexed:
+            codes = np.fromfile(self.columnFile(self.path, name), dtype="int32")
+            order = np.argsort(codes, kind="stable").astype("int64")     # rows of each code, in time order
+            order.tofile(os.path.join(self.path, name + ".index.bin"))
+            indexes[name] = np.searchsorted(codes[order], np.arange(len(self.vocabularies[name]) + 1)).tolist()
+
+        meta = {"rows": self.rows,
+                "columns": [{"name": name, "kind": kind, "dtype": Trajectory.dtype(kind)} for name, kind in Trajectory.columns],
+                "vocabularies": {name: list(vocabulary) for name, vocabulary in self.vocabularies.items()},
+                "indexes": indexes}
+        with open(os.path.join(self.path, "meta.json"), "w") as file:
+            json.dump(meta, file)
+
+    def flush(self):
+        """append the rows held in memory to the column files"""
+        if not self.chunk[0]:
+            return
+        for (name, kind), values in zip(Trajectory.columns, self.chunk):
+            np.asarray(values, dtype=Trajectory.dtype(kind)).tofile(self.files[name])
+            values.clear()
+
+    def log(self, format, *values):
+        """add a drone log record - the format is only used for text logs, records without values (the title line) are dropped"""
+        self.count += 1
+        if len(values) != len(Trajectory.columns):
+            return
+        for (name, kind), column, value in zip(Trajectory.columns, self.chunk, values):
+            if kind == "text":
+                vocabulary = self.vocabularies[name]
+                value = vocabulary.setdefault(value, len(vocabulary))
+            column.append(value)
+        self.rows += 1
+        if len(self.chunk[0]) >= Trajectory.chunkRows:
+            self.flush()
+
+
+class TrajectoryReader:
+    """A finished trajectory store, memory mapped - columns are numpy arrays, text columns decoded on request"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as file:
+            self.meta = json.load(file)
+        self.rows = self.meta["rows"]
+        self.kinds = {column["name"]: column["kind"] for column in self.meta["columns"]}
+        self.columns = {}
+        for column in self.meta["columns"]:
+            if self.rows > 0:
+                self.columns[column["name"]] = np.memmap(Trajectory.columnFile(path, column["name"]), dtype=column["dtype"], mode="r", shape=(self.rows,))
+            else:
+                self.columns[column["name"]] = np.empty(0, dtype=column["dtype"])
+        self.vocabularies = self.meta["vocabularies"]
+        self.codes = {name: {text: code for code, text in enumerate(vocabulary)} for name, vocabulary in self.vocabularies.items()}
+        self.indexes = {}
+
+    def decode(self, name, codes):
+        """the text for codes from a text column"""
+        vocabulary = self.vocabularies[name]
+        return [vocabulary[code] for code in codes]
+
+    def drone(self, droneID):
+        """the rows logged for a drone - column name -> array"""
+        return self.slice("drone", droneID)
+
+    def droneIDs(self):
+        """the drones in the store"""
+        return list(self.vocabularies["drone"])
+
+    def ev(self, evID):
+        """the rows logged while a drone was serving an EV - column name -> array"""
+        return self.slice("ev", evID)
+
+    def evIDs(self):
+        """the EVs in the store"""
+        return [evID for evID in self.vocabularies["ev"] if evID != ""]
+
+    def rowsFor(self, name, text):
+        """the row numbers, in time order, for a value of an indexed column"""
+        code = self.codes[name].get(text)
+        if code is None:
+            return np.empty(0, dtype="int64")
+        if name not in self.indexes:
+            self.indexes[name] = np.memmap(os.path.join(self.path, name + ".index.bin"), dtype="int64", mode="r", shape=(self.rows,))
+        offsets = self.meta["indexes"][name]
+        return self.indexes[name][offsets[code]:offsets[code + 1]]
+
+    def slice(self, name, text):
+        """the rows for a value of an indexed column - column name -> array"""
+        rows = self.rowsFor(name, text)
+        return {column: values[rows] for column, values in self.columns.items()}
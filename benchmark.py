@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Micro benchmarks for parts of the drone model that don't need a running SUMO
+   run as:
+        python benchmark.py [-h] [-n n] [-e n,n..]
+"""
+import argparse
+import copy
+import time
+import tracemalloc
+import types
+
+from DroneType import DroneType
+from Drone import Drone
+from EV import EV
+
+
+class DictShadow:
+    """an object with a per instance dict - what EV and Drone shadows were before they had __slots__"""
+
+
+def poiParams(n):
+    """parameters for n drone POIs as they might appear in an add file - most only override the colour"""
+    palette = [(r, g, 255 - r, 255) for r in range(0, 256, 64) for g in range(0, 256, 64)]
+    params = []
+    for i in range(n):
+        poi = {"droneColour": palette[i % len(palette)]}
+        if i % 10 == 0:
+            poi["droneChargeWh"] = 20000. + 1000. * (i % 50 // 10)
+        if i % 25 == 0:
+            poi["WhDroneRechargeRate"] = 50000
+        params.append(poi)
+    return params
+
+
+def benchmarkDroneTypes(n, stepSecs=1.0):
+    """time creating the drone types for n POIs - per POI deepcopy of a mutable type (the old way) against the registry"""
+    pois = poiParams(n)
+
+    d0 = DroneType.get(stepSecs)
+    mutable = types.SimpleNamespace(**{name: getattr(d0, name) for name in DroneType.__slots__})
+    start = time.perf_counter()
+    copies = []
+    for poi in pois:
+        dt = copy.deepcopy(mutable)
+        for name, value in poi.items():
+            setattr(dt, name, value)
+        dt.droneFlyingWhperTimeStep *= stepSecs     # setDerived
+        dt.minDroneCharge = dt.droneChargeContingencyp * dt.droneChargeWh
+        dt.viableDroneCharge = dt.droneChargeViablep * dt.droneChargeWh
+        copies.append(dt)
+    copySecs = time.perf_counter() - start
+
+    DroneType.registry.clear()
+    start = time.perf_counter()
+    registered = [DroneType.get(stepSecs).replace(**poi) for poi in pois]
+    registrySecs = time.perf_counter() - start
+
+    return {"pois": n, "deepcopySecs": copySecs, "registrySecs": registrySecs,
+            "copies": len({id(dt) for dt in copies}), "types": len({id(dt) for dt in registered})}
+
+
+def shadowValues(cls, i):
+    """representative values for the attributes of an EV or Drone shadow - objects are made without SUMO, so without __init__"""
+    values = {}
+    for name in cls.__slots__:
+        if name == "myID":
+            values[name] = str(i)
+        elif name in ("myPosition", "myRendezvous", "myParkPosition", "myParkEP"):
+            values[name] = (float(i), float(i) + 0.5)
+        elif name == "myColour":
+            values[name] = (255, 255, 255, 255)
+        elif name in ("myState", "myDrone", "myEV", "myDt", "myDummyEVs", "myDormantFrom"):
+            values[name] = None
+        else:
+            values[name] = float(i)
+    return values
+
+
+def benchmarkShadowMemory(cls, n):
+    """tracemalloc peak and bytes per object for n shadows - slotted cls against the same attributes in a dict"""
+    result = {"objects": n}
+    for label, make in (("dict", DictShadow), ("slots", cls.__new__)):
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        shadows = []
+        for i in range(n):
+            shadow = make(cls) if label == "slots" else make()
+            for name, value in shadowValues(cls, i).items():
+                setattr(shadow, name, value)
+            shadows.append(shadow)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result[label + "Peak"] = peak - start
+        result[label + "PerObject"] = (current - start) / n
+        del shadows
+    return result
+
+
+def main():
+    """Run the benchmarks"""
+    parser = argparse.ArgumentParser(description="micro benchmarks for the drone model")
+    parser.add_argument('-n', '--pois', help='no of drone POIs for the DroneType benchmark, default 10000', metavar='n', type=int, default=10000)
+    parser.add_argument('-e', '--evs', help='comma separated nos of simulated EV arrivals for the memory benchmark, default 10000,100000,1000000', metavar='n,n..', default="10000,100000,1000000")
+    args = parser.parse_args()
+
+    r = benchmarkDroneTypes(args.pois)
+    print("DroneType for %i POIs:\tdeepcopy: %.3fs (%i objects)\tregistry: %.3fs (%i types)" %
+          (r["pois"], r["deepcopySecs"], r["copies"], r["registrySecs"], r["types"]))
+
+    for cls, counts in ((EV, args.evs), (Drone, args.evs.split(",")[0])):
+        for n in counts.split(","):
+            r = benchmarkShadowMemory(cls, int(n))
+            print("%s shadows: %i\tdict: peak %.1fMB %.0f bytes/object\tslots: peak %.1fMB %.0f bytes/object" %
+                  (cls.__name__, r["objects"], r["dictPeak"] / 1e6, r["dictPerObject"], r["slotsPeak"] / 1e6, r["slotsPerObject"]))
+
+
+if __name__ == "__main__":
+    main()
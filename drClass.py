@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 """Module initiating SUMO Traci code implementing Drone based charging of EVs in motion"""
+import contextlib
+import io
 import os
 import sys
 
@@ -8,13 +10,25 @@ from ChargeHubs import ChargeHubs
 from ControlCentre import ControlCentre
 from Simulation import Simulation
 from Drone import Drone
+import DroneFleet
+from DummyEVPool import DummyEVPool
+from TraciBuffer import TraciBuffer
+from TraciCache import TraciCache
+from LogSink import LogSink
+from IntervalStats import IntervalStats
+from Metrics import Metrics
+import RunSummary
+from Profiler import Profiler
+from ResultCache import ResultCache
+from Checkpoint import Checkpoint
+import Trajectory
 
 """
     sample traci code - using a POI to represent a drone able to fly outside the network and track specific vehicles
                             network needs charging stations to launch and recharge drones
    run as:
         python drclass.py [-h] [-v] [-b] [-c filePath] [-d n] [-e n] [-f n] [-k n] [-l] [-m] [-o filePath] [-p metres] [-r n] [-s sumo.exe] 
-            [-t ehang184] [-u] [-we n.n] [-wu n.n] [-z]
+            [-t ehang184] [-u] [-we n.n] [-wu n.n] [-z] [--poiSync n] [--fleet] [--bufferWrites] [--dummyPool] [--schedule] [--cacheReads] [--contextSubscribe] [--controlPeriod n] [--logThread] [--trajectory dir] [--intervalStats filePath] [--statsInterval n] [--metricsPort n] [--summaryFile filePath] [--profile dir] [--profileSample] [--memorySnapshots n] [--resultCache db] [--checkpoint dir] [--checkpointAt s] [--restore dir]
                   sumocfg
 
    This program is made available under the terms of the Eclipse Public License 2.0 which is available at https://www.eclipse.org/legal/epl-2.0/
@@ -44,6 +58,7 @@ class drClass:
 
     sumoCmd = None      # The sumo runstring
     runstring = None    # the drClass.py runstring
+    finished = False    # whether the loop ran to the end of the simulation - only finished runs go in the result cache
 
     def __ini__(self):
         """Check whether we have access to sumo and parse runstring"""
@@ -59,9 +74,18 @@ class drClass:
         version = self.getVersion()
         if GG.cc is not None:
             GG.cc.tidyDrones()
-            GG.cc.printDroneStatistics(drClass.briefStatistics, version, self.runstring)
+            IntervalStats.close(GG.ss.timeStep, GG.ss.now, len(GG.cc.requests), GG.cc.droneStateCounts)
+            if ResultCache.key is not None and self.finished:      # keep a copy of the summary for the cache
+                summary = io.StringIO()
+                with contextlib.redirect_stdout(summary):
+                    GG.cc.printDroneStatistics(drClass.briefStatistics, version, self.runstring)
+                print(summary.getvalue(), end="")
+                ResultCache.store(self.runstring, summary.getvalue(), GG.cc.runRecord)
+            else:
+                GG.cc.printDroneStatistics(drClass.briefStatistics, version, self.runstring)
 
         # tidy up
+        Metrics.stop()
         if GG.dronePrint:
             GG.droneLog.close()
         if GG.chargePrint:
@@ -69,8 +93,12 @@ class drClass:
 
     def loop(self):
         """main simulation loop"""
-        while GG.ss.step():
-            pass
+        if Profiler.path is not None:
+            Profiler.run(GG.ss.step)
+        else:
+            while GG.ss.step():
+                pass
+        self.finished = True
 
     def parseRunstring(self, parser=None, argparse=None):
         """use argparse to parse runstring and set our variables"""
@@ -80,7 +108,7 @@ class drClass:
         parser.add_argument('sumocfg', help='sumo configuration file')            # mandatory - sumo configuration
 
         parser.add_argument('-b', '--brief', help='output a single line statistics summary, default full summary', action='store_const', default='False')
-        parser.add_argument('-c', '--chargeFile', help='file for output of detailed EV charge levels beginning/end of charge, default no output', metavar='filePath', type=argparse.FileType('a'))
+        parser.add_argument('-c', '--chargeFile', help='file for output of detailed EV charge levels beginning/end of charge, default no output', metavar='filePath')
         parser.add_argument('-d', '--maxDrones', help='maximum drones to spawn, default is 6', metavar='n', type=int, default=6)
         parser.add_argument('-e', '--maxEVs', help='maximum EVs that are allowed to charge by Drone, default is no limit', metavar='n', type=int, default=sys.maxsize)
         parser.add_argument('-f', '--fullChargeTolerance', help='tolerance (s) use > 0 ensure only full charges', metavar='n', type=int, default=0)
@@ -88,7 +116,7 @@ class drClass:
         parser.add_argument('-k', '--droneKmPerHr', help='drone speed Km/h', metavar='n', type=float, default=60.0)
         parser.add_argument('-l', '--lineOfSight', help='route drone to EV by line of sight at each step, default is to compute a rendezvous point\n', action='store_const', default='True')
         parser.add_argument('-m', '--multipleCharge', help='Allow EVs to be charged more than once - default is only once', action='store_const', default='True')
-        parser.add_argument('-o', '--outputFile', help='file for output of detailed drone charge levels for each step, default no output', metavar='filePath', type=argparse.FileType('a'))
+        parser.add_argument('-o', '--outputFile', help='file for output of detailed drone charge levels for each step, default no output', metavar='filePath')
         parser.add_argument('-p', '--proximityRadius', help='proximity radius to scan for vehicles needing charge, default 1000', metavar='metres', type=float, default=1000)
         parser.add_argument('-r', '--randomSeed', help='seed for random generator triggering requests and sizeof requests', metavar='n', type=int, default=0)
         parser.add_argument('-s', '--sumoBinary', help='sumo binary to execute against configuration, default is sumo-gui.exe', metavar='sumo.exe', default="sumo-gui.exe")
@@ -97,9 +125,38 @@ class drClass:
         parser.add_argument('-we', '--wEnergy','--we', help='weighting to apply to vehicles found in radius, default 1', metavar='n.n', type=float, default=1.0)
         parser.add_argument('-wu', '--wUrgency','--wu', help='weighting to apply to nearest vehicle urgency, default 0', metavar='n.n', type=float, default=0.0)
         parser.add_argument('-z', '--zeroDrone', '--z', help='Only use drones defined in the ...add.xml file', action='store_const', default='True')
+        parser.add_argument('--poiSync', help='with sumo (not sumo-gui) move drone POIs every n steps, 0 only at state changes, -1 never, default 1', metavar='n', type=int, default=1)
+        parser.add_argument('--fleet', help='hold drones in numpy arrays and move them in one vectorised update, default is to update each drone', action='store_const', default='True')
+        parser.add_argument('--bufferWrites', help='buffer TraCI set calls and send them once per step, dropping overwritten or unchanged values, default is to send each call', action='store_const', default='True')
+        parser.add_argument('--dummyPool', help='with chargingstations-output keep dummy EVs for drone batteries parked at each hub, off the charging station while idle, and move them on for arriving drones setting only their batteries, default is to add/remove them for each drone visit', action='store_const', default='True')
+        parser.add_argument('--cacheReads', help='remember TraCI get calls made in a step so repeated reads are answered locally, default is to read from SUMO each time', action='store_const', default='True')
+        parser.add_argument('--contextSubscribe', help='find requesting EVs near each other with SUMO context subscriptions (positions one step old), default is to read positions and filter in python', action='store_const', default='True')
+        parser.add_argument('--controlPeriod', help='allocate drones to EVs requesting charge every n steps, drones and EVs are still updated every step, default 1', metavar='n', type=int, default=1)
+        parser.add_argument('--logThread', help='format and write the -o/-c logs in a background thread, default is to write them as the simulation runs. Logs named .gz or .zst are compressed', action='store_const', default='True')
+        parser.add_argument('--trajectory', help='write the drone log as a columnar binary store in dir (needs numpy), instead of -o text', metavar='dir')
+        parser.add_argument('--intervalStats', help='file for rolling statistics (pending requests, drones free/busy/charging, allocations, break offs, Wh) written every --statsInterval seconds, CSV if named .csv otherwise JSON lines, default no output', metavar='filePath')
+        parser.add_argument('--statsInterval', help='simulated seconds in each --intervalStats window, default 300', metavar='n', type=float, default=300.0)
+        parser.add_argument('--metricsPort', help='serve live metrics (Prometheus text format) on http://127.0.0.1:n/metrics while the simulation runs, default no server', metavar='n', type=int, default=0)
+        parser.add_argument('--summaryFile', help='append the run summary as a JSON line to filePath, or if filePath ends .parquet add it to that Parquet dataset directory (needs pyarrow), default no output', metavar='filePath')
+        parser.add_argument('--profile', help='run the simulation loop under cProfile, writing profile.pstats and profile.txt to dir, default no profiling', metavar='dir')
+        parser.add_argument('--profileSample', help='with --profile sample the stack instead of using cProfile, writing stacks.collapsed for flame graphs', action='store_const', default='True')
+        parser.add_argument('--memorySnapshots', help='with --profile write the allocations that grew most to memory.txt every n steps (tracemalloc), default 0 no snapshots', metavar='n', type=int, default=0)
+        parser.add_argument('--resultCache', help='SQLite database of finished run summaries - a run whose options, scenario files and code match a stored run prints the stored summary (and adds its record to --summaryFile, marked cacheHit) instead of running, unless it writes -o, -c, --trajectory, --intervalStats, --profile or --checkpoint output. Default no cache', metavar='db')
+        parser.add_argument('--checkpoint', help='write a checkpoint (SUMO state and a snapshot of the control centre, EVs, drones and random state) to dir after --checkpointAt simulated seconds, default no checkpoint', metavar='dir')
+        parser.add_argument('--checkpointAt', help='simulated seconds at which --checkpoint is written', metavar='s', type=float, default=0.0)
+        parser.add_argument('--restore', help='start from the checkpoint in dir, with the options of this run - --fleet and --dummyPool must be as they were for the checkpoint, default start from the beginning', metavar='dir')
+        parser.add_argument('--schedule', help='only step drones at, or flying to, a hub near their next state change, default is to step every drone every step. Not with -o, --fleet or sumo-gui', action='store_const', default='True')
 
         # and parse what we actually got
         args = parser.parse_args()
+        if args.logThread:
+            LogSink.threaded = False
+        else:
+            LogSink.threaded = True
+        for logFile in (args.outputFile, args.chargeFile, args.intervalStats):
+            if logFile and not LogSink.canWrite(logFile):
+                print(" .zst logs need zstandard, which is not installed")
+                sys.exit(1)
         if args.lineOfSight:                   # has the default value of True
             modelRendezvous = True
         else:                                  # unless the flag is in the runstring when it's 'None'
@@ -109,14 +166,13 @@ class drClass:
         else:                                  # unless the flag is in the runstring when it's 'None'
             onlyChargeOnce = False
 
-        if args.outputFile:
-            droneLog = args.outputFile
-        else:
-            droneLog = None
-        if args.chargeFile:
-            chargeLog = args.chargeFile
-        else:
-            chargeLog = None
+        if args.trajectory:
+            if args.outputFile:
+                print(" use either -o or --trajectory for the drone log")
+                sys.exit(1)
+            if Trajectory.np is None:
+                print(" --trajectory needs numpy, which is not installed")
+                sys.exit(1)
 
         if args.brief:
             drClass.briefStatistics = False
@@ -133,36 +189,144 @@ class drClass:
         else:
             useOneBattery = True
 
+        if args.fleet:
+            fleet = None
+        elif DroneFleet.np is None:
+            print(" --fleet needs numpy, which is not installed")
+            sys.exit(1)
+        else:
+            fleet = DroneFleet.DroneFleet()
+
+        if args.bufferWrites:
+            TraciBuffer.buffering = False
+        else:
+            TraciBuffer.buffering = True
+
+        if args.dummyPool:
+            DummyEVPool.pooling = False
+        else:
+            DummyEVPool.pooling = True
+
+        if args.contextSubscribe:
+            ControlCentre.contextSubscribing = False
+        else:
+            ControlCentre.contextSubscribing = True
+
+        if args.controlPeriod < 1:
+            print(" --controlPeriod must be at least 1")
+            sys.exit(1)
+        ControlCentre.controlPeriod = args.controlPeriod
+
+        if args.statsInterval <= 0:
+            print(" --statsInterval must be more than 0")
+            sys.exit(1)
+
+        if args.summaryFile:
+            if RunSummary.RunSummary.isParquet(args.summaryFile) and RunSummary.pa is None:
+                print(" --summaryFile .parquet needs pyarrow, which is not installed")
+                sys.exit(1)
+            RunSummary.RunSummary.path = args.summaryFile
+
+        if args.profile:
+            Profiler.path = args.profile
+            if args.profileSample:
+                Profiler.sampling = False
+            else:
+                Profiler.sampling = True
+            Profiler.memorySteps = max(0, args.memorySnapshots)
+        elif not args.profileSample or args.memorySnapshots:
+            print(" --profileSample and --memorySnapshots need --profile dir")
+            sys.exit(1)
+
+        if args.checkpoint:
+            if args.checkpointAt <= 0:
+                print(" --checkpoint needs --checkpointAt seconds, more than 0")
+                sys.exit(1)
+            Checkpoint.path = args.checkpoint
+        elif args.checkpointAt:
+            print(" --checkpointAt needs --checkpoint dir")
+            sys.exit(1)
+
+        if args.restore:
+            Checkpoint.load(args.restore, fleet)
+
+        if args.metricsPort:        # before SUMO starts, so a port in use fails early
+            Metrics.start(args.metricsPort)
+
+        if args.cacheReads:
+            TraciCache.caching = False
+        else:
+            TraciCache.caching = True
 
         # maximum no of EVs that can be charged by Drones
         maxEVs = args.maxEVs
         randomSeed = args.randomSeed
         droneKmPerHr = args.droneKmPerHr
 
+        if args.resultCache:
+            ResultCache.path = args.resultCache
+            ResultCache.makeKey(vars(args), args.sumocfg, self.getVersion())
+            stored = ResultCache.lookup()
+            writesFiles = args.outputFile or args.chargeFile or args.trajectory or args.intervalStats or args.profile or args.checkpoint
+            if stored is not None and not writesFiles and (stored[1] is not None or not args.summaryFile):
+                print(" result cache hit %s - not re-running" % ResultCache.key[:12], file=sys.stderr)
+                print(stored[0], end="")
+                if args.summaryFile:        # the stored run wrote this record already - mark the copy so a sweep can tell them apart
+                    RunSummary.RunSummary.write(dict(stored[1], cacheHit=True))
+                sys.exit(0)
+
+        # the options are good - only now open the logs, so a runstring we reject doesn't leave empty or partial logs behind
+        droneLog = chargeLog = statsLog = None
+        try:
+            if args.trajectory:
+                droneLog = Trajectory.Trajectory(args.trajectory)
+            elif args.outputFile:
+                droneLog = LogSink(args.outputFile)
+            if args.chargeFile:
+                chargeLog = LogSink(args.chargeFile)
+            if args.intervalStats:
+                statsLog = LogSink(args.intervalStats)
+        except OSError as e:
+            print(" cannot open log:", e)
+            sys.exit(1)
+
         # create sumo runstring
         sumoBinary = os.environ['SUMO_HOME'] + '/bin/' + args.sumoBinary
         drClass.sumoCmd = [sumoBinary, "-c", args.sumocfg]
+        if args.checkpoint:
+            drClass.sumoCmd.append("--save-state.rng")     # so runs restored from the checkpoint see the same traffic
 
         # create our management objects plus ChargeHubs - which is essentially static
         ss = Simulation(drClass.sumoCmd, maxEVs)
+        Checkpoint.atStep = round(args.checkpointAt / ss.stepSecs)
         ch = ChargeHubs()
         cc = ControlCentre(args.wEnergy, args.wUrgency, args.proximityRadius, args.maxDrones, args.fullChargeTolerance, args.globalCharge)
 
         # setup the global references to these objects
-        gg = GG(cc, ss, ch)
+        gg = GG(cc, ss, ch, fleet)
         gg.setGlobals(droneKmPerHr, randomSeed, droneLog, chargeLog, onlyChargeOnce, modelRendezvous)
 
+        if statsLog is not None:
+            IntervalStats.start(statsLog, args.statsInterval, ss.stepSecs)
+
         Drone.setDroneType(useOneBattery, args.droneType)
+        Drone.setPOISync(args.poiSync)
+        if args.schedule:
+            Drone.setScheduling(False)
+        else:
+            Drone.setScheduling(True)
         if args.droneType != "ehang184x":
             poiDrones = Drone.setDroneTypeFromPOI(useOneBattery, zeroDrone)
         if zeroDrone and (poiDrones > 0):
             cc.setMaxDrones(poiDrones)
+        if args.restore:
+            Checkpoint.restore(cc, Simulation)
 
-        # any output file would have been opened in parse_args() - write out the title line if needed
+        # write out the title line of any log opened above
         if gg.dronePrint:
-            print("timeStep\tDrone\tEV\tLane\tPosition\tdrone x\tdrone y\tdroneWh\tchargeWh\tflyingWh\tactivity", file=droneLog)
+            droneLog.log("timeStep\tDrone\tEV\tLane\tPosition\tdrone x\tdrone y\tdroneWh\tchargeWh\tflyingWh\tactivity")
         if gg.chargePrint:
-            print("timeStep\tEV id\tEV State\tDrone\tCapacity\tCharge Wh(if any)\tRequested Charge Wh", file=chargeLog)
+            chargeLog.log("timeStep\tEV id\tEV State\tDrone\tCapacity\tCharge Wh(if any)\tRequested Charge Wh")
 
         return gg
 
@@ -188,8 +352,6 @@ class drClass:
 def main():
     """Instantiate!"""
     import argparse    # here because pdoc gets upset if its in the stamdard position at the top of the file
-    # import tracemalloc
-    # tracemalloc.start()
 
     runstring = ""                 # runstring to be used in print output
     for runArg in sys.argv:
@@ -204,11 +366,6 @@ def main():
 
     session.loop()
 
-    # snapshot = tracemalloc.take_snapshot()
-    # top_stats = snapshot.statistics('lineno')
-    # for stat in top_stats[:10]:
-    # print(stat)
-
     del session, gg
 
 
@@ -0,0 +1,5 @@
+"""the modules are at the top of the repo - make them importable from the tests"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
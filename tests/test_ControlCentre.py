@@ -0,0 +1,58 @@
+"""ControlCentre checks that don't need a running SUMO - the TraCI calls made are replaced with answers from the test's positions"""
+import math
+import types
+
+import pytest
+import traci
+import traci.constants as tc
+
+from GlobalClasses import GlobalClasses as GG
+from ControlCentre import ControlCentre
+from EV import EV
+
+RADIUS = 1000.0
+# the first EV is the one we search around - two of the others are outside the radius, the last isn't requesting charge
+POSITIONS = [(0.0, 0.0), (100.0, 0.0), (0.0, 250.0), (-300.0, -400.0), (700.0, 700.0), (1500.0, 0.0), (0.0, 1200.0), (50.0, 50.0)]
+
+
+def makeEV(vehID, position):
+    """an EV shadow made without SUMO, so without __init__"""
+    ev = EV.__new__(EV)
+    ev.myID = vehID
+    ev.myPosition = position
+    return ev
+
+
+@pytest.fixture
+def cc(monkeypatch):
+    """a control centre with requests from all but the last EV and the context subscription results SUMO would return"""
+    evs = {"ev%i" % i: makeEV("ev%i" % i, position) for i, position in enumerate(POSITIONS)}
+    monkeypatch.setattr(GG, "ss", types.SimpleNamespace(EVs=evs), raising=False)
+
+    def contextResults(vehID):
+        """vehicles within the radius of vehID, including itself, as SUMO returns them"""
+        centre = evs[vehID].myPosition
+        return {nID: {tc.VAR_POSITION: nEV.myPosition} for nID, nEV in evs.items() if math.dist(centre, nEV.myPosition) <= RADIUS}
+    monkeypatch.setattr(traci.vehicle, "getContextSubscriptionResults", contextResults)
+
+    cc = ControlCentre(1.0, 1.0, RADIUS, 1)
+    for ev in list(evs.values())[:-1]:
+        cc.requests[ev] = None
+    return cc
+
+
+@pytest.mark.parametrize("firstCall", [False, True])
+def test_context_neighbours_match_python(cc, monkeypatch, firstCall):
+    """the context subscription search finds the same neighbours, at the same mean distance, as the python search"""
+    monkeypatch.setattr(ControlCentre, "contextSubscribing", False)
+    monkeypatch.setattr(EV, "setMyPosition", lambda ev: None)    # positions are already set
+    ev = GG.ss.EVs["ev0"]
+    pyNeighbours, pyMean = cc.getNeighboursNeedingCharge(ev, firstCall)
+    monkeypatch.setattr(ControlCentre, "contextSubscribing", True)
+    ctxNeighbours, ctxMean = cc.getNeighboursNeedingCharge(ev, firstCall)
+
+    assert [nEV.getID() for nEV in pyNeighbours] == ["ev1", "ev2", "ev3", "ev4"]
+    assert sorted(ctxNeighbours, key=EV.getID) == pyNeighbours
+    expected = sum(math.dist(ev.myPosition, nEV.myPosition) for nEV in pyNeighbours) / 4
+    assert pyMean == pytest.approx(expected)
+    assert ctxMean == pytest.approx(pyMean)
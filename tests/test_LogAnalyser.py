@@ -0,0 +1,25 @@
+"""LogAnalyser checks on small charge logs written in the test"""
+import io
+
+from LogAnalyser import analyseChargeLog
+
+
+def chargeLog(rows):
+    """a charge log, without its title line, as analyseChargeLog reads it"""
+    return io.StringIO("".join("\t".join(str(field) for field in row) + "\n" for row in rows))
+
+
+def test_evs_counted_once_across_sessions():
+    """an EV charging twice is one EV, as is one that only leaves - sessions still close on each outcome"""
+    rows = [(10, "ev1", "<EVState.CHARGEREQUESTED: 2>", "", 5000.0, 0.0, 20000.0),
+            (20, "ev1", "<EVState.CHARGINGFROMDRONE: 5>", "d1", 5000.0, 0.0),
+            (30, "ev1", "<EVState.DRIVING: 1>", "d1", 25000.0, 20000.0),
+            (40, "ev1", "<EVState.CHARGEREQUESTED: 2>", "", 5000.0, 0.0, 20000.0),
+            (50, "ev1", "<EVState.CHARGINGFROMDRONE: 5>", "d1", 5000.0, 0.0),
+            (60, "ev1", "<EVState.LEFTSIMULATION: 7>", "d1", 15000.0, 10000.0),
+            (70, "ev2", "<EVState.LEFTSIMULATION: 7>", "-", 30000.0, 0.0)]
+    result = analyseChargeLog(chargeLog(rows))
+    assert result["evs"] == 2
+    assert result["sessions"] == {"full": 1, "brokenDrone": 0, "brokenEV": 1, "reRequests": 0}
+    assert result["chargeWh"] == 30000.0
+    assert result["latencies"] == 2
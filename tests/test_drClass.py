@@ -0,0 +1,53 @@
+"""drClass runstring checks that end before SUMO would be started"""
+import argparse
+import json
+import sys
+
+import pytest
+
+import RunSummary
+from ResultCache import ResultCache
+from drClass import drClass
+
+RECORD = {"timeStamp": "2026-01-01T00:00:00", "runstring": "drClass.py demo.sumocfg", "cacheHit": False, "totals": {"evs": 100}}
+
+
+def parse(monkeypatch, *runArgs):
+    """parse a runstring as main() does"""
+    monkeypatch.setattr(sys, "argv", ["drClass.py"] + list(runArgs))
+    return drClass().parseRunstring(argparse.ArgumentParser(), argparse)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """a result cache holding RECORD for the run - whatever its options, as the key is fixed"""
+    monkeypatch.setattr(ResultCache, "path", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(ResultCache, "key", "k" * 64)
+    monkeypatch.setattr(ResultCache, "makeKey", staticmethod(lambda options, sumocfg, version: ResultCache.key))
+    monkeypatch.setattr(RunSummary.RunSummary, "path", None)
+    ResultCache.store("drClass.py demo.sumocfg", "stored summary\n", RECORD)
+    return ResultCache.path
+
+
+def test_cache_hit_summary_record_marked(cache, tmp_path, monkeypatch, capsys):
+    """a cache hit prints the stored summary and adds the stored record, marked as a cache hit, to the summary file"""
+    summaryFile = tmp_path / "summary.jsonl"
+    for hit in range(2):
+        with pytest.raises(SystemExit) as raised:
+            parse(monkeypatch, "--resultCache", cache, "--summaryFile", str(summaryFile), "demo.sumocfg")
+        assert raised.value.code == 0
+        assert capsys.readouterr().out == "stored summary\n"
+
+    records = [json.loads(line) for line in summaryFile.read_text().splitlines()]
+    assert records == [dict(RECORD, cacheHit=True)] * 2
+
+
+@pytest.mark.parametrize("rejected", [["--controlPeriod", "0"], ["--summaryFile", "summary.parquet"], ["--checkpointAt", "60"]])
+def test_rejected_runstring_opens_no_logs(tmp_path, monkeypatch, rejected):
+    """options are checked before any log is opened, so a rejected runstring leaves no empty logs or trajectory directory"""
+    monkeypatch.setattr(RunSummary, "pa", None)        # as if pyarrow wasn't installed
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(SystemExit) as raised:
+        parse(monkeypatch, "-c", "charge.txt.gz", "--intervalStats", "stats.csv", "--trajectory", "trajectory", *rejected, "demo.sumocfg")
+    assert raised.value.code == 1
+    assert list(tmp_path.iterdir()) == []